@@ -0,0 +1,274 @@
+"""
+Stand-in for the parts of the hou module cnwpose uses, so the library can be
+imported and timed outside Houdini.
+
+Parms hold real keyframe lists and evaluate them by linear interpolation,
+the playbar reports a fixed frame range and channel list, and the viewwrite
+hscript command renders a small synthetic image per frame with Pillow. Times
+follow Houdini's convention of frame 1 at time 0.
+"""
+
+import contextlib
+import os
+import re
+import sys
+import types
+
+import numpy as np
+
+
+class Keyframe(object):
+    def __init__(self, value=None, time=None):
+        self._data = {}
+        if value is not None:
+            self._data['value'] = float(value)
+        if time is not None:
+            self._data['time'] = float(time)
+
+    def fromJSON(self, data):
+        self._data = dict(data)
+
+    def asJSON(self):
+        return dict(self._data)
+
+    def time(self):
+        return self._data.get('time', 0.0)
+
+    def setTime(self, time):
+        self._data['time'] = float(time)
+
+    def frame(self):
+        return timeToFrame(self.time())
+
+    def setFrame(self, frame):
+        self.setTime(frameToTime(frame))
+
+    def value(self):
+        return self._data.get('value', 0.0)
+
+    def setValue(self, value):
+        self._data['value'] = float(value)
+
+    def isValueSet(self):
+        return 'value' in self._data
+
+    def expression(self):
+        return self._data.get('expression', '')
+
+
+class Parm(object):
+    def __init__(self, name, node=None):
+        self._name = name
+        self._node = node
+        self._keys = []
+        self._curve = None
+        self.scoped = False
+
+    def name(self):
+        return self._name
+
+    def path(self):
+        prefix = self._node.path() if self._node is not None else ''
+        return f'{prefix}/{self._name}'
+
+    def node(self):
+        return self._node
+
+    def keyframes(self):
+        return tuple(self._keys)
+
+    def setKeyframes(self, keys):
+        for k in keys:
+            self.setKeyframe(k)
+
+    def setKeyframe(self, key):
+        # Copied like hou does, a key set on a parm is not shared with it.
+        k = Keyframe()
+        k.fromJSON(key.asJSON())
+        t = k.time()
+        self._keys = [i for i in self._keys if i.time() != t]
+        self._keys.append(k)
+        self._keys.sort(key=Keyframe.time)
+        self._curve = None
+
+    def deleteAllKeyframes(self):
+        self._keys = []
+        self._curve = None
+
+    def setScope(self, on):
+        self.scoped = on
+
+    def evalAtTime(self, time):
+        if not self._keys:
+            return 0.0
+        if self._curve is None:
+            self._curve = (np.array([k.time() for k in self._keys]),
+                           np.array([k.value() for k in self._keys]))
+        return float(np.interp(time, *self._curve))
+
+    def evalAtFrame(self, frame):
+        return self.evalAtTime(frameToTime(frame))
+
+    def eval(self):
+        return self.evalAtFrame(frame())
+
+
+class ObjNode(object):
+    def __init__(self, path, parm_names=()):
+        self._path = path
+        self._parms = [Parm(n, self) for n in parm_names]
+
+    def path(self):
+        return self._path
+
+    def name(self):
+        return self._path.rsplit('/', 1)[-1]
+
+    def parms(self):
+        return tuple(self._parms)
+
+    def parm(self, name):
+        for p in self._parms:
+            if p.name() == name:
+                return p
+        return None
+
+
+class _ChannelList(object):
+    def __init__(self):
+        self._parms = []
+        self._selected = []
+
+    def parms(self):
+        return tuple(self._parms)
+
+    def selected(self):
+        return tuple(self._selected)
+
+
+class _Playbar(object):
+    def __init__(self):
+        self.range = (1.0, 48.0)
+        self.selection = None
+        self.channels = _ChannelList()
+
+    def frameRange(self):
+        return self.range
+
+    def selectionRange(self):
+        return self.selection
+
+    def channelList(self):
+        return self.channels
+
+
+class _UI(object):
+    def __init__(self):
+        self.status = ''
+        self.messages = []
+
+    def scaledSize(self, size):
+        return size
+
+    def setStatusMessage(self, message, severity=None):
+        self.status = message
+
+    def displayMessage(self, text, *args, **kwargs):
+        self.messages.append(text)
+        return 0
+
+    def readInput(self, message, buttons=('OK',), initial_contents='',
+                  **kwargs):
+        return 0, initial_contents
+
+
+class _Undos(object):
+    @contextlib.contextmanager
+    def group(self, label):
+        yield
+
+
+_state = {'fps': 24.0, 'frame': 1.0, 'nodes': [], 'rendered': 0}
+playbar = _Playbar()
+ui = _UI()
+undos = _Undos()
+severityType = types.SimpleNamespace(
+    Message=0, ImportantMessage=1, Warning=2, Error=3)
+
+
+def fps():
+    return _state['fps']
+
+
+def setFps(value):
+    _state['fps'] = float(value)
+
+
+def frame():
+    return _state['frame']
+
+
+def setFrame(value):
+    _state['frame'] = float(value)
+
+
+def frameToTime(frame):
+    return (frame - 1.0) / _state['fps']
+
+
+def timeToFrame(time):
+    return time * _state['fps'] + 1.0
+
+
+def expandString(text):
+    return expandStringAtFrame(text, _state['frame'])
+
+
+def expandStringAtFrame(text, frame):
+    def padded(m):
+        return str(int(frame)).zfill(int(m.group(1) or 1))
+    text = re.sub(r'\$F(\d*)', padded, text)
+    for var in ('HIP', 'JOB', 'HOME'):
+        text = text.replace('$' + var, os.environ.get(var, os.getcwd()))
+    return text
+
+
+def selectedNodes():
+    return tuple(_state['nodes'])
+
+
+def setSelectedNodes(nodes):
+    _state['nodes'] = list(nodes)
+
+
+def hscript(command):
+    '''Only viewwrite is understood, it writes one image per frame.'''
+    args = command.split()
+    if not args or args[0] != 'viewwrite':
+        return '', f'Unknown command: {command}'
+    start, end = (int(float(a)) for a in args[args.index('-f') + 1:][:2])
+    filename = command.rsplit(' ', 1)[1].strip("'")
+    for f in range(start, end + 1):
+        _renderImage(expandStringAtFrame(filename, f), f)
+    return '', ''
+
+
+def _renderImage(filename, frame, size=(320, 240)):
+    from PIL import Image
+    x = np.linspace(0, 255, size[0], dtype=np.float32)
+    y = np.linspace(0, 255, size[1], dtype=np.float32)[:, None]
+    shift = (frame * 7) % 256
+    pixels = np.empty((size[1], size[0], 3), dtype=np.uint8)
+    pixels[..., 0] = (x + shift) % 256
+    pixels[..., 1] = (y + shift) % 256
+    pixels[..., 2] = (x + y) / 2
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    Image.fromarray(pixels).save(filename)
+    _state['rendered'] += 1
+
+
+def install():
+    '''Register this module as hou, returns it.'''
+    module = sys.modules[__name__]
+    sys.modules['hou'] = module
+    return module
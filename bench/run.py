@@ -0,0 +1,334 @@
+"""
+Headless benchmarks for cnwpose.
+
+    python bench/run.py --clips 1000 --channels 30 --keys 120 --thumb gif
+    python bench/run.py --output new.json --compare old.json
+    python bench/run.py --trace bench.trace.json
+
+A synthetic library is written to a temporary directory and each operation
+is timed --repeat times against it with a stand-in hou module. Results are
+printed as JSON: the parameters, the interpreter, and per operation the
+min, median and mean in milliseconds. With --compare, operations whose
+median got slower than --threshold times the baseline are listed under
+'regressions' and the exit status is 1.
+
+The panel's Qt methods are timed through the code they delegate to, the
+widget work around them needs a Houdini session:
+    refreshLibrary      manifest reconcile, entries() and the search index,
+                        cold (no index on disk) and warm, and .pack
+                        opening an exported pack of the library
+    _search             queries against --search-entries in memory entries,
+                        .typing a term typed a letter at a time into a
+                        fresh index
+    getJSON             reading a whole clip, and only some channels,
+                        .pack from the pack
+    getTimeLength       reading the clip header
+    applyJSON           ClipApplier.apply per insertion method, on parms
+                        that already have keys
+    _writeToFile        capture.UI._writeToFile, clipfile.writeClip when
+                        capture can't be imported
+    _convertImagesToGif the thumbnail pipeline over frames from viewwrite
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'python3.7libs'))
+sys.path.insert(0, HERE)
+
+import fakehou  # noqa: E402
+hou = fakehou.install()
+
+from cnwpose import apply  # noqa: E402
+from cnwpose import clipfile  # noqa: E402
+from cnwpose import encode  # noqa: E402
+from cnwpose import manifest  # noqa: E402
+from cnwpose import pack  # noqa: E402
+from cnwpose import plglobals  # noqa: E402
+from cnwpose import search  # noqa: E402
+from cnwpose import trace  # noqa: E402
+
+import synth  # noqa: E402
+
+try:
+    from cnwpose import capture
+except ImportError:
+    capture = None
+
+
+# Timed by _search, bare terms match names and tag prefixes.
+SEARCH_QUERIES = ('a', 'w', 'walk', 'type:clip a', 'walk tag:loop', 'ch:rx',
+                  'src:rig_3')
+
+
+def timeit(fn, repeat, setup=None):
+    '''Run fn repeat times, calling setup untimed before each, and return
+    the timings in milliseconds.'''
+    times = []
+    for i in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000.0)
+    return {'min': min(times), 'median': statistics.median(times),
+            'mean': statistics.mean(times), 'runs': repeat}
+
+
+class Bench(object):
+    def __init__(self, args, root):
+        self.args = args
+        self.root = root
+        self.lib_path = os.path.join(root, 'lib')
+        self.results = {}
+        self.notes = {}
+
+    def record(self, name, fn, setup=None, repeat=None):
+        self.results[name] = timeit(fn, repeat or self.args.repeat, setup)
+        if not self.args.quiet:
+            print(f"{name:40s} {self.results[name]['median']:10.3f} ms",
+                  file=sys.stderr)
+
+    def run(self):
+        args = self.args
+        start = time.perf_counter()
+        self.names = synth.makeLibrary(
+            self.lib_path, clips=args.clips, poses=args.poses,
+            channels=args.channels, keys=args.keys, thumb=args.thumb,
+            seed=args.seed)
+        self.notes['synth_seconds'] = time.perf_counter() - start
+        plglobals.lib_path = self.lib_path
+        self.refreshLibrary()
+        self.libraryPack()
+        self.search()
+        if self.names['clip']:
+            name = self.names['clip'][0]
+            self.clip = os.path.join(self.lib_path, 'clip', name, name)
+            self.getJSON()
+            self.getTimeLength()
+            self.applyJSON()
+            self.writeToFile()
+        self.convertImagesToGif()
+
+    def refreshLibrary(self):
+        index = search.SearchIndex()
+
+        def cold():
+            manifest._manifests.clear()
+            try:
+                os.remove(os.path.join(self.lib_path, manifest.DB_NAME))
+            except OSError:
+                pass
+
+        def refresh():
+            m = manifest.getManifest(self.lib_path)
+            m.reconcile()
+            index.setEntries(m.entries())
+
+        self.record('refreshLibrary.cold', refresh, cold,
+                    repeat=max(1, self.args.repeat // 5))
+        self.record('refreshLibrary.warm', refresh)
+        self.record('search', lambda: index.search('walk tag:loop'))
+
+    def libraryPack(self):
+        filename = os.path.join(self.root, 'lib' + pack.PACK_EXT)
+        start = time.perf_counter()
+        pack.writePack(manifest.getManifest(self.lib_path).entries(),
+                       filename)
+        self.notes['pack_seconds'] = time.perf_counter() - start
+        index = search.SearchIndex()
+
+        def cold():
+            manifest._manifests.pop(filename, None)
+            pack._packs.clear()
+
+        def refresh():
+            m = manifest.getManifest(filename)
+            m.reconcile()
+            index.setEntries(m.entries())
+
+        self.record('refreshLibrary.pack', refresh, cold)
+        if self.names['clip']:
+            name = self.names['clip'][0]
+            clip = os.path.join(filename, 'clip', name, name)
+            self.record('getJSON.pack', lambda: clipfile.readClip(clip))
+
+    def search(self):
+        index = search.SearchIndex()
+        entries = synth.makeEntries(self.args.search_entries,
+                                    channels=self.args.channels,
+                                    seed=self.args.seed)
+        self.record('_search.build', lambda: index.setEntries(entries),
+                    repeat=max(1, self.args.repeat // 5))
+        for query in SEARCH_QUERIES:
+            self.record(f'_search.{query}', lambda: index.search(query))
+
+        def typing():
+            for i in range(1, len('walk') + 1):
+                index.search('walk'[:i])
+
+        self.record('_search.typing', typing,
+                    lambda: index.setEntries(entries))
+
+    def getJSON(self):
+        names = synth.channelNames(self.args.channels)
+        subset = names[:max(1, len(names) // 4)]
+        self.record('getJSON', lambda: clipfile.readClip(self.clip))
+        self.record('getJSON.subset', lambda: clipfile.readClip(
+            self.clip, names=subset, window=(0.0, 1.0)))
+
+    def getTimeLength(self):
+        self.record('getTimeLength',
+                    lambda: clipfile.readInfo(self.clip)['length'])
+
+    def applyJSON(self):
+        node = hou.ObjNode('/obj/bench',
+                           synth.channelNames(self.args.channels))
+        hou.setSelectedNodes([node])
+        parms = node.parms()
+        existing = {}
+        for p in parms:
+            existing[p] = [hou.Keyframe(i % 5, i / hou.fps())
+                           for i in range(0, self.args.keys * 2, 4)]
+
+        def reset():
+            hou.setFrame(self.args.keys // 2)
+            for p in parms:
+                p.deleteAllKeyframes()
+                p.setKeyframes(existing[p])
+
+        applier = apply.ClipApplier(self.clip)
+        self.record('applyJSON.cold', lambda: apply.ClipApplier(
+            self.clip).apply(parms, 'Replace', 1.0), reset)
+        for method in apply.METHODS:
+            self.record(f'applyJSON.{method}',
+                        lambda: applier.apply(parms, method, 1.0), reset)
+
+    def writeToFile(self):
+        clip = clipfile.readClip(self.clip)
+        out_dir = os.path.join(self.root, 'write')
+        if capture is not None:
+            def write():
+                capture.UI._writeToFile(None, clip, 'bench', out_dir)
+            self.notes['_writeToFile'] = 'capture.UI._writeToFile'
+        else:
+            def write():
+                os.makedirs(out_dir, exist_ok=True)
+                clipfile.writeClip(os.path.join(out_dir, 'bench'), clip)
+            self.notes['_writeToFile'] = 'clipfile.writeClip'
+        self.record('_writeToFile', write)
+
+    def convertImagesToGif(self):
+        frames = self.args.frames
+        scratch = os.path.join(self.root, 'frames')
+        pattern = os.path.join(scratch, 'bench.$F4.jpg')
+        files = [hou.expandStringAtFrame(pattern, f)
+                 for f in range(1, frames + 1)]
+
+        def render():
+            hou.hscript(f"viewwrite -f 1 {frames} bench '{pattern}'")
+
+        if capture is not None:
+            def convert():
+                capture.UI._convertImagesToGif(
+                    None, files, os.path.join(scratch, 'bench.gif'))
+            self.notes['_convertImagesToGif'] = \
+                'capture.UI._convertImagesToGif'
+        else:
+            def convert():
+                pipeline = encode.FramePipeline(
+                    os.path.join(scratch, 'bench.gif'), hou.fps())
+                for i in files:
+                    pipeline.submit(i)
+                pipeline.finish()
+            self.notes['_convertImagesToGif'] = 'encode.FramePipeline'
+        self.record('_convertImagesToGif', convert, render,
+                    repeat=max(1, self.args.repeat // 5))
+
+
+def compare(results, baseline, threshold):
+    '''Return the operations slower than threshold times the baseline.'''
+    regressions = {}
+    for name, stats in results.items():
+        old = baseline.get(name)
+        if old is None or old['median'] <= 0:
+            continue
+        ratio = stats['median'] / old['median']
+        if ratio > threshold:
+            regressions[name] = {'baseline': old['median'],
+                                 'median': stats['median'], 'ratio': ratio}
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--clips', type=int, default=200)
+    parser.add_argument('--poses', type=int, default=50)
+    parser.add_argument('--channels', type=int, default=18)
+    parser.add_argument('--keys', type=int, default=96,
+                        help='keys per channel of each clip')
+    parser.add_argument('--thumb', choices=sorted(synth.THUMB_EXTS),
+                        default='gif', help='thumbnail kind')
+    parser.add_argument('--search-entries', type=int, default=50000,
+                        help='entries searched by _search')
+    parser.add_argument('--frames', type=int, default=48,
+                        help='frames converted by _convertImagesToGif')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='also write the results here')
+    parser.add_argument('--compare', help='baseline results to compare to')
+    parser.add_argument('--threshold', type=float, default=1.25)
+    parser.add_argument('--trace', help='write a Chrome trace of the run')
+    parser.add_argument('--keep', action='store_true',
+                        help='keep the synthetic library')
+    parser.add_argument('--quiet', action='store_true')
+    args = parser.parse_args(argv)
+
+    root = tempfile.mkdtemp(prefix='cnwpose_bench_')
+    bench = Bench(args, root)
+    if args.trace:
+        trace.enable()
+    try:
+        bench.run()
+    finally:
+        if args.trace:
+            trace.disable()
+            trace.export(args.trace)
+        if args.keep:
+            print(f'Library kept in {root}', file=sys.stderr)
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+    report = {'params': {k: v for k, v in vars(args).items()
+                         if k not in ('output', 'compare', 'trace', 'keep',
+                                      'quiet')},
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+              'notes': bench.notes,
+              'results': bench.results}
+    status = 0
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        report['regressions'] = compare(bench.results, baseline['results'],
+                                        args.threshold)
+        status = 1 if report['regressions'] else 0
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
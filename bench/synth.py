@@ -0,0 +1,145 @@
+"""
+Synthetic pose libraries for the benchmarks.
+
+makeLibrary() lays out <lib>/clip/<name>/<name> and <lib>/pose/<name>/<name>
+the way capture does, with binary clip files of random bezier keys and one
+thumbnail per entry. The thumbnail is encoded once and copied, it is the
+file sizes and counts that matter for scanning, not their content. Folder
+and file mtimes are moved into the past so the manifest trusts them straight
+away.
+"""
+
+import os
+import random
+import shutil
+import time
+
+import numpy as np
+
+from cnwpose import clipfile
+from cnwpose import encode
+
+import fakehou
+
+THUMB_EXTS = {'gif': '.gif', 'webp': '.webp', 'jpg': '.jpg', 'none': None}
+CHANNEL_NAMES = ('tx', 'ty', 'tz', 'rx', 'ry', 'rz', 'sx', 'sy', 'sz')
+WORDS = ('walk', 'run', 'idle', 'jump', 'turn', 'wave', 'sit', 'crouch',
+         'reach', 'grab', 'fall', 'kick', 'punch', 'look', 'point', 'nod')
+TAGS = ('loop', 'hero', 'crowd', 'mocap', 'keyed', 'wip', 'final')
+
+
+def channelNames(count):
+    '''Return count channel names, tx ty tz ... then tx1 ty1 ...'''
+    names = []
+    i = 0
+    while len(names) < count:
+        suffix = str(i // len(CHANNEL_NAMES) or '')
+        names.append(CHANNEL_NAMES[i % len(CHANNEL_NAMES)] + suffix)
+        i += 1
+    return names
+
+
+def makeClip(channels, keys, fps=24.0, rng=None, meta=None):
+    '''Build a clipfile.Clip of random smooth bezier curves, one key per
+    frame from time 0.'''
+    if rng is None:
+        rng = np.random.default_rng()
+    fields = clipfile.FIELDS
+    clip = clipfile.Clip(strings=['bezier()'], meta=meta)
+    t = np.arange(keys) / fps
+    for name in channelNames(channels):
+        v = np.cumsum(rng.normal(0.0, 1.0, keys))
+        values = np.full((len(fields), keys), np.nan)
+        values[fields.index('time')] = t
+        values[fields.index('value')] = v
+        slopes = np.gradient(v, t) if keys > 1 else np.zeros(keys)
+        values[fields.index('slope')] = slopes
+        values[fields.index('inSlope')] = slopes
+        values[fields.index('accel')] = 1.0 / 3.0 / fps
+        values[fields.index('accelRatio')] = 1.0 / 3.0 / fps
+        strs = np.full((len(clipfile.STRFIELDS), keys), clipfile.NO_STRING,
+                       dtype='<u4')
+        strs[clipfile.STRFIELDS.index('expression')] = 0
+        clip.channels[name] = (values, strs)
+    return clip
+
+
+def makeThumbnail(filename, kind, frames=24):
+    '''Render frames with the fake viewwrite and encode them like
+    capture does. Returns the thumbnail's filename or None.'''
+    if THUMB_EXTS[kind] is None:
+        return None
+    scratch = os.path.join(os.path.dirname(filename), '.frames')
+    pattern = os.path.join(scratch, 'frame.$F4.jpg')
+    fakehou.hscript(f"viewwrite -f 1 {frames} bench '{pattern}'")
+    images = [fakehou.expandStringAtFrame(pattern, f)
+              for f in range(1, frames + 1)]
+    if kind == 'jpg':
+        encode._loadFrame(images[0]).save(filename)
+    else:
+        pipeline = encode.FramePipeline(filename, 24.0, format=kind)
+        for i in images:
+            pipeline.submit(i)
+        filename = pipeline.finish()
+    shutil.rmtree(scratch)
+    return filename
+
+
+def makeEntries(count, channels=9, seed=0):
+    '''Return count manifest entries named and tagged like makeLibrary()'s,
+    without writing anything, for timing the search index at scale.'''
+    words = random.Random(seed)
+    names = ' '.join(channelNames(channels))
+    date = time.strftime('%Y-%m-%d %H:%M:%S')
+    entries = []
+    for i in range(count):
+        clip_type = 'clip' if words.random() < 0.8 else 'pose'
+        tags = words.sample(TAGS, 2) if words.random() < 0.3 else []
+        entries.append({
+            'name': f'{words.choice(WORDS)}_{words.choice(WORDS)}_{i:05d}',
+            'type': clip_type, 'channel_names': names, 'date': date,
+            'source': f'/obj/rig_{i % 7}/ctrl_{i % 13}',
+            'tags': ' '.join(sorted(tags))})
+    return entries
+
+
+def makeLibrary(lib_path, clips=100, poses=20, channels=9, keys=48,
+                thumb='gif', seed=0):
+    '''Write a synthetic library to lib_path and return its entry names
+    as {'clip': [...], 'pose': [...]}.'''
+    rng = np.random.default_rng(seed)
+    words = random.Random(seed)
+    os.makedirs(lib_path, exist_ok=True)
+    thumbnail = makeThumbnail(
+        os.path.join(lib_path, '.thumb' + (THUMB_EXTS[thumb] or '')), thumb)
+    names = {'clip': [], 'pose': []}
+    past = time.time() - 3600
+    for clip_type, count, length in (('clip', clips, keys),
+                                     ('pose', poses, 1)):
+        type_dir = os.path.join(lib_path, clip_type)
+        os.makedirs(type_dir, exist_ok=True)
+        for i in range(count):
+            name = f'{words.choice(WORDS)}_{words.choice(WORDS)}_{i:05d}'
+            dir = os.path.join(type_dir, name)
+            os.makedirs(dir, exist_ok=True)
+            meta = {'start': 1.0, 'end': float(length), 'fps': 24.0,
+                    'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+                    'source': f'/obj/rig_{i % 7}/ctrl_{i % 13}'}
+            clipfile.writeClip(os.path.join(dir, name),
+                               makeClip(channels, length, rng=rng, meta=meta))
+            if thumbnail is not None:
+                shutil.copyfile(thumbnail, os.path.join(
+                    dir, name + THUMB_EXTS[thumb]))
+            if words.random() < 0.3:
+                with open(os.path.join(dir, name + '.tags'), 'w') as f:
+                    f.write('\n'.join(words.sample(TAGS, 2)) + '\n')
+            # The manifest only trusts mtimes older than MTIME_SETTLE, the
+            # data file's as well as the folder's.
+            for f in os.listdir(dir):
+                os.utime(os.path.join(dir, f), (past, past))
+            os.utime(dir, (past, past))
+            names[clip_type].append(name)
+        os.utime(type_dir, (past, past))
+    if thumbnail is not None:
+        os.remove(thumbnail)
+    return names
@@ -0,0 +1,189 @@
+"""
+Applying a clip to parameters.
+
+Only the channels of the parms being applied to are read from the clip file,
+and only the keys inside the clip range when one is set. Their hou.Keyframe
+objects are built once per time scale and range and reused for every apply,
+only their times are moved to the current frame. Each
+target parm is rewritten with a single setKeyframes() call: its existing
+keys are read once, filtered or shifted for the insertion method, and set
+together with the clip's keys after deleteAllKeyframes(). The whole apply is
+one undo step.
+
+Merge adds the clip as a weighted layer over the existing animation. The
+existing curve is sampled once over the clip's span, at the key times or on
+the frame grid when there are more keys than frames, and combined with the
+clip values as arrays.
+"""
+
+import hou
+
+from . import clipfile
+from . import plglobals
+from . import trace
+
+if plglobals.debug == 1:
+    from importlib import reload
+    reload(clipfile)
+    reload(plglobals)
+    reload(trace)
+
+
+METHODS = ('Insert', 'Merge', 'Replace', 'Replace All')
+
+
+class _Channel(object):
+    '''Keyframes of one clip channel with their unshifted times and
+    values.'''
+
+    def __init__(self, keys, mult, offset=0.0):
+        import numpy as np
+        self.frames = []
+        for k in keys:
+            frame = hou.Keyframe()
+            frame.fromJSON(k)
+            self.frames.append(frame)
+        self.times = (np.array([f.time() for f in self.frames]) -
+                      offset) / mult
+        self.values = np.array([f.value() if f.isValueSet() else np.nan
+                                for f in self.frames])
+        self.start = None
+        self.merged = False
+
+    def place(self, start):
+        '''Move the keys to start at time start.'''
+        if start == self.start:
+            return
+        for frame, t in zip(self.frames, self.times + start):
+            frame.setTime(float(t))
+        self.start = start
+
+    def restore(self):
+        '''Undo values changed by a merge.'''
+        if not self.merged:
+            return
+        self.setValues(self.values)
+        self.merged = False
+
+    def setValues(self, values):
+        for frame, v in zip(self.frames, values.tolist()):
+            if v == v:
+                frame.setValue(v)
+
+
+class ClipApplier(object):
+    """Apply a clip file to parms, loading and caching the keyframes of
+    the channels it is asked for per time scale and clip range."""
+
+    def __init__(self, filename, length=None, clip=None, mapped=None):
+        self.filename = filename
+        if length is None or mapped is None:
+            info = clipfile.readInfo(filename)
+            length = info['length'] if length is None else length
+            mapped = bool(info['baked']) if mapped is None else mapped
+        self.length = length
+        # Baked channels are sliced from a map of the file rather than read.
+        self.mapped = mapped
+        # Already read whole, by the prefetcher.
+        self.clip = clip
+        self._state = None
+        self._channels = {}
+        self._missing = set()
+
+    def channels(self, names, mult, window=None):
+        '''Return {name: _Channel} for the clip channels among names.'''
+        if (mult, window) != self._state:
+            self._channels = {}
+            self._missing = set()
+            self._state = (mult, window)
+        wanted = set(names) - set(self._channels) - self._missing
+        if wanted:
+            with trace.span('apply.load', channels=len(wanted)):
+                if self.clip is not None:
+                    clip = self.clip.subset(wanted, window)
+                else:
+                    clip = clipfile.readClip(self.filename, names=wanted,
+                                             window=window,
+                                             mapped=self.mapped)
+                offset = window[0] if window else 0.0
+                for name in clip.names():
+                    self._channels[name] = _Channel(clip.keys(name), mult,
+                                                    offset)
+                self._missing |= wanted - set(clip.names())
+        return self._channels
+
+    def apply(self, parms, method, mult, window=None, frame=None,
+              weight=1.0):
+        '''Apply the clip, or the (start, end) window of it in seconds, to
+        parms at frame. Returns the number of parms that received keys.
+        weight scales the clip when merging.'''
+        if frame is None:
+            frame = hou.frame()
+        start = hou.frameToTime(frame)
+        span = window[1] - window[0] if window else self.length
+        length = hou.timeToFrame(span / mult)
+        targets = {}
+        for p in parms:
+            targets.setdefault(p.name(), []).append(p)
+        channels = self.channels(targets, mult, window)
+        applied = 0
+        with trace.span('apply.' + method, parms=len(parms)), \
+                hou.undos.group(f'Apply {method}'):
+            for name, group in targets.items():
+                channel = channels.get(name)
+                if channel is not None:
+                    channel.place(start)
+                    channel.restore()
+                for p in group:
+                    keys = self._existing(p, method, frame, length)
+                    if channel is not None:
+                        if method == 'Merge':
+                            self._merge(p, channel, weight)
+                        keys.extend(channel.frames)
+                        p.setScope(True)
+                        applied += 1
+                    p.deleteAllKeyframes()
+                    if keys:
+                        p.setKeyframes(keys)
+                    trace.count('apply.keys', len(keys))
+        return applied
+
+    def _existing(self, parm, method, frame, length):
+        '''Return the keys of parm that survive the insertion method.'''
+        if method == 'Replace All':
+            return []
+        keys = list(parm.keyframes())
+        if method == 'Insert':
+            for k in keys:
+                if k.frame() >= frame:
+                    k.setFrame(k.frame() + length)
+            return keys
+        return [k for k in keys
+                if not frame <= k.frame() <= frame + length]
+
+    def _merge(self, parm, channel, weight):
+        times = channel.times + channel.start
+        base = sampleCurve(parm, times)
+        channel.setValues(base + weight * channel.values)
+        channel.merged = True
+
+
+def sampleCurve(parm, times):
+    '''Evaluate parm's animation at times, an array of seconds.
+
+    Dense keys are sampled on the frame grid they span and interpolated.
+    '''
+    import numpy as np
+    if not len(times):
+        return np.zeros(0)
+    start = float(times.min())
+    key_frames = hou.timeToFrame(start) + (times - start) * hou.fps()
+    first = int(np.floor(key_frames.min()))
+    last = int(np.ceil(key_frames.max()))
+    unique, inverse = np.unique(times, return_inverse=True)
+    if len(unique) <= last - first + 1:
+        return np.array([parm.evalAtTime(float(t))
+                         for t in unique])[inverse]
+    frames = np.arange(first, last + 1)
+    samples = np.array([parm.evalAtFrame(int(f)) for f in frames])
+    return np.interp(key_frames, frames, samples)
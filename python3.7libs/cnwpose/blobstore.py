@@ -0,0 +1,265 @@
+"""
+Content addressed storage for library entries.
+
+With BLOB_STORE on, a capture's clip data and thumbnail are moved into
+<lib>/.blobs/<xx>/<sha256>, named by the SHA-256 of their content, and the
+entry becomes a small JSON ref file, <lib>/<type>/<name>.ref:
+
+    {"data": "<sha256>", "thumb": "<sha256>", "thumb_ext": ".gif",
+     "tags": ["loop"]}
+
+Identical captures share their blobs, renaming an entry renames only its
+ref and sync() copies only the blobs the other library doesn't have yet.
+Blobs are never modified, a changed payload is a new blob.
+
+Ref entries and folder entries live side by side and are listed alike by
+the manifest, storeLibrary() moves the folder entries of an existing library
+into the store. Deleting an entry only removes its ref: another artist's
+ref may point at the same blobs without this session's manifest knowing.
+collect() removes the blobs no ref on disk refers to, run it from the
+Python shell to reclaim space.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from . import plglobals
+
+if plglobals.debug == 1:
+    from importlib import reload
+    reload(plglobals)
+
+
+BLOB_DIR = '.blobs'
+REF_EXT = '.ref'
+TAGS_EXT = '.tags'
+# Thumbnail extensions in the order capture and the manifest prefer them.
+THUMB_EXTS = ('.gif', '.webp', '.jpg')
+CHUNK = 1024 * 1024
+# collect() leaves blobs younger than this, in seconds, a capture stores its
+# blobs before its ref.
+COLLECT_AGE = 3600.0
+
+
+def isRef(path):
+    return path.endswith(REF_EXT)
+
+
+def refPath(lib_path, clip_type, name):
+    return os.path.join(lib_path, clip_type, name + REF_EXT)
+
+
+def refLibrary(path):
+    '''Return the library a ref file belongs to.'''
+    return os.path.dirname(os.path.dirname(path))
+
+
+def blobPath(lib_path, digest):
+    return os.path.join(lib_path, BLOB_DIR, digest[:2], digest)
+
+
+def _replace(filename, data):
+    '''Write filename so readers only ever see a complete file.'''
+    fd, temp = tempfile.mkstemp(dir=os.path.dirname(filename),
+                                prefix='.tmp_')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp, filename)
+    except BaseException:
+        os.remove(temp)
+        raise
+
+
+def putBlob(lib_path, filename):
+    '''Store a file's content, returns its digest. The content is only
+    written when no blob has it yet.'''
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK), b''):
+            digest.update(chunk)
+    digest = digest.hexdigest()
+    blob = blobPath(lib_path, digest)
+    if os.path.isfile(blob):
+        # Keeps collect() from taking it before the new ref is written.
+        os.utime(blob)
+    else:
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=os.path.dirname(blob),
+                                    prefix='.tmp_')
+        os.close(fd)
+        try:
+            shutil.copyfile(filename, temp)
+            os.replace(temp, blob)
+        except BaseException:
+            os.remove(temp)
+            raise
+    return digest
+
+
+def readRef(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def writeRef(path, ref):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    _replace(path, json.dumps(ref, sort_keys=True).encode('UTF-8'))
+
+
+def storeEntry(lib_path, clip_type, name, dir):
+    '''Move a folder entry's files into the store, replacing the folder
+    with a ref. Returns the ref's path.'''
+    ref = {'data': putBlob(lib_path, os.path.join(dir, name))}
+    for ext in THUMB_EXTS:
+        thumb = os.path.join(dir, name + ext)
+        if os.path.isfile(thumb):
+            ref['thumb'] = putBlob(lib_path, thumb)
+            ref['thumb_ext'] = ext
+            break
+    try:
+        # Written by manifest.writeTags(), one tag a line.
+        with open(os.path.join(dir, name + TAGS_EXT)) as f:
+            ref['tags'] = f.read().split()
+    except IOError:
+        pass
+    path = refPath(lib_path, clip_type, name)
+    writeRef(path, ref)
+    shutil.rmtree(dir)
+    return path
+
+
+def storeLibrary(lib_path, types=('clip', 'pose')):
+    '''Move every folder entry of a library into the store, returns how
+    many were moved.'''
+    count = 0
+    for clip_type in types:
+        sub_dir = os.path.join(lib_path, clip_type)
+        if not os.path.isdir(sub_dir):
+            continue
+        for e in os.scandir(sub_dir):
+            if e.is_dir() and not e.name.startswith('.') and \
+                    os.path.isfile(os.path.join(e.path, e.name)):
+                storeEntry(lib_path, clip_type, e.name, e.path)
+                count += 1
+    return count
+
+
+def entryExists(type_dir, name):
+    '''Whether type_dir holds an entry called name, as a ref or a folder.'''
+    return os.path.exists(os.path.join(type_dir, name + REF_EXT)) or \
+        os.path.exists(os.path.join(type_dir, name))
+
+
+def renameRef(path, new_name):
+    '''Rename an entry, only its ref is touched. Raises FileExistsError
+    rather than replace another entry called new_name.'''
+    type_dir = os.path.dirname(path)
+    new_path = os.path.join(type_dir, new_name + REF_EXT)
+    if entryExists(type_dir, new_name):
+        raise FileExistsError(new_path)
+    os.rename(path, new_path)
+    return new_path
+
+
+def deleteRef(path):
+    '''Delete an entry's ref. Its blobs stay until collect().'''
+    os.remove(path)
+
+
+def _refs(lib_path, types=('clip', 'pose')):
+    for clip_type in types:
+        sub_dir = os.path.join(lib_path, clip_type)
+        if not os.path.isdir(sub_dir):
+            continue
+        for e in os.scandir(sub_dir):
+            if e.is_file() and isRef(e.name):
+                yield clip_type, e
+
+
+def _blobs(lib_path):
+    '''Return the digests of the blobs in a library.'''
+    root = os.path.join(lib_path, BLOB_DIR)
+    digests = set()
+    if not os.path.isdir(root):
+        return digests
+    for d in os.scandir(root):
+        if d.is_dir():
+            digests.update(e.name for e in os.scandir(d.path)
+                           if not e.name.startswith('.'))
+    return digests
+
+
+def collect(lib_path):
+    '''Remove the blobs no ref points at, returns how many were removed.
+
+    Refs are read from disk, blobs modified within COLLECT_AGE are kept for
+    captures that have not written their ref yet.'''
+    now = time.time()
+    used = set()
+    for clip_type, e in _refs(lib_path):
+        try:
+            ref = readRef(e.path)
+        except (IOError, ValueError):
+            # Keep everything rather than guess what a broken ref used.
+            return 0
+        used.update(ref[k] for k in ('data', 'thumb') if ref.get(k))
+    removed = 0
+    for digest in _blobs(lib_path) - used:
+        blob = blobPath(lib_path, digest)
+        try:
+            if now - os.stat(blob).st_mtime < COLLECT_AGE:
+                continue
+            os.remove(blob)
+            removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+def sync(src, dst):
+    '''Copy a library to dst, which may already hold an older copy.
+
+    Only blobs dst doesn't have are copied, refs are copied when they
+    differ and folder entries when dst has no entry of that name. Nothing
+    in dst is removed. Returns the number of blobs, refs and folders
+    copied.'''
+    stats = {'blobs': 0, 'refs': 0, 'folders': 0}
+    have = _blobs(dst)
+    for digest in sorted(_blobs(src) - have):
+        blob = blobPath(dst, digest)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        temp = os.path.join(os.path.dirname(blob), '.tmp_' + digest)
+        shutil.copyfile(blobPath(src, digest), temp)
+        os.replace(temp, blob)
+        stats['blobs'] += 1
+    # Refs last, so a ref never points at a blob that isn't there yet.
+    for clip_type, e in _refs(src):
+        with open(e.path, 'rb') as f:
+            data = f.read()
+        target = os.path.join(dst, clip_type, e.name)
+        try:
+            with open(target, 'rb') as f:
+                if f.read() == data:
+                    continue
+        except IOError:
+            pass
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        _replace(target, data)
+        stats['refs'] += 1
+    for clip_type in ('clip', 'pose'):
+        sub_dir = os.path.join(src, clip_type)
+        if not os.path.isdir(sub_dir):
+            continue
+        for e in os.scandir(sub_dir):
+            target = os.path.join(dst, clip_type, e.name)
+            if e.is_dir() and not e.name.startswith('.') and \
+                    not os.path.exists(target) and \
+                    not os.path.exists(target + REF_EXT):
+                shutil.copytree(e.path, target)
+                stats['folders'] += 1
+    return stats
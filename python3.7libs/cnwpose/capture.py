@@ -1,27 +1,35 @@
-import gzip
+import functools
 import hou
-import json
 import os
 import re
-import shutil
+import time
 
-from PIL import Image
 from PySide2 import QtWidgets
 from PySide2 import QtCore
 from PySide2 import QtGui
 
 from . import plglobals
-from . import thumb
 from . import utils
 
 
 if plglobals.debug == 1:
     from importlib import reload
-    reload(thumb)
     reload(plglobals)
     reload(utils)
 
 
+def _traced(name):
+    '''trace.traced, importing trace on the first call rather than with
+    the panel.'''
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            from . import trace
+            return trace.traced(name)(fn)(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
 class UI(QtWidgets.QWidget):
     """ Contains all the widgets to create a capture interface."""
     capture = QtCore.Signal()
@@ -66,6 +74,37 @@ class UI(QtWidgets.QWidget):
         btn_layout.addWidget(self.btn_cap_pose)
         form_layout.addRow(QtWidgets.QLabel(), btn_layout)
 
+        # Clip capture mode
+        self.combo_mode = QtWidgets.QComboBox()
+        self.combo_mode.setFixedWidth(hou.ui.scaledSize(300))
+        self.combo_mode.addItem('Per Frame', 'frame')
+        self.combo_mode.addItem('Frame Range', 'range')
+        self.combo_mode.setCurrentIndex(
+            self.combo_mode.findData(plglobals.CAPTURE_MODE))
+        form_layout.addRow(QtWidgets.QLabel('Capture Mode'), self.combo_mode)
+
+        # Keyframes or baked samples
+        self.combo_channels = QtWidgets.QComboBox()
+        self.combo_channels.setFixedWidth(hou.ui.scaledSize(300))
+        self.combo_channels.addItem('Keyframes', 'keys')
+        self.combo_channels.addItem('Bake', 'bake')
+        self.combo_channels.setCurrentIndex(
+            self.combo_channels.findData(plglobals.CAPTURE_CHANNELS))
+        form_layout.addRow(QtWidgets.QLabel('Channels'), self.combo_channels)
+
+        # Key reduction
+        self.cb_reduce = QtWidgets.QCheckBox('Reduce Keys')
+        self.cb_reduce.setChecked(plglobals.REDUCE_KEYS)
+        self.if_tolerance = hou.qt.InputField(hou.qt.InputField.FloatType, 1)
+        self.if_tolerance.setValue(plglobals.REDUCE_TOLERANCE)
+        self.if_tolerance.setEnabled(plglobals.REDUCE_KEYS)
+        self.cb_reduce.toggled.connect(self.if_tolerance.setEnabled)
+        reduce_layout = QtWidgets.QHBoxLayout()
+        reduce_layout.addWidget(self.cb_reduce)
+        reduce_layout.addWidget(QtWidgets.QLabel('Tolerance'))
+        reduce_layout.addWidget(self.if_tolerance)
+        form_layout.addRow(QtWidgets.QLabel(), reduce_layout)
+
         # Debug
         self.te_debug = QtWidgets.QPlainTextEdit()
         if plglobals.debug == 1:
@@ -73,9 +112,14 @@ class UI(QtWidgets.QWidget):
 
         main_layout.addStretch()
 
+    @_traced('capture.clip')
     def _captureClip(self):
         '''Capture Animation clip from the selected channels.
 The time range is offset to start at frame 0, rather than when it currently starts'''
+        from . import clipfile
+        from . import manifest
+        if utils.isReadOnly():
+            return False
         frame_range = hou.playbar.selectionRange()
         if frame_range == None:
             frame_range = hou.playbar.frameRange()
@@ -87,8 +131,14 @@ The time range is offset to start at frame 0, rather than when it currently star
             utils.warningDialog(
                 'No channels are available in the Channel List')
             return False
+        bake = self.combo_channels.currentData() == 'bake'
+        samples = {}
+        if bake:
+            samples = self._bakeChannels(sel_channels, frame_range)
         anim_dict = {}
         for p in sel_channels:
+            if p.name() in samples:
+                continue
             key_frames = p.keyframesInRange(frame_range[0], frame_range[1])
             if key_frames:
                 key_frames_list = []
@@ -107,6 +157,7 @@ The time range is offset to start at frame 0, rather than when it currently star
         while(type(object) is not hou.ObjNode):
             object = object.parent()
         if clip_name == 'gary':
+            from . import thumb
             thumb.placeholder(os.path.join(dir, clip_name + '.jpg'))
             utils.warningDialog('Why would you name it that?...')
         else:
@@ -114,11 +165,24 @@ The time range is offset to start at frame 0, rather than when it currently star
                 frame_range, object, clip_name, dir)
             if not ok:
                 return False
-        self._writeToFile(anim_dict, clip_name, dir)
+        clip = clipfile.Clip.fromJSON(
+            anim_dict, self._clipMeta(frame_range[0], frame_range[1], object))
+        rate = hou.fps() * plglobals.BAKE_SUBSTEPS
+        for name, values in samples.items():
+            clip.addSamples(name, 0.0, rate, values)
+        if self.cb_reduce.isChecked():
+            clip = self._reduceClip(clip)
+        self._writeToFile(clip, clip_name, dir)
+        self._store('clip', clip_name, dir)
+        manifest.getManifest(plglobals.lib_path).update('clip', clip_name)
         self.capture.emit()
 
+    @_traced('capture.pose')
     def _capturePose(self):
         '''Capture a Pose from the selected controls in the channel list. The stored frame starts from zero'''
+        from . import manifest
+        if utils.isReadOnly():
+            return False
         sel_channels = utils.selectChannels()
         if len(sel_channels) == 0:
             utils.warningDialog(
@@ -135,113 +199,211 @@ The time range is offset to start at frame 0, rather than when it currently star
         while(type(object) is not hou.ObjNode):
             object = object.parent()
         if pose_name == 'gary':
+            from . import thumb
             thumb.placeholder(os.path.join(dir, pose_name + '.jpg'))
             utils.warningDialog('Why would you name it that?...')
         else:
             ok = self._captureThumbnailStill(object, pose_name, dir)
             if not ok:
                 return False
-        self._writeToFile(anim_dict, pose_name, dir)
+        meta = self._clipMeta(hou.frame(), hou.frame(), object)
+        self._writeToFile(anim_dict, pose_name, dir, meta)
+        self._store('pose', pose_name, dir)
+        manifest.getManifest(plglobals.lib_path).update('pose', pose_name)
         self.capture.emit()
 
+    @_traced('capture.bake')
+    def _bakeChannels(self, parms, frame_range):
+        '''Evaluate parms over the frame range, BAKE_SUBSTEPS samples a
+frame, returns {name: float32 array}. Parms that don't evaluate to a
+number are left out and captured as keys.'''
+        import numpy as np
+        step = 1.0 / max(plglobals.BAKE_SUBSTEPS, 1)
+        frames = np.arange(frame_range[0], frame_range[1] + step / 2, step)
+        parms = [p for p in parms
+                 if isinstance(p.eval(), (int, float))]
+        values = np.empty((len(parms), len(frames)), dtype='<f4')
+        # Frame by frame, each node cooks once per frame for all its parms.
+        for i, f in enumerate(frames.tolist()):
+            values[:, i] = [p.evalAtFrame(f) for p in parms]
+        return {p.name(): values[n] for n, p in enumerate(parms)}
+
     def _jsonFromValue(self, time, value):
         return [{'time': time, 'value': value, 'slope': 0.0,
                  'inSlope': 0.0, 'accel': 0.0, 'accelRatio': 0,
                  'expression': 'bezier()', 'language': 'Hscript'}]
 
-    def _writeToFile(self, data, name, dir):
+    def _clipMeta(self, start, end, object):
+        '''Describe where a capture came from, stored in the clip header.'''
+        return {'start': float(start), 'end': float(end), 'fps': hou.fps(),
+                'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'source': object.path()}
+
+    @_traced('capture.reduce')
+    def _reduceClip(self, clip):
+        '''Drop redundant keys and constant channels, report the ratio.'''
+        from . import keyreduce
+        clip, stats = keyreduce.reduceClip(
+            clip, max(self.if_tolerance.value(), 0.0),
+            plglobals.REDUCE_DROP_CONSTANT)
+        message = (f"Reduced {stats['keys_before']} keys to "
+                   f"{stats['keys_after']} "
+                   f"({stats['ratio']:.1f}x), dropped "
+                   f"{len(stats['dropped'])} constant channels")
+        hou.ui.setStatusMessage(message)
+        if plglobals.debug == 1:
+            self.te_debug.appendPlainText(
+                message + '\n' + ', '.join(stats['dropped']))
+        return clip
+
+    def _store(self, clip_type, name, dir):
+        '''Move a finished capture into the blob store when it is on.'''
+        if not plglobals.BLOB_STORE or not os.path.isdir(dir):
+            return
+        from . import blobstore
+        try:
+            blobstore.storeEntry(hou.expandString(plglobals.lib_path),
+                                 clip_type, name, dir)
+        except (IOError, OSError) as e:
+            utils.warningDialog(f"Unable to store the capture.\nError: {e}")
+
+    @_traced('capture.write')
+    def _writeToFile(self, data, name, dir, meta=None):
+        from . import clipfile
         filename = os.path.join(dir, name)
         if not os.path.exists(dir):
             os.makedirs(dir)
         try:
-            with gzip.open(filename, 'wt', encoding='UTF-8') as zipfile:
-                json.dump(data, zipfile)
+            if not isinstance(data, clipfile.Clip):
+                data = clipfile.Clip.fromJSON(data, meta)
+            clipfile.writeClip(filename, data)
         except IOError as e:
             utils.warningDialog(f"Unable to write file.\nError: {e}")
 
     def _readFromFile(self, name, dir):
+        from . import clipfile
         filename = os.path.join(dir, name)
         try:
-            with gzip.open(filename, 'rt', encoding='UTF-8') as zipfile:
-                return json.load(zipfile)
+            return clipfile.readClip(filename)
         except IOError as e:
             utils.warningDialog(f"Unable to read file.\nError: {e}")
             return False
 
     def _captureThumbnailStill(self, object, pose_name, dir):
-        if not os.path.isdir(dir):
-            os.makedirs(dir)
-        filename = os.path.join(dir, hou.expandString(f"{pose_name}.jpg"))
-        self._captureThumbnail(hou.frame(), filename, object)
+        filename = os.path.join(dir, f"{pose_name}.jpg")
+        return self._captureThumbnail(hou.frame(), filename, object)
 
+    @_traced('capture.thumbnail')
     def _captureThumbnailSequence(self, frames, object, clip_name, dir):
+        '''Render frames to a local scratch directory while the encode
+pipeline works, the library only receives the finished animation'''
+        if self.combo_mode.currentData() == 'range':
+            return self._captureThumbnailRange(frames, object, clip_name, dir)
+        from . import encode
         cur_frame = hou.frame()
-        img_filenames = []
-        if not os.path.isdir(dir):
-            os.makedirs(dir)
+        viewer = self._viewerState()
         self.cancel = False
-        for i in range(int(frames[0]), int(frames[1])):
-            hou.setFrame(i)
-            filename = os.path.join(
-                dir, hou.expandString(f"{clip_name}.$F4.jpg"))
-            img_filenames.append(filename)
-            ok = self._captureThumbnail(i, filename, object)
-            assert ok
-            if self.cancel:
-                shutil.rmtree(dir)
-                self.cancel = False
+        with encode.scratchDir() as scratch:
+            pipeline = encode.FramePipeline(
+                os.path.join(dir, clip_name + '.gif'), hou.fps())
+            for i in range(int(frames[0]), int(frames[1])):
+                hou.setFrame(i)
+                filename = os.path.join(scratch, f"{i:04d}.jpg")
+                ok = self._renderFrame(i, filename, object, viewer)
+                if ok:
+                    pipeline.submit(filename)
+                if self.cancel or not ok:
+                    pipeline.cancel()
+                    hou.setFrame(cur_frame)
+                    self.cancel = False
+                    if not ok:
+                        utils.warningDialog(f"Unable to capture frame {i}")
+                    return False
+            hou.setFrame(cur_frame)
+            pipeline.finish()
+        return True
+
+    @_traced('capture.thumbnail')
+    def _captureThumbnailRange(self, frames, object, clip_name, dir):
+        '''Render the whole range with one viewwrite, then encode it'''
+        from . import encode
+        cur_frame = hou.frame()
+        start = int(frames[0])
+        end = int(frames[1]) - 1
+        with encode.scratchDir() as scratch:
+            self._renderFrame((start, end), os.path.join(
+                scratch, "frame.$F4.jpg"), object)
+            hou.setFrame(cur_frame)
+            filenames = [os.path.join(scratch, f"frame.{i:04d}.jpg")
+                         for i in range(start, end + 1)]
+            missing = [f for f in filenames if not os.path.isfile(f)]
+            if missing:
+                utils.warningDialog(
+                    f"Unable to capture {len(missing)} frames")
                 return False
-        hou.setFrame(cur_frame)
-        self._convertImagesToGif(img_filenames)
+            self._convertImagesToGif(
+                filenames, os.path.join(dir, clip_name + '.gif'))
         return True
 
-    def _convertImagesToGif(self, filename_list):
-        gif = []
-        base_dir = os.path.dirname(filename_list[0])
-        filename = os.path.basename(filename_list[0]).split(".")[0] + ".gif"
-        filename = os.path.join(base_dir, filename)
-        duration = (1.0/hou.fps())*1000
+    @_traced('capture.encode')
+    def _convertImagesToGif(self, filename_list, filename=None):
+        from . import encode
+        if filename is None:
+            base_dir = os.path.dirname(filename_list[0])
+            filename = os.path.join(base_dir, os.path.basename(
+                filename_list[0]).split(".")[0] + ".gif")
+        pipeline = encode.FramePipeline(filename, hou.fps())
         for i in filename_list:
-            image = Image.open(i)
-            gif.append(image.convert("P", palette=Image.ADAPTIVE))
-            os.remove(i)
-        gif[0].save(filename, save_all=True,
-                    optimize=False, append_images=gif[1:], loop=0, duration=duration)
+            pipeline.submit(i)
+        pipeline.finish()
 
-    def _captureThumbnail(self, frame, filename, object):
+    def _viewerState(self):
+        '''Resolve the Scene Viewer used for captures'''
         cur_desktop = hou.ui.curDesktop()
-        desktop = cur_desktop.name()
-        panetab = cur_desktop.paneTabOfType(hou.paneTabType.SceneViewer).name()
-        refPlane = cur_desktop.paneTabOfType(
-            hou.paneTabType.SceneViewer).referencePlane()
+        viewer = cur_desktop.paneTabOfType(hou.paneTabType.SceneViewer)
+        camera_path = (f"{cur_desktop.name()}.{viewer.name()}.world."
+                       f"{viewer.curViewport().name()}")
+        return camera_path, viewer.referencePlane()
+
+    @_traced('capture.render')
+    def _renderFrame(self, frame, filename, object, viewer=None):
+        '''Render the Scene Viewer at a frame, or a (start, end) range with
+$F in filename, returns if the (first) image exists'''
+        if viewer is None:
+            viewer = self._viewerState()
+        camera_path, refPlane = viewer
+        if isinstance(frame, tuple):
+            start, end = frame
+        else:
+            start = end = frame
         grid = refPlane.isVisible()
         refPlane.setIsVisible(False)
-        persp = cur_desktop.paneTabOfType(
-            hou.paneTabType.SceneViewer).curViewport().name()
-        camera_path = f"{desktop}.{panetab}.world.{persp}"
-        temp = os.path.join(os.path.dirname(filename), "temp.jpg")
-        if filename is not None:
-            if object is False:
-                hou.hscript(
-                    f"viewwrite -R beauty -g 2.21 -f {frame} {frame} {camera_path} {temp}")
-            else:
-                hou.hscript(
-                    f"viewwrite -v {object} -R beauty -g 2.21 -f {frame} {frame} {camera_path} {temp}")
+        # Single quotes keep hscript from expanding $F before viewwrite does.
+        if object is False:
+            hou.hscript(
+                f"viewwrite -R beauty -g 2.21 -f {start} {end} {camera_path} '{filename}'")
+        else:
+            hou.hscript(
+                f"viewwrite -v {object} -R beauty -g 2.21 -f {start} {end} {camera_path} '{filename}'")
         refPlane.setIsVisible(grid)
-        if not os.path.isfile(temp):
-            return False
-        try:
-            img = Image.open(temp)
-            w, h = img.size
-            crop = min(w, h)
-            img2 = img.crop(((w - crop)//2,
-                            (h - crop)//2,
-                            (w + crop)//2,
-                            (h + crop)//2)).resize((192, 192))
-            img2.save(filename)
-            os.remove(temp)
-        except Exception as e:
-            utils.warningDialog(f"Unable to save thumbnail\nError: {e}")
+        return os.path.isfile(hou.expandStringAtFrame(filename, start))
+
+    @_traced('capture.thumbnail')
+    def _captureThumbnail(self, frame, filename, object):
+        from . import encode
+        with encode.scratchDir() as scratch:
+            temp = os.path.join(scratch, "frame.jpg")
+            if not self._renderFrame(frame, temp, object):
+                return False
+            try:
+                from PIL import Image
+                with Image.open(temp) as img:
+                    thumbnail = encode.cropSquare(img)
+                if not os.path.isdir(os.path.dirname(filename)):
+                    os.makedirs(os.path.dirname(filename))
+                thumbnail.save(filename)
+            except Exception as e:
+                utils.warningDialog(f"Unable to save thumbnail\nError: {e}")
         return True
 
     def keyPressEvent(self, event):
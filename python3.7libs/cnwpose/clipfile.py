@@ -0,0 +1,457 @@
+"""
+Binary clip storage.
+
+Layout (little endian):
+    magic       8 bytes   b'CNWCLIP\\x00'
+    version     uint32
+    header_len  uint32
+    header      utf-8 JSON, padded to an 8 byte boundary
+    data        one block per channel, each 8 byte aligned
+
+The header lists the numeric key fields, the string key fields, the interned
+string table and, per channel, the key count and byte offset of its block
+relative to the start of the data section. A channel block is a float64 array
+of shape (len(fields), keys), one contiguous row per field, followed by a
+uint32 array of shape (len(strfields), keys) indexing the string table.
+Missing numeric values are stored as NaN and missing strings as NO_STRING so
+keys written by Keyframe.asJSON() round-trip unchanged.
+
+Version 2 adds baked channels, marked 'kind': 'samples' in the header with
+their sample count, start time and rate (samples per second). Their block is
+a single contiguous float32 array, so it can be used straight from a memory
+map. Clips without baked channels are still written as version 1.
+
+The header's meta holds what capture knows about the clip (source frame
+range, fps, date, source object) plus a summary written by writeClip():
+'length' (end time in seconds), 'channels' and 'keys'. readInfo() returns it
+without reading any key data.
+
+readClip() can load a subset of the channels and a time window. It then
+seeks to each requested channel, reads its time row to find the window and
+reads only that slice of every field, so the rest of the file is never
+touched.
+
+Files written before this format are gzip'd JSON and are still read.
+
+Clips inside a library pack, see pack.py, are read from its memory map.
+
+numpy is imported by the functions that build or decode key data, readInfo()
+and the panel's startup path don't load it.
+"""
+
+import gzip
+import json
+import mmap
+import struct
+
+from . import pack
+from . import trace
+
+
+MAGIC = b'CNWCLIP\x00'
+VERSION = 2
+GZIP_MAGIC = b'\x1f\x8b'
+NO_STRING = 0xFFFFFFFF
+
+# Fields written by Keyframe.asJSON(), in the order they are stored.
+FIELDS = ('time', 'value', 'slope', 'inSlope', 'accel', 'accelRatio')
+STRFIELDS = ('expression', 'language')
+# Expression of the keys baked channels are converted to.
+SAMPLE_EXPRESSION = 'bezier()'
+
+_PREAMBLE = struct.Struct('<8sII')
+
+
+def _align(n):
+    return (n + 7) & ~7
+
+
+class Clip(object):
+    """Columnar clip data, one float array per field per channel.
+
+    Baked channels are kept in `samples` as (start, rate, values) and read
+    as bezier keys, one per sample, with slopes from the samples.
+    """
+
+    def __init__(self, fields=FIELDS, strfields=STRFIELDS, strings=None,
+                 bools=None, meta=None):
+        self.fields = tuple(fields)
+        self.strfields = tuple(strfields)
+        self.strings = list(strings or [])
+        self.bools = tuple(bools or ())
+        self.meta = dict(meta or {})
+        self.channels = {}
+        self.samples = {}
+
+    def __len__(self):
+        return len(self.channels) + len(self.samples)
+
+    def __contains__(self, name):
+        return name in self.channels or name in self.samples
+
+    def names(self):
+        return list(self.channels.keys()) + list(self.samples.keys())
+
+    def keyCount(self, name=None):
+        if name is not None:
+            if name in self.samples:
+                return len(self.samples[name][2])
+            return self.channels[name][0].shape[1]
+        return (sum(v[0].shape[1] for v in self.channels.values()) +
+                sum(len(v[2]) for v in self.samples.values()))
+
+    def addSamples(self, name, start, rate, values):
+        '''Add a baked channel sampled rate times a second from start.'''
+        import numpy as np
+        self.samples[name] = (float(start), float(rate),
+                              np.asarray(values, dtype='<f4'))
+
+    def sampleTimes(self, name):
+        import numpy as np
+        start, rate, values = self.samples[name]
+        return start + np.arange(len(values)) / rate
+
+    def _channel(self, name):
+        '''Return (values, strs) of a channel, converting baked ones.'''
+        import numpy as np
+        if name not in self.samples:
+            return self.channels[name]
+        start, rate, samples = self.samples[name]
+        n = len(samples)
+        t = self.sampleTimes(name)
+        v = samples.astype('<f8')
+        slopes = np.gradient(v, t) if n > 1 else np.zeros(n)
+        values = np.full((len(self.fields), n), np.nan, dtype='<f8')
+        for field, column in (('time', t), ('value', v), ('slope', slopes),
+                              ('inSlope', slopes)):
+            values[self.fields.index(field)] = column
+        strs = np.full((len(self.strfields), n), NO_STRING, dtype='<u4')
+        if 'expression' in self.strfields:
+            if SAMPLE_EXPRESSION not in self.strings:
+                self.strings.append(SAMPLE_EXPRESSION)
+            strs[self.strfields.index('expression')] = \
+                self.strings.index(SAMPLE_EXPRESSION)
+        return values, strs
+
+    def subset(self, names=None, window=None):
+        '''Return a clip with only the named channels and the keys or
+        samples between window[0] and window[1] seconds.'''
+        clip = Clip(self.fields, self.strfields, self.strings, self.bools,
+                    self.meta)
+        t = self.fields.index('time')
+        for name, (values, strs) in self.channels.items():
+            if names is None or name in names:
+                i0, i1 = _keyRange(values[t], window)
+                clip.channels[name] = (values[:, i0:i1], strs[:, i0:i1])
+        for name, (start, rate, values) in self.samples.items():
+            if names is None or name in names:
+                i0, i1 = _sampleRange(start, rate, len(values), window)
+                clip.samples[name] = (start + i0 / rate, rate,
+                                      values[i0:i1])
+        return clip
+
+    def toKeys(self):
+        '''Return a clip with baked channels converted to keys.'''
+        if not self.samples:
+            return self
+        channels = {name: self._channel(name) for name in self.names()}
+        clip = Clip(self.fields, self.strfields, self.strings, self.bools,
+                    self.meta)
+        clip.channels = channels
+        return clip
+
+    def column(self, name, field):
+        '''Return the array for a single field of a channel.'''
+        import numpy as np
+        values, strs = self._channel(name)
+        if field in self.fields:
+            return values[self.fields.index(field)]
+        idx = strs[self.strfields.index(field)]
+        return np.array([self.strings[i] if i != NO_STRING else None
+                         for i in idx], dtype=object)
+
+    def endTime(self):
+        import numpy as np
+        end = 0.0
+        t = self.fields.index('time')
+        for values, strs in self.channels.values():
+            if values.shape[1]:
+                end = max(end, float(np.nanmax(values[t])))
+        for start, rate, values in self.samples.values():
+            if len(values):
+                end = max(end, start + (len(values) - 1) / rate)
+        return end
+
+    def summary(self):
+        return {'length': self.endTime(), 'channels': len(self),
+                'keys': self.keyCount()}
+
+    def keys(self, name):
+        '''Return the keys of a channel as Keyframe.asJSON() dicts.'''
+        values, strs = self._channel(name)
+        keys = []
+        for i in range(values.shape[1]):
+            k = {}
+            for f, field in enumerate(self.fields):
+                v = values[f, i]
+                if v == v:
+                    k[field] = bool(v) if field in self.bools else float(v)
+            for s, field in enumerate(self.strfields):
+                idx = strs[s, i]
+                if idx != NO_STRING:
+                    k[field] = self.strings[idx]
+            keys.append(k)
+        return keys
+
+    def asJSON(self):
+        return {name: self.keys(name) for name in self.names()}
+
+    @classmethod
+    def fromJSON(cls, data, meta=None):
+        '''Build a clip from {channel: [Keyframe.asJSON(), ...]}.'''
+        import numpy as np
+        fields = list(FIELDS)
+        strfields = list(STRFIELDS)
+        bools = set()
+        for keys in data.values():
+            for k in keys:
+                for field, v in k.items():
+                    if field in fields or field in strfields:
+                        continue
+                    if isinstance(v, str):
+                        strfields.append(field)
+                    else:
+                        fields.append(field)
+                bools.update(f for f, v in k.items() if isinstance(v, bool))
+        clip = cls(fields, strfields, bools=bools, meta=meta)
+        lookup = {}
+        for name, keys in data.items():
+            n = len(keys)
+            values = np.full((len(fields), n), np.nan, dtype='<f8')
+            strs = np.full((len(strfields), n), NO_STRING, dtype='<u4')
+            for i, k in enumerate(keys):
+                for f, field in enumerate(fields):
+                    v = k.get(field)
+                    if v is not None:
+                        values[f, i] = v
+                for s, field in enumerate(strfields):
+                    v = k.get(field)
+                    if v is None:
+                        continue
+                    idx = lookup.get(v)
+                    if idx is None:
+                        idx = lookup[v] = len(clip.strings)
+                        clip.strings.append(v)
+                    strs[s, i] = idx
+            clip.channels[name] = (values, strs)
+        return clip
+
+
+def _keyRange(times, window):
+    import numpy as np
+    if window is None:
+        return 0, len(times)
+    return (int(np.searchsorted(times, window[0], 'left')),
+            int(np.searchsorted(times, window[1], 'right')))
+
+
+def _sampleRange(start, rate, count, window):
+    import numpy as np
+    if window is None:
+        return 0, count
+    i0 = int(np.ceil((window[0] - start) * rate - 1e-6))
+    i1 = int(np.floor((window[1] - start) * rate + 1e-6)) + 1
+    return min(max(i0, 0), count), min(max(i1, 0), count)
+
+
+@trace.traced('clip.write')
+def writeClip(filename, clip):
+    '''Write a Clip (or a legacy {channel: keys} dict) to filename.'''
+    import numpy as np
+    if not isinstance(clip, Clip):
+        clip = Clip.fromJSON(clip)
+    nf = len(clip.fields)
+    ns = len(clip.strfields)
+    channels = []
+    offset = 0
+    for name, (values, strs) in clip.channels.items():
+        n = values.shape[1]
+        channels.append({'name': name, 'keys': n, 'offset': offset})
+        offset += _align(n * nf * 8 + n * ns * 4)
+    for name, (start, rate, values) in clip.samples.items():
+        channels.append({'name': name, 'kind': 'samples',
+                         'samples': len(values), 'start': start,
+                         'rate': rate, 'offset': offset})
+        offset += _align(len(values) * 4)
+    header = json.dumps({
+        'fields': clip.fields,
+        'strfields': clip.strfields,
+        'bools': clip.bools,
+        'strings': clip.strings,
+        'channels': channels,
+        'meta': dict(clip.meta, **clip.summary()),
+    }).encode('UTF-8')
+    header += b' ' * (_align(_PREAMBLE.size + len(header)) -
+                      _PREAMBLE.size - len(header))
+    with open(filename, 'wb') as f:
+        version = VERSION if clip.samples else 1
+        f.write(_PREAMBLE.pack(MAGIC, version, len(header)))
+        f.write(header)
+        for values, strs in clip.channels.values():
+            size = values.nbytes + strs.nbytes
+            f.write(np.ascontiguousarray(values, dtype='<f8').tobytes())
+            f.write(np.ascontiguousarray(strs, dtype='<u4').tobytes())
+            f.write(b'\x00' * (_align(size) - size))
+        for start, rate, values in clip.samples.values():
+            data = np.ascontiguousarray(values, dtype='<f4').tobytes()
+            f.write(data + b'\x00' * (_align(len(data)) - len(data)))
+
+
+def _readHeader(buf):
+    magic, version, length = _PREAMBLE.unpack_from(buf, 0)
+    if magic != MAGIC:
+        raise IOError('Not a clip file')
+    if version > VERSION:
+        raise IOError(f'Unsupported clip file version {version}')
+    header = json.loads(bytes(buf[_PREAMBLE.size:_PREAMBLE.size + length])
+                        .decode('UTF-8'))
+    return header, _PREAMBLE.size + length
+
+
+def _readHeaderFrom(f):
+    '''Read the header from an open clip file, None for legacy files.'''
+    buf = f.read(_PREAMBLE.size)
+    if buf[:2] == GZIP_MAGIC:
+        return None, 0
+    if len(buf) < _PREAMBLE.size:
+        raise IOError('Not a clip file')
+    buf += f.read(_PREAMBLE.unpack(buf)[2])
+    return _readHeader(buf)
+
+
+@trace.traced('clip.info')
+def readInfo(filename):
+    '''Return a clip's meta dict, reading only the header. 'names' is
+    added with the channel names and 'baked' with those of baked channels.
+
+    Files without a summary in their header are read in full once.
+    '''
+    member = pack.read(filename)
+    if member is None:
+        with open(filename, 'rb') as f:
+            header, start = _readHeaderFrom(f)
+    elif member[:2] == GZIP_MAGIC:
+        header = None
+    else:
+        header, start = _readHeader(member)
+    if header is not None and 'length' in header['meta']:
+        return dict(header['meta'],
+                    names=[c['name'] for c in header['channels']],
+                    baked=[c['name'] for c in header['channels']
+                           if c.get('kind') == 'samples'])
+    clip = readClip(filename)
+    return dict(clip.meta, names=clip.names(), baked=list(clip.samples),
+                **clip.summary())
+
+
+def _readArray(f, offset, dtype, count):
+    import numpy as np
+    f.seek(offset)
+    data = f.read(count * np.dtype(dtype).itemsize)
+    return np.frombuffer(data, dtype=dtype, count=count)
+
+
+def _readPartial(filename, names, window):
+    import numpy as np
+    with open(filename, 'rb') as f:
+        header, start = _readHeaderFrom(f)
+        if header is None:
+            return None
+        clip = Clip(header['fields'], header['strfields'], header['strings'],
+                    header['bools'], header['meta'])
+        nf = len(clip.fields)
+        ns = len(clip.strfields)
+        t = clip.fields.index('time')
+        for c in header['channels']:
+            if names is not None and c['name'] not in names:
+                continue
+            offset = start + c['offset']
+            if c.get('kind') == 'samples':
+                i0, i1 = _sampleRange(c['start'], c['rate'], c['samples'],
+                                      window)
+                clip.samples[c['name']] = (
+                    c['start'] + i0 / c['rate'], c['rate'],
+                    _readArray(f, offset + i0 * 4, '<f4', i1 - i0))
+                continue
+            n = c['keys']
+            i0, i1 = 0, n
+            if window is not None:
+                i0, i1 = _keyRange(
+                    _readArray(f, offset + t * n * 8, '<f8', n), window)
+            m = i1 - i0
+            values = np.empty((nf, m), dtype='<f8')
+            for row in range(nf):
+                values[row] = _readArray(
+                    f, offset + (row * n + i0) * 8, '<f8', m)
+            strs = np.empty((ns, m), dtype='<u4')
+            for row in range(ns):
+                strs[row] = _readArray(
+                    f, offset + nf * n * 8 + (row * n + i0) * 4, '<u4', m)
+            clip.channels[c['name']] = (values, strs)
+    return clip
+
+
+@trace.traced('clip.read')
+def readClip(filename, names=None, window=None, mapped=False):
+    '''Read a clip file, binary or legacy gzip JSON, into a Clip.
+
+    names limits the channels read and window, a (start, end) pair of clip
+    times in seconds, the keys and samples. Legacy files are read in full
+    and cut down in memory.
+
+    With mapped set the arrays are views of a read-only memory map of the
+    file instead of a copy. On Windows the file can't be renamed or deleted
+    until the clip is released.
+
+    Clips in a pack are always views of the pack's map, a subset is cut
+    from them without copying.
+    '''
+    import numpy as np
+    buf = pack.read(filename)
+    if buf is None and (names is not None or window is not None) and \
+            not mapped:
+        clip = _readPartial(filename, names, window)
+        if clip is not None:
+            return clip
+    if buf is None:
+        with open(filename, 'rb') as f:
+            if mapped:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                buf = f.read()
+    if buf[:2] == GZIP_MAGIC:
+        clip = Clip.fromJSON(json.loads(gzip.decompress(buf[:])
+                                        .decode('UTF-8')))
+        if names is not None or window is not None:
+            clip = clip.subset(names, window)
+        return clip
+    header, start = _readHeader(buf)
+    clip = Clip(header['fields'], header['strfields'], header['strings'],
+                header['bools'], header['meta'])
+    nf = len(clip.fields)
+    ns = len(clip.strfields)
+    for c in header['channels']:
+        offset = start + c['offset']
+        if c.get('kind') == 'samples':
+            clip.samples[c['name']] = (c['start'], c['rate'], np.frombuffer(
+                buf, dtype='<f4', count=c['samples'], offset=offset))
+            continue
+        n = c['keys']
+        values = np.frombuffer(buf, dtype='<f8', count=nf * n,
+                               offset=offset).reshape(nf, n)
+        strs = np.frombuffer(buf, dtype='<u4', count=ns * n,
+                             offset=offset + nf * n * 8).reshape(ns, n)
+        clip.channels[c['name']] = (values, strs)
+    if names is not None or window is not None:
+        clip = clip.subset(names, window)
+    return clip
@@ -1,16 +1,15 @@
-import hou
-import json
-import gzip
-import sys
 import time
+_import_start = time.perf_counter()
+
+import hou
 
 from PySide2 import QtWidgets
-from PySide2 import QtCore
 
 from . import plglobals
 from . import header
 from . import capture
 from . import library
+from . import trace
 
 
 '''
@@ -23,6 +22,10 @@ if plglobals.debug == 1:
     reload(capture)
     reload(header)
     reload(library)
+    reload(trace)
+
+# Only the first panel of a session pays for the imports.
+_import_time = time.perf_counter() - _import_start
 
 
 class CnwPose(QtWidgets.QWidget):
@@ -33,16 +36,26 @@ class CnwPose(QtWidgets.QWidget):
         '''
         Build the interface
         '''
-        plglobals.debug = 1
+        global _import_time
+        self._start = time.perf_counter()
+        plglobals.startup.clear()
+        plglobals.startup['import'] = _import_time
+        _import_time = 0.0
+        trace.echo = plglobals.debug == 1
+        if plglobals.TRACE:
+            trace.enable(plglobals.TRACE_PROFILE,
+                         plglobals.TRACE_FILE or trace.defaultFile())
 
         # Init modules
-        self.header = header.UI()
-        self.capture = capture.UI()
-        self.library = library.UI()
+        with trace.span('startup.build'):
+            self.header = header.UI()
+            self.capture = capture.UI()
+            self.library = library.UI()
 
         # Signals and slots
         self.header.path.connect(self.library.refreshLibrary)
-        self.capture.capture.connect(self.library.refreshLibrary)
+        self.capture.capture.connect(self.library.updateLibrary)
+        self.library.scanned.connect(self._libraryScanned)
 
         self.tab_widget = QtWidgets.QTabWidget()
         self.tab_widget.addTab(self.capture, 'Capture')
@@ -53,3 +66,23 @@ class CnwPose(QtWidgets.QWidget):
         mainLayout.addWidget(self.header)
         mainLayout.addWidget(self.tab_widget)
         self.setLayout(mainLayout)
+        plglobals.startup['build'] = time.perf_counter() - self._start
+
+    def _libraryScanned(self, seconds):
+        '''Startup timing hook, the library's first scan runs once the
+        panel has painted and ends the startup.'''
+        self.library.scanned.disconnect(self._libraryScanned)
+        startup = plglobals.startup
+        startup['scan'] = seconds
+        startup['shown'] = (time.perf_counter() - self._start -
+                            startup['build'] - seconds)
+        startup['total'] = (startup['import'] + startup['build'] +
+                            startup['shown'] + seconds)
+        trace.event('startup', **startup)
+        if plglobals.debug == 1 or plglobals.STARTUP_REPORT:
+            message = (f"Pose Library started in "
+                       f"{startup['total'] * 1000:.0f} ms (" + ', '.join(
+                           f"{k} {startup[k] * 1000:.0f}"
+                           for k in ('import', 'build', 'shown', 'scan')) +
+                       ')')
+            hou.ui.setStatusMessage(message)
@@ -0,0 +1,348 @@
+import io
+import os
+import queue
+import struct
+import tempfile
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from . import plglobals
+from . import trace
+
+if plglobals.debug == 1:
+    from importlib import reload
+    reload(plglobals)
+    reload(trace)
+
+
+THUMB_SIZE = 192
+
+
+def cropSquare(img, size=THUMB_SIZE):
+    '''Center crop an image to a square and resize it to a thumbnail.'''
+    w, h = img.size
+    crop = min(w, h)
+    return img.crop(((w - crop)//2,
+                     (h - crop)//2,
+                     (w + crop)//2,
+                     (h + crop)//2)).resize((size, size))
+
+
+def scratchDir():
+    '''Return a TemporaryDirectory for rendered frames on local storage.
+
+    Uses CAPTURE_SCRATCH if set, else /dev/shm where it exists so frames
+    never leave memory, else the system temp directory.
+    '''
+    base = None
+    for d in (plglobals.CAPTURE_SCRATCH, '/dev/shm'):
+        if d and os.path.isdir(d) and os.access(d, os.W_OK):
+            base = d
+            break
+    return tempfile.TemporaryDirectory(prefix='cnwpose_', dir=base)
+
+
+class _AnimationWriter(object):
+    """Base for streaming animation writers.
+
+    Frames are written as they are added, only the previous frame is kept
+    to find the rectangle that changed. A frame identical to the previous
+    one extends its duration instead of being written. The animation is
+    streamed to <filename>.part and only replaces filename once closed, so
+    an aborted capture leaves the existing thumbnail alone.
+    """
+
+    def __init__(self, filename, duration):
+        self.filename = filename
+        self.duration = duration
+        self.frames = 0
+        self._temp = filename + '.part'
+        self._made_dir = None
+        self._file = None
+        self._previous = None
+        self._pending = None
+
+    def add(self, frame):
+        if self._file is None:
+            dir = os.path.dirname(self.filename)
+            if not os.path.isdir(dir):
+                os.makedirs(dir)
+                self._made_dir = dir
+            self._file = open(self._temp, 'wb')
+            self._writeHeader(frame)
+            bbox = (0, 0) + frame.size
+        else:
+            bbox = self._difference(self._previous, frame)
+        self.frames += 1
+        self._previous = frame
+        if bbox is None:
+            self._pending[1] += self.duration
+            return
+        self._flush()
+        self._pending = [frame.crop(bbox), self.duration, bbox[:2]]
+
+    def close(self):
+        if self._file is None:
+            return
+        self._flush()
+        self._writeTrailer()
+        self._file.close()
+        self._file = None
+        os.replace(self._temp, self.filename)
+
+    def abort(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        os.remove(self._temp)
+        if self._made_dir is not None:
+            # Only the folder this writer created, and only while empty.
+            try:
+                os.rmdir(self._made_dir)
+            except OSError:
+                pass
+
+    def _flush(self):
+        if self._pending is not None:
+            self._writeFrame(*self._pending)
+            self._pending = None
+
+    def _difference(self, previous, frame):
+        from PIL import ImageChops
+        return ImageChops.difference(previous, frame).getbbox()
+
+
+class GifWriter(_AnimationWriter):
+    """Streaming GIF writer using one global palette.
+
+    Every frame must be quantized to the palette of the first frame. Only
+    the rectangle that changed since the previous frame is stored, over
+    the previous frame left in place. Pillow encodes the LZW data of each
+    rectangle, which is then spliced into the stream.
+    """
+
+    def _writeHeader(self, frame):
+        self._palette = _gifImage(frame)[0].ljust(768, b'\x00')
+        w, h = frame.size
+        self._file.write(b'GIF89a' + struct.pack('<HHBBB', w, h, 0xF7, 0, 0))
+        self._file.write(self._palette)
+        # Loop forever
+        self._file.write(b'\x21\xFF\x0BNETSCAPE2.0\x03\x01\x00\x00\x00')
+
+    def _difference(self, previous, frame):
+        from PIL import Image
+        from PIL import ImageChops
+        # Compare palette indices, both frames share the palette.
+        return ImageChops.difference(
+            Image.frombytes('L', previous.size, previous.tobytes()),
+            Image.frombytes('L', frame.size, frame.tobytes())).getbbox()
+
+    def _writeFrame(self, image, duration, offset):
+        table, descriptor, data = _gifImage(image)
+        delay = int(round(duration / 10.0))
+        # Graphic control extension, disposal 1 keeps the previous frame.
+        self._file.write(struct.pack('<4BHBB', 0x21, 0xF9, 4, 1 << 2,
+                                     delay, 0, 0))
+        struct.pack_into('<HH', descriptor, 1, *offset)
+        if table and table != self._palette[:len(table)]:
+            bits = max(len(table) // 3 - 1, 1).bit_length()
+            descriptor[9] |= 0x80 | (bits - 1)
+            self._file.write(bytes(descriptor))
+            self._file.write(table.ljust(3 << bits, b'\x00'))
+        else:
+            self._file.write(bytes(descriptor))
+        self._file.write(data)
+
+    def _writeTrailer(self):
+        self._file.write(b'\x3B')
+
+
+def _gifImage(image):
+    '''Encode a P image with Pillow and split the result into its color
+    table, image descriptor and LZW data blocks.'''
+    buf = io.BytesIO()
+    image.save(buf, 'GIF', optimize=False)
+    data = buf.getvalue()
+    table = b''
+    pos = 13
+    if data[10] & 0x80:
+        size = 3 << ((data[10] & 7) + 1)
+        table = data[pos:pos + size]
+        pos += size
+    while data[pos] == 0x21:
+        pos += 2
+        while data[pos]:
+            pos += data[pos] + 1
+        pos += 1
+    descriptor = bytearray(data[pos:pos + 10])
+    pos += 10
+    if descriptor[9] & 0x80:
+        size = 3 << ((descriptor[9] & 7) + 1)
+        table = data[pos:pos + size]
+        pos += size
+        descriptor[9] &= 0x78
+    return table, descriptor, data[pos:-1]
+
+
+class WebPWriter(_AnimationWriter):
+    """Streaming animated WebP writer.
+
+    Each changed rectangle is encoded as a still WebP by Pillow and its
+    bitstream chunk is wrapped in an ANMF frame. The RIFF size is patched
+    in when the file is closed.
+    """
+    _KEEP = (b'ALPH', b'VP8 ', b'VP8L')
+
+    def _writeHeader(self, frame):
+        w, h = frame.size
+        self._file.write(b'RIFF\x00\x00\x00\x00WEBP')
+        self._chunk(b'VP8X', b'\x02\x00\x00\x00' + _u24(w - 1) +
+                    _u24(h - 1))
+        self._chunk(b'ANIM', b'\x00\x00\x00\x00' + struct.pack('<H', 0))
+
+    def _difference(self, previous, frame):
+        from PIL import ImageChops
+        bbox = ImageChops.difference(previous, frame).getbbox()
+        if bbox is None:
+            return None
+        # Frame offsets are stored divided by two.
+        return (bbox[0] & ~1, bbox[1] & ~1) + bbox[2:]
+
+    def _writeFrame(self, image, duration, offset):
+        buf = io.BytesIO()
+        image.save(buf, 'WEBP', quality=plglobals.WEBP_QUALITY, method=4)
+        data = buf.getvalue()
+        frame = b''
+        pos = 12
+        while pos < len(data):
+            tag = data[pos:pos + 4]
+            size = struct.unpack_from('<I', data, pos + 4)[0]
+            end = pos + 8 + size + (size & 1)
+            if tag in self._KEEP:
+                frame += data[pos:end]
+            pos = end
+        w, h = image.size
+        # No blending, no disposal: the rectangle replaces what is there.
+        self._chunk(b'ANMF', _u24(offset[0] // 2) + _u24(offset[1] // 2) +
+                    _u24(w - 1) + _u24(h - 1) +
+                    _u24(int(round(duration))) + b'\x02' + frame)
+
+    def _writeTrailer(self):
+        size = self._file.tell() - 8
+        self._file.seek(4)
+        self._file.write(struct.pack('<I', size))
+
+    def _chunk(self, tag, payload):
+        self._file.write(tag + struct.pack('<I', len(payload)) + payload)
+        if len(payload) & 1:
+            self._file.write(b'\x00')
+
+
+def _u24(value):
+    return struct.pack('<I', value)[:3]
+
+
+WRITERS = {'gif': GifWriter, 'webp': WebPWriter}
+
+
+@trace.traced('encode.load')
+def _loadFrame(source):
+    from PIL import Image
+    with Image.open(source) as img:
+        frame = cropSquare(img.convert('RGB'))
+    os.remove(source)
+    return frame
+
+
+@trace.traced('encode.quantize')
+def _quantizeFrame(source, palette=None):
+    '''Load a frame and quantize it, to the palette of the frame returned
+    by the palette future if given.'''
+    frame = _loadFrame(source)
+    if palette is None:
+        return frame.quantize(colors=256, dither=0)
+    return frame.quantize(palette=palette.result(), dither=0)
+
+
+class FramePipeline(object):
+    """Producer/consumer pipeline turning rendered frames into an animated
+    thumbnail.
+
+    The caller renders frames on the main thread and submit()s each file as
+    soon as it is written. Cropping, resizing and quantizing run on a pool
+    of worker threads while a writer thread streams finished frames to the
+    output in order. At most CAPTURE_IN_FLIGHT frames are held at once,
+    submit() waits for the writer beyond that, so memory does not grow
+    with the length of the clip.
+    """
+
+    def __init__(self, filename, fps, format=None):
+        self.format = format or plglobals.THUMB_FORMAT
+        self.filename = os.path.splitext(filename)[0] + '.' + self.format
+        self.writer = WRITERS[self.format](self.filename, (1.0/fps)*1000)
+        self._executor = ThreadPoolExecutor(
+            max_workers=plglobals.CAPTURE_WORKERS)
+        self._slots = threading.BoundedSemaphore(plglobals.CAPTURE_IN_FLIGHT)
+        self._queue = queue.Queue()
+        self._first = None
+        self._error = None
+        self._cancelled = False
+        self._thread = threading.Thread(target=self._drain)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, source):
+        self._slots.acquire()
+        if self.format != 'gif':
+            future = self._executor.submit(_loadFrame, source)
+        elif self._first is None:
+            future = self._first = self._executor.submit(
+                _quantizeFrame, source)
+        else:
+            future = self._executor.submit(
+                _quantizeFrame, source, self._first)
+        self._queue.put(future)
+
+    def _drain(self):
+        while True:
+            future = self._queue.get()
+            if future is None:
+                break
+            try:
+                frame = future.result()
+                if not self._cancelled and self._error is None:
+                    with trace.span('encode.write'):
+                        self.writer.add(frame)
+            except Exception as e:
+                if self._error is None:
+                    self._error = e
+            finally:
+                self._slots.release()
+
+    def _stop(self):
+        self._queue.put(None)
+        self._thread.join()
+        self._executor.shutdown()
+
+    @trace.traced('encode.finish')
+    def finish(self):
+        '''Wait for the remaining frames and close the file, returns its
+        name.'''
+        self._stop()
+        if self._error is not None:
+            self.writer.abort()
+            raise self._error
+        self.writer.close()
+        # A thumbnail captured earlier in another format would shadow this one.
+        for ext in WRITERS:
+            other = os.path.splitext(self.filename)[0] + '.' + ext
+            if other != self.filename and os.path.isfile(other):
+                os.remove(other)
+        return self.filename
+
+    def cancel(self):
+        self._cancelled = True
+        self._stop()
+        self.writer.abort()
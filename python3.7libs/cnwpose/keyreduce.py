@@ -0,0 +1,176 @@
+"""
+Keyframe reduction for captured clips.
+
+A key is removed when the curve through its kept neighbours, using their own
+slopes, stays within tolerance of the original curve at the removed keys and
+half way between them. bezier()/cubic() segments are compared as cubic
+Hermite curves and linear() segments as lines; keys with other expressions,
+missing slopes or a value discontinuity are always kept, as are the first
+and last key of a channel.
+
+Houdini's bezier() handles reach out by the key's accel, in seconds, and a
+handle of a third of the segment makes it the Hermite curve the fit was
+checked against. Where keys were removed the kept keys on either side had
+handles for the shorter segments they started with, so the accel and
+inAccel facing the removed span are set to a third of the new segment.
+Segments nothing was removed from keep their handles.
+
+The tolerance is a fraction of each channel's value range, at least one
+unit, so rotations in degrees and translations in metres reduce alike.
+Channels whose value does not change over the clip are dropped. Their
+slopes, in units per second, are checked against the tolerance as the value
+they add over their segment, so the test doesn't depend on the frame rate.
+"""
+
+import numpy as np
+
+from . import clipfile
+from . import plglobals
+
+if plglobals.debug == 1:
+    from importlib import reload
+    reload(clipfile)
+    reload(plglobals)
+
+
+HERMITE = ('bezier()', 'cubic()')
+LINEAR = ('linear()',)
+
+
+def _hermite(t, t0, v0, m0, t1, v1, m1):
+    dt = t1 - t0
+    s = (t - t0) / dt
+    s2 = s * s
+    s3 = s2 * s
+    return ((2*s3 - 3*s2 + 1) * v0 + (s3 - 2*s2 + s) * dt * m0 +
+            (-2*s3 + 3*s2) * v1 + (s3 - s2) * dt * m1)
+
+
+def _linear(t, t0, v0, t1, v1):
+    return v0 + (t - t0) / (t1 - t0) * (v1 - v0)
+
+
+class _Curve(object):
+    '''Column view of one channel used while reducing it.'''
+
+    def __init__(self, clip, name):
+        self.t = clip.column(name, 'time')
+        self.v = clip.column(name, 'value')
+        self.out = clip.column(name, 'slope')
+        self.inn = clip.column(name, 'inSlope')
+        expr = clip.column(name, 'expression') \
+            if 'expression' in clip.strfields \
+            else np.full(len(self.t), None, dtype=object)
+        # 0 cubic, 1 linear, -1 anything this can't evaluate
+        self.kind = np.array([0 if e in HERMITE or e is None else
+                              1 if e in LINEAR else -1 for e in expr])
+        self.fixed = (self.kind < 0) | ~np.isfinite(self.v)
+        self.fixed |= (self.kind == 0) & ~(np.isfinite(self.out) &
+                                           np.isfinite(self.inn))
+        if 'inValue' in clip.fields:
+            inv = clip.column(name, 'inValue')
+            self.fixed |= np.isfinite(inv) & (inv != self.v)
+        if len(self.t) > 1:
+            # Original curve half way along each segment.
+            self.mid_t = (self.t[:-1] + self.t[1:]) / 2
+            self.mid_v = self.segment(np.arange(len(self.t) - 1),
+                                      np.arange(1, len(self.t)), self.mid_t)
+
+    def segment(self, a, b, t):
+        '''Evaluate the segment from key a to key b at t.'''
+        cubic = _hermite(t, self.t[a], self.v[a], self.out[a],
+                         self.t[b], self.v[b], self.inn[b])
+        line = _linear(t, self.t[a], self.v[a], self.t[b], self.v[b])
+        return np.where(self.kind[a] == 1, line, cubic)
+
+    def fits(self, a, b, tolerance):
+        '''Whether keys a+1..b-1 can be removed.'''
+        inner = slice(a + 1, b)
+        if self.fixed[inner].any() or (self.kind[a:b] != self.kind[a]).any():
+            return False
+        t = np.concatenate((self.t[inner], self.mid_t[a:b]))
+        v = np.concatenate((self.v[inner], self.mid_v[a:b]))
+        return bool((np.abs(self.segment(a, b, t) - v) <= tolerance).all())
+
+    def reduce(self, tolerance):
+        '''Return the indices of the keys to keep.'''
+        n = len(self.t)
+        if n < 3:
+            return np.arange(n)
+        keep = [0]
+        a = 0
+        b = 2
+        while b < n:
+            if self.fits(a, b, tolerance):
+                b += 1
+                continue
+            a = b - 1
+            keep.append(a)
+            b = a + 2
+        keep.append(n - 1)
+        return np.array(keep)
+
+    def retime(self, keep, accel, in_accel):
+        '''Set the accel and inAccel rows of the kept keys facing a removed
+        span to a third of the new segment, in place.'''
+        merged = np.flatnonzero(np.diff(keep) > 1)
+        third = np.diff(self.t[keep])[merged] / 3.0
+        accel[merged] = third
+        in_accel[merged + 1] = third
+
+    def isConstant(self, tolerance):
+        '''Whether the values, and what the slopes add over their
+        segments, stay within tolerance.'''
+        if self.fixed.any() or np.ptp(self.v) > tolerance:
+            return False
+        dt = np.diff(self.t)
+        drift = np.concatenate((self.out[:-1] * dt, self.inn[1:] * dt))
+        return not (np.abs(drift[np.isfinite(drift)]) > tolerance).any()
+
+
+def reduceClip(clip, tolerance, drop_constant=True):
+    '''Return a reduced copy of clip and a stats dict with the key counts
+    'keys_before' and 'keys_after', the 'dropped' channel names and the
+    'ratio'.
+
+    Baked channels are fitted with keys.'''
+    clip = clip.toKeys()
+    fields = tuple(clip.fields)
+    if 'inAccel' not in fields:
+        fields += ('inAccel',)
+    result = clipfile.Clip(fields, clip.strfields, clip.strings,
+                           clip.bools, clip.meta)
+    a = fields.index('accel') if 'accel' in fields else None
+    ia = fields.index('inAccel')
+    dropped = []
+    for name, (values, strs) in clip.channels.items():
+        if len(fields) > len(clip.fields):
+            # inAccel defaults to accel, as in Houdini.
+            values = np.vstack((values, values[a:a + 1] if a is not None
+                                else np.full((1, values.shape[1]), np.nan)))
+        curve = _Curve(clip, name)
+        if not len(curve.t):
+            result.channels[name] = (values, strs)
+            continue
+        span = np.ptp(curve.v[np.isfinite(curve.v)]) \
+            if np.isfinite(curve.v).any() else 0.0
+        tol = tolerance * max(span, 1.0)
+        if curve.isConstant(tol):
+            dropped.append(name)
+            keep = np.arange(1)
+        else:
+            keep = curve.reduce(tol)
+        values = values[:, keep]
+        if a is not None:
+            curve.retime(keep, values[a], values[ia])
+        result.channels[name] = (values, strs[:, keep])
+    if drop_constant and len(dropped) < len(clip):
+        for name in dropped:
+            del result.channels[name]
+    else:
+        dropped = []
+    before = clip.keyCount()
+    after = result.keyCount()
+    return result, {'keys_before': before, 'keys_after': after,
+                    'dropped': dropped,
+                    'ratio': before / float(max(after, 1))}
@@ -1,29 +1,57 @@
-import collections
+import bisect
 import hou
-import os
-import psutil
+import time
 
 from PySide2 import QtWidgets
 from PySide2 import QtCore
 from PySide2.QtGui import QMovie
 
+from . import localcache
+from . import manifest
+from . import pack
 from . import plglobals
+from . import prefetch
+from . import search
 from . import sidebar
+from . import trace
+from . import utils
+from . import watcher
 from . import widgets
 
 if plglobals.debug == 1:
     from importlib import reload
+    reload(localcache)
+    reload(manifest)
+    reload(pack)
     reload(plglobals)
+    reload(prefetch)
+    reload(search)
     reload(sidebar)
+    reload(trace)
+    reload(utils)
+    reload(watcher)
     reload(widgets)
 
 
 class UI(QtWidgets.QWidget):
     """ Contains all the widgets to create the library interface."""
+    # Seconds the first scan took, emitted once it ran after the first show.
+    scanned = QtCore.Signal(float)
 
     def __init__(self, parent=None):
         super(UI, self).__init__()
         self.setStyleSheet("magin:5px;")
+        self._tiles = {}
+        self._order = []
+        self._scan_pending = True
+        self.index = search.SearchIndex()
+        self.watcher = watcher.LibraryWatcher(self)
+        self.watcher.changed.connect(self.updateLibrary)
+        # Watch the files of the tiles on screen once scrolling settles.
+        self._watch_timer = QtCore.QTimer(self)
+        self._watch_timer.setSingleShot(True)
+        self._watch_timer.setInterval(plglobals.WATCH_DEBOUNCE_MS)
+        self._watch_timer.timeout.connect(self._watchOnScreen)
         self._createUI()
 
     def __del__(self):
@@ -49,97 +77,304 @@ class UI(QtWidgets.QWidget):
         # Library Side
         if plglobals.debug == 1:
             self.lbl_mem = QtWidgets.QLabel()
-            self.lbl_mem.setText(
-                f"{psutil.Process().memory_info().rss / (1024 * 1024):.2f} Mb memory used")
+            self.lbl_mem.setText(self._memoryUsage())
             lib_layout.addWidget(self.lbl_mem)
         btn_layout = QtWidgets.QHBoxLayout()
         lib_layout.addLayout(btn_layout)
         btn_layout.addStretch()
         self.btn_r = QtWidgets.QPushButton('Reload')
-        self.btn_r.clicked.connect(self.refreshLibrary)
+        self.btn_r.clicked.connect(self.reloadLibrary)
         btn_layout.addWidget(self.btn_r)
         self.btn = QtWidgets.QPushButton('Clear')
         self.btn.clicked.connect(self._clearLibrary)
         btn_layout.addWidget(self.btn)
+        self.btn_pack = QtWidgets.QPushButton('Export Pack')
+        self.btn_pack.clicked.connect(self._exportPack)
+        btn_layout.addWidget(self.btn_pack)
+        self.chk_scrub = QtWidgets.QCheckBox('Scrub Previews')
+        self.chk_scrub.setChecked(plglobals.SCRUB_PREVIEW)
+        self.chk_scrub.toggled.connect(self._setScrub)
+        btn_layout.addWidget(self.chk_scrub)
+        if plglobals.debug == 1:
+            self.chk_trace = QtWidgets.QCheckBox('Trace')
+            self.chk_trace.setChecked(trace.isEnabled())
+            self.chk_trace.toggled.connect(self._setTrace)
+            btn_layout.addWidget(self.chk_trace)
         btn_layout.addStretch()
 
+        # Search
+        self.le_search = QtWidgets.QLineEdit()
+        self.le_search.setPlaceholderText(
+            'Search names and tags, or tag: type: ch: src: date:')
+        self.le_search.setClearButtonEnabled(True)
+        self.le_search.textChanged.connect(self._search)
+        lib_layout.addWidget(self.le_search)
+
         # Thumbnails
-        self.flow = widgets.ScrollingFlowWidget()
-        lib_layout.addWidget(self.flow)
+        if plglobals.VIRTUAL_GRID:
+            self.view = widgets.ThumbnailView()
+            self.view.clipSelected.connect(self.getClip)
+            self.view.clipDeleted.connect(self.updateLibrary)
+            self.view.clipRenamed.connect(self.updateLibrary)
+            self.view.clipTagged.connect(self.updateLibrary)
+            self.view.verticalScrollBar().valueChanged.connect(
+                lambda v: self._watch_timer.start())
+            lib_layout.addWidget(self.view)
+        else:
+            self.view = None
+            self.flow = widgets.ScrollingFlowWidget()
+            lib_layout.addWidget(self.flow)
 
         # Zoom widget
         self.zoom = QtWidgets.QSlider(QtCore.Qt.Horizontal)
         self.zoom.setMinimum(hou.ui.scaledSize(64))
         self.zoom.setMaximum(hou.ui.scaledSize(384))
         self.zoom.setValue(hou.ui.scaledSize(128))
-        self.zoom.valueChanged.connect(self._resizeBtns)
         lib_layout.addWidget(self.zoom)
+        # Coalesce slider ticks into one resize per frame.
+        self._zoom_timer = QtCore.QTimer(self)
+        self._zoom_timer.setSingleShot(True)
+        self._zoom_timer.setInterval(16)
+        self._zoom_timer.timeout.connect(self._resizeBtns)
+        self.zoom.valueChanged.connect(lambda v: self._zoom_timer.start())
+        self._resizeBtns()
 
-        self.refreshLibrary()
         self.setLayout(main_layout)
 
-    def refreshLibrary(self):
+    def showEvent(self, event):
+        super(UI, self).showEvent(event)
+        # Scan once the panel has painted rather than while it is built.
+        if self._scan_pending:
+            self._scan_pending = False
+            QtCore.QTimer.singleShot(0, self._firstScan)
+
+    def _firstScan(self):
+        start = time.perf_counter()
+        with trace.span('startup.scan'):
+            self.refreshLibrary()
+        self.scanned.emit(time.perf_counter() - start)
+
+    def refreshLibrary(self, full=False):
+        """ Rebuild every thumbnail from the library index """
         self._clearLibrary()
+        if plglobals.WATCH_LIBRARY:
+            self.watcher.setPath(plglobals.lib_path)
         try:
-            lib_dir = plglobals.lib_path
-            clips = []
-            for f in ('clip', 'pose'):
-                sub_dir = os.path.join(lib_dir, f)
-                if os.path.isdir(sub_dir):
-                    for i in os.listdir(sub_dir):
-                        clip_dir = os.path.join(sub_dir, i)
-                        if os.path.isdir(clip_dir):
-                            dict = {"name": i,
-                                    "dir": clip_dir,
-                                    "type": f}
-                            clips.append(dict)
-                            clips = sorted(
-                                clips, key=lambda c: c['name'].lower())
-            for i in clips:
-                clip = widgets.QImageThumbnail()
-                clip.setText(i['name'])
-                clip.setPath(i['dir'])
-                clip.setType(i['type'])
-                self.flow.addWidget(clip)
-                clip.clicked.connect(self.getClip)
-                clip.deleted.connect(self.refreshLibrary)
-                clip.rename.connect(self.refreshLibrary)
-                gif = os.path.join(i['dir'], i['name'] + '.gif')
-                jpg = os.path.join(i['dir'], i['name'] + '.jpg')
-                if os.path.isfile(gif):
-                    clip.setMovie(gif)
-                    self._resizeBtns()
-                elif os.path.isfile(jpg):
-                    clip.setImage(jpg)
-                    self._resizeBtns()
+            index = manifest.getManifest(plglobals.lib_path)
+            index.reconcile(full)
+            entries = index.entries()
+            localcache.warm(entries)
+            self.index.setEntries(entries)
+            if self.view is not None:
+                self.view.model().setEntries(entries)
+            else:
+                for i in entries:
+                    self._addTile(i, len(self._order))
+            self._search()
         except Exception as e:
-            if plglobals.debug == 1:
-                print(e)
-            pass
+            trace.error('library.refresh', e)
+        self._watch_timer.start()
+
+    def reloadLibrary(self):
+        """ Rescan every entry on disk rather than trusting folder mtimes """
+        self.refreshLibrary(full=True)
+
+    def _exportPack(self):
+        """ Write the library into a single pack file, see pack.py """
+        filename = hou.ui.selectFile(
+            title='Export Library Pack', pattern='*' + pack.PACK_EXT,
+            chooser_mode=hou.fileChooserMode.Write)
+        if not filename:
+            return
+        filename = hou.expandString(filename)
+        if not filename.endswith(pack.PACK_EXT):
+            filename += pack.PACK_EXT
+        try:
+            index = manifest.getManifest(plglobals.lib_path)
+            index.reconcile()
+            count = pack.writePack(index.entries(), filename)
+        except (IOError, OSError) as e:
+            utils.warningDialog(f"Unable to export the library.\nError: {e}",
+                                show_cancel=False)
+            return
+        hou.ui.setStatusMessage(f"Exported {count} entries to {filename}")
+
+    def _onScreen(self):
+        """ Return the selected and visible entries """
+        entries = []
+        if plglobals.clip['name']:
+            entries.append(manifest.getManifest(plglobals.lib_path).entry(
+                plglobals.clip['type'], plglobals.clip['name']))
+        if self.view is not None:
+            entries += self.view.visibleEntries()
+        return [e for e in entries if e is not None]
+
+    def _watchOnScreen(self):
+        if plglobals.WATCH_LIBRARY:
+            self.watcher.watchEntries(self._onScreen())
+
+    def updateLibrary(self):
+        """ Apply what changed on disk to the existing thumbnails """
+        check = set((e['type'], e['name']) for e in self._onScreen())
+        check |= self.watcher.takeTouched()
+        try:
+            changes = manifest.getManifest(plglobals.lib_path).reconcile(
+                check=check)
+        except Exception as e:
+            trace.error('library.update', e)
+            return
+        for i in changes['removed']:
+            self._removeTile(i)
+        for old, new in changes['renamed']:
+            self._removeTile(old)
+            self._addTile(new)
+            if plglobals.clip['dir'] == old['dir']:
+                plglobals.clip.update(name=new['name'], dir=new['dir'])
+        for i in changes['changed']:
+            self._removeTile(i)
+            self._addTile(i)
+        for i in changes['added']:
+            self._addTile(i)
+        self.index.applyChanges(changes)
+        prefetch.getPrefetcher().forget(
+            changes['removed'] + changes['changed'] +
+            [old for old, new in changes['renamed']])
+        localcache.warm(changes['added'] + changes['changed'] +
+                        [new for old, new in changes['renamed']])
+        if self.le_search.text().strip():
+            self._search()
+        self._watch_timer.start()
+
+    def _search(self):
+        """ Show only the entries matching the search box """
+        keys = self.index.search(self.le_search.text())
+        self._watch_timer.start()
+        if self.view is not None:
+            self.view.model().setFilter(keys)
+            return
+        self.flow.setUpdatesEnabled(False)
+        for key, clip in self._tiles.items():
+            clip.setVisible(keys is None or key in keys)
+        self.flow.flow_layout.invalidate()
+        self.flow.setUpdatesEnabled(True)
+
+    def _sortKey(self, entry):
+        return (entry['name'].lower(), entry['type'], entry['name'])
+
+    def _addTile(self, entry, index=None):
+        if self.view is not None:
+            self.view.model().insertEntry(entry)
+            if plglobals.clip['dir'] == entry['dir']:
+                self.view.selectEntry(entry)
+            return
+        key = self._sortKey(entry)
+        if index is None:
+            index = bisect.bisect(self._order, key)
+        self._order.insert(index, key)
+        clip = widgets.QImageThumbnail()
+        clip.setText(entry['name'])
+        clip.setPath(entry['dir'], entry['name'])
+        clip.setType(entry['type'])
+        clip.setFixedSize(self.zoom.value(), self.zoom.value()+26)
+        self.flow.insertWidget(index, clip)
+        clip.clicked.connect(self.getClip)
+        clip.deleted.connect(self.updateLibrary)
+        clip.rename.connect(self.updateLibrary)
+        clip.tagged.connect(self.updateLibrary)
+        thumb = localcache.resolve(entry['thumb'], entry['thumb_mtime'])
+        if entry['thumb_kind'] == 'movie':
+            clip.setMovie(thumb, entry['thumb_mtime'])
+        elif entry['thumb_kind'] == 'pixmap':
+            clip.setImage(thumb)
+        self._tiles[(entry['type'], entry['name'])] = clip
+
+    def _removeTile(self, entry):
+        if plglobals.clip['dir'] == entry['dir']:
+            self.sidebar._clear()
+        if self.view is not None:
+            self.view.model().removeEntry(entry)
+            return
+        clip = self._tiles.pop((entry['type'], entry['name']), None)
+        if clip is None:
+            return
+        key = self._sortKey(entry)
+        index = bisect.bisect_left(self._order, key)
+        if index < len(self._order) and self._order[index] == key:
+            del self._order[index]
+        clip.setParent(None)
+        clip.deleteLater()
 
     def getClip(self):
+        if self.view is None:
+            self._prefetchNeighbours()
         self.sidebar.updateClip()
+        self._watch_timer.start()
+
+    def _prefetchNeighbours(self):
+        """ Queue the clips of the tiles next to the selected one """
+        key = self._sortKey(plglobals.clip)
+        row = bisect.bisect_left(self._order, key)
+        index = manifest.getManifest(plglobals.lib_path)
+        neighbours = [self._order[i] for i in (row + 1, row - 1)
+                      if 0 <= i < len(self._order)]
+        prefetch.getPrefetcher().request(
+            [index.entry(k[1], k[2]) for k in neighbours])
+
+    def _setScrub(self, scrub):
+        plglobals.SCRUB_PREVIEW = scrub
+        if self.view is not None:
+            self.view.setScrub(scrub)
+
+    def _setTrace(self, on):
+        '''Start a new trace, or stop and write the current one.'''
+        if on:
+            trace.clear()
+            trace.enable(plglobals.TRACE_PROFILE)
+            return
+        trace.disable()
+        try:
+            filename = trace.export(plglobals.TRACE_FILE or None)
+        except (IOError, OSError) as e:
+            hou.ui.setStatusMessage(f'Unable to write the trace: {e}')
+            return
+        hou.ui.setStatusMessage(f'Trace written to {filename}')
 
     def _resizeBtns(self):
+        if self.view is not None:
+            self.view.setTileSize(self.zoom.value())
+            return
+        size = QtCore.QSize(self.zoom.value(), self.zoom.value()+26)
+        self.flow.setUpdatesEnabled(False)
+        self.flow.setUniformItemSize(size)
         count = self.flow.count()
         for i in range(count):
             item = self.flow.itemAt(i)
             if item is not None:
                 widget = item.widget()
                 if widget is not None:
-                    widget.setFixedSize(self.zoom.value(),
-                                        self.zoom.value()+26)
+                    widget.setFixedSize(size)
+        self.flow.setUpdatesEnabled(True)
 
     def _clearLibrary(self):
         self.sidebar._clear()
-        count = self.flow.count()
-        for i in range(count):
-            item = self.flow.itemAt(0)
-            if item is not None:
-                widget = item.widget()
-                if widget is not None:
-                    widget.setParent(None)
-                    del widget
+        self._tiles = {}
+        self._order = []
+        self.index.clear()
+        if self.view is not None:
+            self.view.model().setEntries([])
+        else:
+            count = self.flow.count()
+            for i in range(count):
+                item = self.flow.itemAt(0)
+                if item is not None:
+                    widget = item.widget()
+                    if widget is not None:
+                        widget.setParent(None)
+                        del widget
         if plglobals.debug == 1:
-            self.lbl_mem.setText(
-                f"{psutil.Process().memory_info().rss / (1024 * 1024):.2f} Mb memory used")
+            self.lbl_mem.setText(self._memoryUsage())
+
+    def _memoryUsage(self):
+        import psutil
+        return (f"{psutil.Process().memory_info().rss / (1024 * 1024):.2f} "
+                "Mb memory used")
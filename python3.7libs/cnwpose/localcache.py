@@ -0,0 +1,332 @@
+"""
+Local copy of a library kept on a network share.
+
+resolve() maps a file in the library to its copy under the user cache
+directory when the copy is current, otherwise it returns the path unchanged
+and queues a copy on a background thread, so only the first read of a file
+crosses the network. A copy is current while the share reports the mtime,
+and size when it is checked, the file was copied with. Thumbnails are
+checked against the mtime in the manifest without touching the share.
+
+When the library root can't be reached the last copy of a file is served
+instead of failing the read. Files that are gone from a reachable share are
+dropped from the cache.
+
+Copies are indexed in SQLite next to them with their last use, the least
+recently used are removed once the total passes LOCAL_CACHE_MB. Misses are
+copied before warm() requests, which queue the thumbnails of a library
+after it was scanned.
+"""
+
+import atexit
+import hashlib
+import hou
+import itertools
+import os
+import queue
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+
+from . import pack
+from . import plglobals
+from . import trace
+
+if plglobals.debug == 1:
+    from importlib import reload
+    reload(pack)
+    reload(plglobals)
+    reload(trace)
+
+
+DB_NAME = 'index.db'
+# Seconds a check of whether the library root is reachable is trusted.
+ONLINE_CHECK = 2.0
+# Queue priorities, lower first.
+MISS = 0
+WARM = 1
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    local TEXT NOT NULL,
+    mtime REAL,
+    size INTEGER,
+    used REAL
+);
+'''
+
+_caches = {}
+
+
+def userCacheDir():
+    '''Return LOCAL_CACHE_DIR, or the platform's per user cache dir.'''
+    if plglobals.LOCAL_CACHE_DIR:
+        return hou.expandString(plglobals.LOCAL_CACHE_DIR)
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    elif sys.platform == 'darwin':
+        base = os.path.expanduser('~/Library/Caches')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or \
+            os.path.expanduser('~/.cache')
+    return os.path.join(base, 'cnwpose')
+
+
+def getCache(lib_path):
+    '''Return the shared LocalCache of a library, None when disabled.'''
+    # A pack is read through its memory map, copy the whole file instead.
+    if not plglobals.LOCAL_CACHE or pack.isPack(lib_path):
+        return None
+    lib_path = os.path.normpath(lib_path)
+    cache = _caches.get(lib_path)
+    if cache is None:
+        digest = hashlib.sha1(lib_path.encode('UTF-8')).hexdigest()[:16]
+        cache = _caches[lib_path] = LocalCache(
+            lib_path, os.path.join(userCacheDir(), digest),
+            plglobals.LOCAL_CACHE_MB * 1024 * 1024)
+    return cache
+
+
+def resolve(path, mtime=None):
+    '''Return where to read a file of the current library from.'''
+    if not path:
+        return path
+    cache = getCache(plglobals.lib_path)
+    if cache is None:
+        return path
+    return cache.path(path, mtime)
+
+
+def warm(entries):
+    '''Queue copies of the thumbnails of manifest entries.'''
+    cache = getCache(plglobals.lib_path)
+    if cache is not None:
+        cache.warm((e['thumb'], e['thumb_mtime']) for e in entries)
+
+
+class LocalCache(object):
+    def __init__(self, lib_path, root, budget):
+        self.lib_path = lib_path
+        self.root = root
+        self.budget = budget
+        self.bytes = 0
+        self._files = {}
+        self._touched = set()
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._queue = queue.PriorityQueue()
+        self._queued = {}
+        self._order = itertools.count()
+        self._thread = None
+        self._online = (0.0, True)
+        try:
+            os.makedirs(root, exist_ok=True)
+            self.db = sqlite3.connect(os.path.join(root, DB_NAME),
+                                      check_same_thread=False)
+            self.db.executescript(_SCHEMA)
+        except (OSError, sqlite3.Error) as e:
+            # Nowhere to cache to, every read goes to the share.
+            trace.error('cache.open', e)
+            self.db = None
+            return
+        for path, local, mtime, size, used in self.db.execute(
+                'SELECT path, local, mtime, size, used FROM files'):
+            self._files[path] = [local, mtime, size, used]
+            self.bytes += size
+        atexit.register(self.flush)
+
+    def path(self, source, mtime=None):
+        '''Return the copy of source if it is current, else source.
+
+        Without an mtime the share is asked for the file's mtime and size.
+        '''
+        key = os.path.normpath(source)
+        if self.db is None or not key.startswith(self.lib_path + os.sep):
+            return source
+        with self._lock:
+            item = self._files.get(key)
+        size = None
+        if mtime is None:
+            try:
+                st = os.stat(key)
+                mtime, size = st.st_mtime, st.st_size
+            except OSError:
+                if item is not None and not self.isOnline():
+                    trace.count('cache.offline')
+                    return self._use(key, item)
+                if item is not None:
+                    self._drop(key)
+                return source
+        if item is not None and item[1] == mtime and \
+                (size is None or item[2] == size) and \
+                os.path.isfile(item[0]):
+            trace.count('cache.hit')
+            return self._use(key, item)
+        trace.count('cache.miss')
+        self.fetch(key, MISS)
+        return source
+
+    def isOnline(self):
+        '''Whether the library root can be reached.'''
+        checked, online = self._online
+        now = time.time()
+        if now - checked > ONLINE_CHECK:
+            online = os.path.isdir(self.lib_path)
+            self._online = (now, online)
+        return online
+
+    def warm(self, files):
+        '''Queue copies of (path, mtime) pairs that are not current.'''
+        if self.db is None:
+            return
+        for source, mtime in files:
+            if not source:
+                continue
+            key = os.path.normpath(source)
+            with self._lock:
+                item = self._files.get(key)
+            if item is None or item[1] != mtime:
+                self.fetch(key, WARM)
+
+    def fetch(self, source, priority=MISS):
+        '''Queue a copy of source.'''
+        with self._lock:
+            queued = self._queued.get(source)
+            if queued is not None and queued <= priority:
+                return
+            self._queued[source] = priority
+        self._queue.put((priority, next(self._order), source))
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._work)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _work(self):
+        while True:
+            priority, order, source = self._queue.get()
+            with self._lock:
+                if self._queued.get(source) != priority:
+                    continue
+                del self._queued[source]
+            try:
+                self._copy(source)
+            except Exception as e:
+                trace.error('cache.copy', e)
+
+    def _copy(self, source):
+        try:
+            st = os.stat(source)
+        except OSError:
+            return
+        with self._lock:
+            item = self._files.get(source)
+        if item is not None and item[1] == st.st_mtime and \
+                item[2] == st.st_size and os.path.isfile(item[0]):
+            return
+        digest = hashlib.sha1(source.encode('UTF-8')).hexdigest()
+        local = os.path.join(self.root, digest[:2],
+                             digest + os.path.splitext(source)[1])
+        temp = local + '.part'
+        with trace.span('cache.copy', path=source):
+            try:
+                os.makedirs(os.path.dirname(local), exist_ok=True)
+                shutil.copyfile(source, temp)
+                # Rewritten while copying, the next read fetches it again.
+                if os.stat(source).st_mtime != st.st_mtime:
+                    os.remove(temp)
+                    return
+                os.replace(temp, local)
+            except OSError as e:
+                trace.error('cache.copy', e)
+                try:
+                    os.remove(temp)
+                except OSError:
+                    pass
+                return
+        self._store(source, local, st.st_mtime, st.st_size)
+
+    def _use(self, key, item):
+        # Readers on pool threads race the copy thread's flush.
+        with self._lock:
+            item[3] = time.time()
+            self._touched.add(key)
+        return item[0]
+
+    def _store(self, key, local, mtime, size):
+        now = time.time()
+        with self._lock:
+            old = self._files.get(key)
+            if old is not None:
+                self.bytes -= old[2]
+            self._files[key] = [local, mtime, size, now]
+            self.bytes += size
+            evicted = self._evict(key)
+        with self._db_lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO files VALUES '
+                            '(?, ?, ?, ?, ?)', (key, local, mtime, size, now))
+            self.db.executemany('DELETE FROM files WHERE path = ?',
+                                [(k,) for k, path in evicted])
+            self._flushTouched()
+        for k, path in evicted:
+            self._remove(path)
+
+    def _evict(self, keep):
+        '''Forget the least recently used files over budget, returns their
+        (path, local) pairs.'''
+        evicted = []
+        if self.bytes <= self.budget:
+            return evicted
+        for key, item in sorted(self._files.items(),
+                                key=lambda i: i[1][3]):
+            if self.bytes <= self.budget:
+                break
+            if key == keep:
+                continue
+            del self._files[key]
+            self.bytes -= item[2]
+            evicted.append((key, item[0]))
+        trace.count('cache.evict', len(evicted))
+        return evicted
+
+    def _drop(self, key):
+        with self._lock:
+            item = self._files.pop(key, None)
+            if item is None:
+                return
+            self.bytes -= item[2]
+        with self._db_lock, self.db:
+            self.db.execute('DELETE FROM files WHERE path = ?', (key,))
+        self._remove(item[0])
+
+    def _remove(self, local):
+        try:
+            os.remove(local)
+        except OSError:
+            pass
+
+    def _flushTouched(self):
+        rows = []
+        with self._lock:
+            touched = self._touched
+            self._touched = set()
+            for key in touched:
+                item = self._files.get(key)
+                if item is not None:
+                    rows.append((item[3], key))
+        self.db.executemany('UPDATE files SET used = ? WHERE path = ?', rows)
+
+    def flush(self):
+        '''Store the last use of the files read since the last copy.'''
+        if self.db is None:
+            return
+        with self._lock:
+            if not self._touched:
+                return
+        try:
+            with self._db_lock, self.db:
+                self._flushTouched()
+        except sqlite3.Error:
+            pass
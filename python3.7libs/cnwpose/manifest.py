@@ -0,0 +1,463 @@
+"""
+On-disk index of the library, stored as SQLite in the library root.
+
+refreshLibrary() reads the entries with a single query. reconcile() brings
+the index up to date with the filesystem: a clip/pose folder is only listed
+again when its mtime changed, and an entry is only probed again when its
+mtime, the later of its folder's and its data file's, changed. Rewriting a
+clip in place, as a recapture does, changes neither the type folder nor
+always the entry folder, so entries written within MTIME_SETTLE and those
+the caller asks for, the tiles on screen, are checked on every reconcile.
+Every store and removal is journaled so callers can apply the difference to
+what they display instead of rebuilding it.
+
+Entries stored in the blob store are a ref file in the type folder rather
+than a folder, see blobstore.py. Their 'dir' is the ref file and 'data' and
+'thumb' are blobs, everything else reads them the same way.
+
+A lib_path ending in .cnwpack is a library pack, see pack.py. Its entries
+come from the pack's header into an in-memory index, PackManifest.
+
+Entries also carry what the search index needs: the channel names, source
+object and capture date from the clip header, and the user's tags. Tags are
+kept in a `<name>.tags` file next to the clip, one per line, so they move
+and sync with it and survive a rebuild of the index.
+"""
+
+import os
+import sqlite3
+import time
+
+from . import blobstore
+from . import clipfile
+from . import pack
+from . import plglobals
+from . import trace
+
+if plglobals.debug == 1:
+    from importlib import reload
+    reload(blobstore)
+    reload(clipfile)
+    reload(pack)
+    reload(plglobals)
+    reload(trace)
+
+
+DB_NAME = '.cnwpose.db'
+SCHEMA_VERSION = 5
+TYPES = ('clip', 'pose')
+THUMB_KINDS = (('movie', '.gif'), ('movie', '.webp'),
+               ('pixmap', '.jpg'))
+TAGS_EXT = '.tags'
+COLUMNS = ('name', 'type', 'dir', 'data', 'thumb', 'thumb_kind',
+           'thumb_mtime', 'length', 'channels', 'size', 'mtime',
+           'channel_names', 'source', 'date', 'tags')
+
+# Directory mtimes younger than this are not trusted, a second change within
+# the filesystem's timestamp resolution would otherwise go unnoticed.
+MTIME_SETTLE = 2.0
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (
+    name TEXT NOT NULL,
+    type TEXT NOT NULL,
+    dir TEXT NOT NULL,
+    data TEXT,
+    thumb TEXT,
+    thumb_kind TEXT,
+    thumb_mtime REAL,
+    length REAL,
+    channels INTEGER,
+    size INTEGER,
+    mtime REAL,
+    channel_names TEXT,
+    source TEXT,
+    date TEXT,
+    tags TEXT,
+    PRIMARY KEY (type, name)
+);
+CREATE INDEX IF NOT EXISTS entries_name ON entries (name COLLATE NOCASE);
+CREATE TABLE IF NOT EXISTS dirs (
+    dir TEXT PRIMARY KEY,
+    mtime REAL
+);
+'''
+
+_manifests = {}
+
+
+def getManifest(lib_path):
+    '''Return the shared Manifest for a library directory or pack.'''
+    lib_path = os.path.normpath(lib_path)
+    manifest = _manifests.get(lib_path)
+    if manifest is None:
+        cls = PackManifest if pack.isPack(lib_path) else Manifest
+        manifest = _manifests[lib_path] = cls(lib_path)
+    return manifest
+
+
+def entryMtime(dir, name):
+    '''Return the later of an entry folder's and its data file's mtime, the
+    ref file's for blob store entries.'''
+    mtime = os.stat(dir).st_mtime
+    if not blobstore.isRef(dir):
+        try:
+            mtime = max(mtime, os.stat(os.path.join(dir, name)).st_mtime)
+        except OSError:
+            pass
+    return mtime
+
+
+@trace.traced('scan.probe')
+def probe(clip_type, name, dir, mtime=None):
+    '''Build an entry dict for a clip folder from what is on disk.'''
+    if mtime is None:
+        mtime = entryMtime(dir, name)
+    entry = {'name': name, 'type': clip_type, 'dir': dir,
+             'data': os.path.join(dir, name), 'thumb': None,
+             'thumb_kind': None, 'thumb_mtime': None, 'length': 0.0,
+             'channels': 0, 'size': 0, 'mtime': mtime,
+             'channel_names': '', 'source': '', 'date': '',
+             'tags': ''}
+    thumbs = [(kind, os.path.join(dir, name + ext))
+              for kind, ext in THUMB_KINDS]
+    if blobstore.isRef(dir):
+        try:
+            ref = blobstore.readRef(dir)
+        except (IOError, ValueError) as e:
+            trace.error('scan.probe', e)
+            return entry
+        lib_path = blobstore.refLibrary(dir)
+        entry['data'] = blobstore.blobPath(lib_path, ref['data'])
+        thumbs = [(kind, blobstore.blobPath(lib_path, ref['thumb']))
+                  for kind, ext in THUMB_KINDS
+                  if ref.get('thumb') and ext == ref.get('thumb_ext')]
+    entry['tags'] = ' '.join(readTags(dir, name))
+    for kind, thumb in thumbs:
+        try:
+            entry['thumb_mtime'] = os.stat(thumb).st_mtime
+        except OSError:
+            continue
+        entry['thumb'] = thumb
+        entry['thumb_kind'] = kind
+        break
+    try:
+        entry['size'] = os.path.getsize(entry['data'])
+        info = clipfile.readInfo(entry['data'])
+        entry['length'] = info['length']
+        entry['channels'] = info['channels']
+        entry['channel_names'] = ' '.join(info['names'])
+        entry['source'] = info.get('source', '')
+        entry['date'] = info.get('date', '')
+    except (IOError, ValueError) as e:
+        trace.error('scan.probe', e)
+    return entry
+
+
+def _tag(tag):
+    return '_'.join(tag.lower().split())
+
+
+def readTags(dir, name):
+    '''Return the tags stored next to a clip, or in its ref.'''
+    if blobstore.isRef(dir):
+        try:
+            return blobstore.readRef(dir).get('tags', [])
+        except (IOError, ValueError):
+            return []
+    try:
+        with open(os.path.join(dir, name + TAGS_EXT)) as f:
+            return [t for t in (_tag(line) for line in f) if t]
+    except IOError:
+        return []
+
+
+def writeTags(dir, name, tags):
+    '''Store a clip's tags, lower case with spaces replaced by _.'''
+    tags = sorted(set(t for t in (_tag(t) for t in tags) if t))
+    if blobstore.isRef(dir):
+        ref = blobstore.readRef(dir)
+        ref['tags'] = tags
+        blobstore.writeRef(dir, ref)
+        return tags
+    filename = os.path.join(dir, name + TAGS_EXT)
+    if tags:
+        with open(filename, 'w') as f:
+            f.write('\n'.join(tags) + '\n')
+    elif os.path.isfile(filename):
+        os.remove(filename)
+    return tags
+
+
+class Manifest(object):
+    def __init__(self, lib_path):
+        self.lib_path = lib_path
+        self._changes = {}
+        self._open()
+
+    def _open(self):
+        # A library that doesn't exist yet, before the first capture, is
+        # indexed in memory until reconcile() finds its folder.
+        self._missing = not os.path.isdir(self.lib_path)
+        if not self._missing:
+            try:
+                self.db = self._connect(os.path.join(self.lib_path, DB_NAME))
+                return
+            except sqlite3.Error:
+                # Read-only library, keep the index in memory.
+                pass
+        self.db = self._connect(':memory:')
+
+    def _connect(self, filename):
+        db = sqlite3.connect(filename)
+        if db.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+            # The index is only a cache of the folders, rebuild it.
+            db.executescript('DROP TABLE IF EXISTS entries;'
+                             'DROP TABLE IF EXISTS dirs;')
+            db.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        db.executescript(_SCHEMA)
+        return db
+
+    def entries(self, clip_type=None):
+        '''Return every entry sorted by name, case insensitive.'''
+        query = f"SELECT {', '.join(COLUMNS)} FROM entries"
+        args = ()
+        if clip_type is not None:
+            query += ' WHERE type = ?'
+            args = (clip_type,)
+        query += ' ORDER BY name COLLATE NOCASE'
+        return [dict(zip(COLUMNS, row))
+                for row in self.db.execute(query, args)]
+
+    def entry(self, clip_type, name):
+        row = self.db.execute(
+            f"SELECT {', '.join(COLUMNS)} FROM entries "
+            "WHERE type = ? AND name = ?", (clip_type, name)).fetchone()
+        return dict(zip(COLUMNS, row)) if row else None
+
+    @trace.traced('scan')
+    def reconcile(self, full=False, check=()):
+        '''Sync the index with the library folders and return the changes.
+
+        Only folders whose mtime changed are listed, unless full is set.
+        The entries of the (type, name) keys in check are looked at even
+        when their folder is not listed.
+        '''
+        if not os.path.isdir(self.lib_path):
+            # Share unreachable or library gone, keep what is indexed.
+            return self.takeChanges()
+        if self._missing:
+            self._open()
+        now = time.time()
+        with self.db:
+            for clip_type in TYPES:
+                sub_dir = os.path.join(self.lib_path, clip_type)
+                try:
+                    dir_mtime = os.stat(sub_dir).st_mtime
+                except OSError:
+                    for (name,) in self.db.execute(
+                            'SELECT name FROM entries WHERE type = ?',
+                            (clip_type,)).fetchall():
+                        self._remove(clip_type, name)
+                    self.db.execute(
+                        'DELETE FROM dirs WHERE dir = ?', (clip_type,))
+                    continue
+                row = self.db.execute(
+                    'SELECT mtime FROM dirs WHERE dir = ?',
+                    (clip_type,)).fetchone()
+                if not full and row is not None and row[0] == dir_mtime:
+                    self._recheck(clip_type, set(
+                        name for t, name in check if t == clip_type))
+                    continue
+                self._scan(clip_type, sub_dir)
+                if now - dir_mtime > MTIME_SETTLE:
+                    self.db.execute(
+                        'INSERT OR REPLACE INTO dirs VALUES (?, ?)',
+                        (clip_type, dir_mtime))
+                else:
+                    self.db.execute(
+                        'DELETE FROM dirs WHERE dir = ?', (clip_type,))
+        return self.takeChanges()
+
+    def _scan(self, clip_type, sub_dir):
+        known = dict(self.db.execute(
+            'SELECT name, mtime FROM entries WHERE type = ?', (clip_type,)))
+        found = {}
+        for e in os.scandir(sub_dir):
+            if e.name.startswith('.'):
+                continue
+            if e.is_dir():
+                found[e.name] = e
+            elif blobstore.isRef(e.name):
+                # A folder of the same name wins over a ref.
+                found.setdefault(e.name[:-len(blobstore.REF_EXT)], e)
+        for name, e in found.items():
+            mtime = entryMtime(e.path, name)
+            if name not in known:
+                self._store(probe(clip_type, name, e.path, mtime), False)
+                continue
+            old = known.pop(name)
+            if old != mtime:
+                # A known mtime that moved is a rewrite even when the
+                # header reads the same.
+                self._store(probe(clip_type, name, e.path, mtime),
+                            force=old is not None)
+        for name in known:
+            self._remove(clip_type, name)
+
+    def _recheck(self, clip_type, names):
+        '''Probe the entries of names again, and those written within
+        MTIME_SETTLE, when their mtime or thumbnail's changed.'''
+        names = set(names)
+        names.update(name for (name,) in self.db.execute(
+            'SELECT name FROM entries WHERE type = ? AND mtime IS NULL',
+            (clip_type,)))
+        for name in names:
+            entry = self.entry(clip_type, name)
+            if entry is None:
+                continue
+            try:
+                mtime = entryMtime(entry['dir'], name)
+            except OSError:
+                self._remove(clip_type, name)
+                continue
+            try:
+                thumb_mtime = os.stat(entry['thumb']).st_mtime \
+                    if entry['thumb'] else None
+            except OSError:
+                thumb_mtime = None
+            if mtime != entry['mtime'] or \
+                    thumb_mtime != entry['thumb_mtime']:
+                self._store(probe(clip_type, name, entry['dir'], mtime),
+                            force=entry['mtime'] is not None)
+
+    def _store(self, entry, exists=True, force=False):
+        trace.count('scan.store')
+        key = (entry['type'], entry['name'])
+        old = self.entry(*key) if exists else None
+        if old is None:
+            state = 'added'
+        elif force or any(old[c] != entry[c]
+                          for c in COLUMNS if c != 'mtime'):
+            state = 'changed'
+        else:
+            state = None
+        if key in self._changes:
+            journaled = self._changes[key]
+            if journaled[0] == 'renamed':
+                state = 'renamed'
+                entry = (journaled[1][0], entry)
+            elif journaled[0] == 'added':
+                state = 'added'
+            elif state == 'added':
+                state = 'changed'
+        if state is not None:
+            self._changes[key] = (state, entry)
+        if state == 'renamed':
+            entry = entry[1]
+        if time.time() - entry['mtime'] <= MTIME_SETTLE:
+            entry = dict(entry, mtime=None)
+        self.db.execute(
+            f"INSERT OR REPLACE INTO entries ({', '.join(COLUMNS)}) "
+            f"VALUES ({', '.join('?' * len(COLUMNS))})",
+            tuple(entry[c] for c in COLUMNS))
+
+    def _remove(self, clip_type, name):
+        entry = self.entry(clip_type, name)
+        if entry is None:
+            return
+        key = (clip_type, name)
+        journaled = self._changes.get(key, (None,))
+        if journaled[0] == 'added':
+            del self._changes[key]
+        elif journaled[0] == 'renamed':
+            old = journaled[1][0]
+            del self._changes[key]
+            self._changes[(old['type'], old['name'])] = ('removed', old)
+        else:
+            self._changes[key] = ('removed', entry)
+        self.db.execute(
+            'DELETE FROM entries WHERE type = ? AND name = ?', key)
+
+    def update(self, clip_type, name):
+        '''Re-probe a single entry after it was written.'''
+        dir = os.path.join(self.lib_path, clip_type, name)
+        if not os.path.isdir(dir):
+            dir = blobstore.refPath(self.lib_path, clip_type, name)
+        if self._missing and os.path.isdir(self.lib_path):
+            self._open()
+        with self.db:
+            if os.path.exists(dir):
+                self._store(probe(clip_type, name, dir), force=True)
+            else:
+                self._remove(clip_type, name)
+
+    def remove(self, clip_type, name):
+        with self.db:
+            self._remove(clip_type, name)
+
+    def rename(self, clip_type, old_name, new_name):
+        '''Move an entry renamed on disk to its new name, journaled as a
+        rename rather than a removal and an addition.'''
+        old_key = (clip_type, old_name)
+        new_key = (clip_type, new_name)
+        old = self.entry(*old_key)
+        self.remove(clip_type, old_name)
+        self.update(clip_type, new_name)
+        if old is None or self._changes.get(old_key, (None,))[0] != 'removed':
+            return
+        journaled = self._changes.get(new_key, (None,))
+        if journaled[0] == 'added':
+            del self._changes[old_key]
+            self._changes[new_key] = ('renamed', (old, journaled[1]))
+
+    def takeChanges(self):
+        '''Return and clear the changes journaled since the last call.
+
+        The result has 'added', 'changed' and 'removed' entry lists and a
+        'renamed' list of (old entry, new entry) pairs of the renames made
+        through rename().
+        '''
+        changes = {'added': [], 'changed': [], 'removed': [], 'renamed': []}
+        for state, entry in self._changes.values():
+            changes[state].append(entry)
+        self._changes = {}
+        return changes
+
+
+class PackManifest(Manifest):
+    """Index of a library pack.
+
+    The pack is read-only, reconcile() only reads its header again when the
+    file was replaced, by a new export, and journals the difference.
+    """
+
+    def __init__(self, lib_path):
+        self.lib_path = lib_path
+        self._changes = {}
+        self._stat = None
+        self.db = self._connect(':memory:')
+
+    @trace.traced('scan')
+    def reconcile(self, full=False, check=()):
+        try:
+            library = pack.getPack(self.lib_path, reopen=True)
+        except (IOError, ValueError) as e:
+            # Pack unreachable or unreadable, keep what is indexed.
+            trace.error('scan', e)
+            return self.takeChanges()
+        if not full and library.stat == self._stat:
+            return self.takeChanges()
+        with self.db:
+            known = set(self.db.execute('SELECT type, name FROM entries'))
+            for entry in library.entries():
+                key = (entry['type'], entry['name'])
+                self._store(entry, key in known)
+                known.discard(key)
+            for key in known:
+                self._remove(*key)
+        self._stat = library.stat
+        return self.takeChanges()
+
+    def update(self, clip_type, name):
+        self.reconcile()
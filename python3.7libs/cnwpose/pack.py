@@ -0,0 +1,253 @@
+"""
+Single file library archive.
+
+writePack() copies the entries of a library into one file that is opened
+read-only with a memory map, so listing a library is reading one header and
+loading a clip or a thumbnail is a seek into the map. Point lib_path at a
+.cnwpack file to use it as a library, see manifest.PackManifest.
+
+Layout (little endian):
+    magic       8 bytes   b'CNWPACK\\x00'
+    version     uint32
+    header_len  uint32
+    header      utf-8 JSON, padded to an 8 byte boundary
+    table       uint64 array of shape (files, 2), offset and size per file
+    data        the files' content, each 8 byte aligned
+
+The header has the entries, what the manifest knows about them plus the
+index of their data and thumbnail in 'files', and 'files', the member names
+the table is in the order of. Members are named like the folder layout,
+'<type>/<name>/<name>[.ext]', so an entry's paths are
+'<pack>/<type>/<name>/<name>' and read() takes them the same way clipfile
+and the thumbnail loaders take files. Offsets are from the start of the
+file. Files with the same content are stored once.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+
+from . import trace
+
+
+MAGIC = b'CNWPACK\x00'
+VERSION = 1
+PACK_EXT = '.cnwpack'
+# Entry fields copied from the manifest, the paths are the pack's own.
+FIELDS = ('name', 'type', 'length', 'channels', 'size', 'channel_names',
+          'source', 'date', 'tags')
+THUMB_KINDS = {'.gif': 'movie', '.webp': 'movie', '.jpg': 'pixmap'}
+CHUNK = 1024 * 1024
+
+_PREAMBLE = struct.Struct('<8sII')
+_ROW = struct.Struct('<QQ')
+
+_packs = {}
+
+
+def _align(n):
+    return (n + 7) & ~7
+
+
+def isPack(path):
+    return bool(path) and os.path.normpath(path).endswith(PACK_EXT)
+
+
+def split(path):
+    '''Split a path inside a pack into the pack and the member name, None
+    for any other path.'''
+    i = path.find(PACK_EXT + os.sep)
+    if i < 0:
+        i = path.find(PACK_EXT + '/')
+        if i < 0:
+            return None
+    i += len(PACK_EXT)
+    return path[:i], path[i + 1:].replace(os.sep, '/')
+
+
+def getPack(filename, reopen=False):
+    '''Return the shared Pack of a file. With reopen set the file is opened
+    again if it was replaced since.'''
+    filename = os.path.normpath(filename)
+    library = _packs.get(filename)
+    if library is None or (reopen and library.isStale()):
+        # The old map stays valid for clips still viewing it.
+        library = _packs[filename] = Pack(filename)
+    return library
+
+
+def read(path):
+    '''Return a memoryview of a file inside a pack, None when path isn't
+    in a pack.'''
+    member = split(path)
+    if member is None:
+        return None
+    return getPack(member[0]).read(member[1])
+
+
+def _chunks(path):
+    '''Yield the content of a file, or of a file in a pack, in pieces of at
+    most CHUNK bytes.'''
+    data = read(path)
+    if data is not None:
+        for i in range(0, len(data), CHUNK):
+            yield data[i:i + CHUNK]
+        return
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK), b''):
+            yield chunk
+
+
+def _hash(path):
+    '''Return a file's SHA-256, size and first bytes.'''
+    digest = hashlib.sha256()
+    size = 0
+    head = b''
+    for chunk in _chunks(path):
+        if not size:
+            head = bytes(chunk[:12])
+        digest.update(chunk)
+        size += len(chunk)
+    return digest.digest(), size, head
+
+
+def _thumbExt(path, data):
+    ext = os.path.splitext(path)[1].lower()
+    if ext in THUMB_KINDS:
+        return ext
+    # Blob store thumbnails have no extension.
+    if data[:4] == b'GIF8':
+        return '.gif'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return '.webp'
+    return '.jpg'
+
+
+@trace.traced('pack.write')
+def writePack(entries, filename):
+    '''Write manifest entries into a pack, returns how many were written.
+
+    The files are hashed in a first pass to lay out the pack and copied into
+    it in a second, neither holds more than a CHUNK of a file in memory.
+    Entries whose clip data can't be read are skipped.'''
+    files = []
+    sources = []
+    index = {'entries': [], 'files': files}
+    for entry in entries:
+        try:
+            data = _hash(entry['data'])
+        except (IOError, TypeError) as e:
+            trace.error('pack.write', e)
+            continue
+        dir = entry['type'] + '/' + entry['name'] + '/'
+        item = {k: entry[k] for k in FIELDS}
+        item['data'] = len(files)
+        files.append(dir + entry['name'])
+        sources.append((entry['data'],) + data)
+        item['thumb'] = None
+        if entry['thumb']:
+            try:
+                thumb = _hash(entry['thumb'])
+            except IOError as e:
+                trace.error('pack.write', e)
+            else:
+                item['thumb'] = len(files)
+                files.append(dir + entry['name'] +
+                             _thumbExt(entry['thumb'], thumb[2]))
+                sources.append((entry['thumb'],) + thumb)
+        index['entries'].append(item)
+    header = json.dumps(index, sort_keys=True).encode('UTF-8')
+    header += b'\x00' * (_align(len(header)) - len(header))
+    table = bytearray(_ROW.size * len(files))
+    offset = _PREAMBLE.size + len(header) + len(table)
+    digests = {}
+    blocks = []
+    for i, (path, digest, size, head) in enumerate(sources):
+        if digest not in digests:
+            digests[digest] = offset
+            blocks.append((path, size))
+            offset += _align(size)
+        _ROW.pack_into(table, i * _ROW.size, digests[digest], size)
+    fd, temp = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(filename)), prefix='.tmp_',
+        suffix=PACK_EXT)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_PREAMBLE.pack(MAGIC, VERSION, len(header)))
+            f.write(header)
+            f.write(table)
+            for path, size in blocks:
+                written = 0
+                for chunk in _chunks(path):
+                    f.write(chunk)
+                    written += len(chunk)
+                if written != size:
+                    raise IOError(f'{path} changed while it was packed')
+                f.write(b'\x00' * (_align(size) - size))
+        os.replace(temp, filename)
+    except BaseException:
+        os.remove(temp)
+        raise
+    return len(index['entries'])
+
+
+class Pack(object):
+    '''A pack opened read-only.'''
+
+    def __init__(self, filename):
+        self.filename = filename
+        with trace.span('pack.open', path=filename):
+            with open(filename, 'rb') as f:
+                st = os.fstat(f.fileno())
+                self.stat = (st.st_mtime, st.st_size)
+                self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, length = _PREAMBLE.unpack_from(self.buf, 0)
+            if magic != MAGIC:
+                raise IOError('Not a library pack')
+            if version > VERSION:
+                raise IOError(f'Unsupported library pack version {version}')
+            start = _PREAMBLE.size
+            header = json.loads(bytes(self.buf[start:start + length])
+                                .rstrip(b'\x00').decode('UTF-8'))
+        self._entries = header['entries']
+        self._names = header['files']
+        self.files = {name: i for i, name in enumerate(self._names)}
+        self._table = start + length
+
+    def isStale(self):
+        '''Whether the file was replaced since it was opened.'''
+        try:
+            st = os.stat(self.filename)
+        except OSError:
+            return False
+        return (st.st_mtime, st.st_size) != self.stat
+
+    def read(self, name):
+        '''Return a memoryview of a member, raises IOError when there is
+        no such member.'''
+        i = self.files.get(name)
+        if i is None:
+            raise IOError(f'No {name} in {self.filename}')
+        offset, size = _ROW.unpack_from(self.buf, self._table + i * _ROW.size)
+        return memoryview(self.buf)[offset:offset + size]
+
+    def entries(self):
+        '''Return the entries as manifest entry dicts.'''
+        mtime = self.stat[0]
+        entries = []
+        for item in self._entries:
+            dir = os.path.join(self.filename, item['type'], item['name'])
+            entry = {k: item[k] for k in FIELDS}
+            entry.update(dir=dir, mtime=mtime,
+                         data=os.path.join(dir, item['name']),
+                         thumb=None, thumb_kind=None, thumb_mtime=None)
+            if item['thumb'] is not None:
+                name = self._names[item['thumb']]
+                entry['thumb'] = os.path.join(dir, name.rsplit('/', 1)[1])
+                entry['thumb_kind'] = THUMB_KINDS[os.path.splitext(name)[1]]
+                entry['thumb_mtime'] = mtime
+            entries.append(entry)
+        return entries
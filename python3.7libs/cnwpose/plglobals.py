@@ -1,13 +1,96 @@
 import hou
+import os
 
 # Global Variables
 global lib_path
 lib_path = hou.expandString('$HIP/Poses/')
+# Dev mode, set CNWPOSE_DEBUG=1 in the environment. Modules are reloaded on
+# every import so edits show up without restarting Houdini, and the panels
+# show debug info.
 global debug
-debug = 1
+debug = 1 if os.environ.get('CNWPOSE_DEBUG', '0') not in ('', '0') else 0
 global clip
 clip = {"name": '', "dir": '', "type": ''}
+# Seconds spent on each step of the last panel startup, see cnwpose.py.
+global startup
+startup = {}
 
 # User Variables
 CAP_HELP_TEXT = '''Select the channels in the Animation Editor Channel List. \
 Select the Time Range in the timeline.'''
+
+# Worker threads encoding captured frames while the viewport renders, and
+# how many captured frames may wait for the encoder at once.
+CAPTURE_WORKERS = 4
+CAPTURE_IN_FLIGHT = 16
+# Animated thumbnail format, 'gif' or 'webp'.
+THUMB_FORMAT = 'gif'
+WEBP_QUALITY = 80
+# 'keys' stores the keyframes of each channel, 'bake' evaluates every
+# channel BAKE_SUBSTEPS times a frame, following expressions and constraints.
+# Baked clips are fitted with keys when Reduce Keys is on.
+CAPTURE_CHANNELS = 'keys'
+BAKE_SUBSTEPS = 1
+# Remove keys the curve does not need when capturing a clip. The tolerance
+# is a fraction of each channel's value range, constant channels are dropped.
+REDUCE_KEYS = False
+REDUCE_TOLERANCE = 0.001
+REDUCE_DROP_CONSTANT = True
+# 'frame' renders and encodes frame by frame and can be cancelled with Esc,
+# 'range' renders the whole range with one viewwrite call.
+CAPTURE_MODE = 'frame'
+# Local directory for rendered frames, defaults to /dev/shm or the temp dir.
+CAPTURE_SCRATCH = ''
+
+# Library grid, the model/view grid only paints visible tiles. Set
+# VIRTUAL_GRID to False to use one QImageThumbnail widget per entry.
+VIRTUAL_GRID = True
+
+# Thumbnails are decoded in the background into a cache shared by the
+# library and the sidebar.
+THUMB_CACHE_MB = 256
+THUMB_THREADS = 4
+
+# Animated thumbnails only decode on hover. With SCRUB_PREVIEW the hovered
+# clip follows the mouse across the tile instead of playing.
+SCRUB_PREVIEW = False
+SCRUB_MAX_FRAMES = 120
+SCRUB_STRIP_CACHE = 4
+
+# Clips of the hovered tile and the tiles around the selection are read in
+# the background, so selecting them doesn't wait for the disk.
+PREFETCH = True
+PREFETCH_MB = 256
+PREFETCH_THREADS = 2
+
+# Library watcher, picks up changes from captures and other artists.
+WATCH_LIBRARY = True
+WATCH_DEBOUNCE_MS = 250
+WATCH_POLL_MS = 1000
+# Entries, the tiles on screen and the selection, whose own files are also
+# watched for recaptures.
+WATCH_MAX_ENTRIES = 200
+
+# Show how long the panel took to start in the status bar, always on in
+# dev mode.
+STARTUP_REPORT = False
+
+# Record spans and counters of scans, thumbnail decodes, clip reads, applies
+# and captures. The Chrome trace is written to TRACE_FILE, the temp dir when
+# empty, when Houdini exits, with a cProfile of the GUI thread next to it as
+# <file>.prof when TRACE_PROFILE is set.
+TRACE = False
+TRACE_PROFILE = False
+TRACE_FILE = ''
+
+# Local copy of clip data and thumbnails for libraries on network shares.
+# Files are copied in the background on first read and served from the copy
+# while it matches the share, or while the share can't be reached.
+# LOCAL_CACHE_DIR defaults to the user cache directory.
+LOCAL_CACHE = False
+LOCAL_CACHE_DIR = ''
+LOCAL_CACHE_MB = 2048
+
+# Store captures by content in <lib>/.blobs, with a small ref file per entry
+# instead of a folder, identical captures are stored once. See blobstore.py.
+BLOB_STORE = False
@@ -0,0 +1,210 @@
+"""
+Background reads of the clips likely to be selected next.
+
+The hovered tile and, once a tile is selected, the tiles around it are
+queued. A pool thread reads each clip's header, parses its data and, for
+animated thumbnails, reads the thumbnail's bytes into a ClipCache bounded
+by PREFETCH_MB. Selecting one of them then fills the sidebar from memory:
+getInfo() takes the header, ClipApplier cuts the channels it applies from
+the parsed clip and the thumbnail plays from a buffer.
+
+Entries are keyed by data path, mtime and size. The library also forgets
+the clips of entries the manifest reports changed, one rewritten within the
+manifest's MTIME_SETTLE has no mtime to tell the copies apart.
+"""
+
+import collections
+
+from PySide2 import QtCore
+
+from . import clipfile
+from . import localcache
+from . import pack
+from . import plglobals
+from . import trace
+
+if plglobals.debug == 1:
+    from importlib import reload
+    reload(clipfile)
+    reload(localcache)
+    reload(pack)
+    reload(plglobals)
+    reload(trace)
+
+
+# Queued reads past this are dropped for the newest requests, the cursor
+# has moved on from them.
+MAX_QUEUED = 16
+
+
+def entryKey(entry):
+    return (entry['data'], entry['mtime'], entry['size'])
+
+
+def clipBytes(clip):
+    '''Return the bytes held by a clip's arrays.'''
+    size = 0
+    for values, strs in clip.channels.values():
+        size += values.nbytes + strs.nbytes
+    for start, rate, values in clip.samples.values():
+        size += values.nbytes
+    return size
+
+
+class ClipCache(object):
+    """LRU of prefetched clips keyed by entryKey(), bounded in bytes."""
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.bytes = 0
+        self._items = collections.OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key):
+        item = self._items.get(key)
+        if item is None:
+            return None
+        self._items.move_to_end(key)
+        return item[0]
+
+    def put(self, key, item):
+        size = clipBytes(item['clip']) + len(item['thumb'] or b'')
+        self.discard(key)
+        self._items[key] = (item, size)
+        self.bytes += size
+        self._evict()
+
+    def discard(self, key):
+        item = self._items.pop(key, None)
+        if item is not None:
+            self.bytes -= item[1]
+
+    def discardIf(self, predicate):
+        for key in [k for k in self._items if predicate(k)]:
+            self.discard(key)
+
+    def clear(self):
+        self._items.clear()
+        self.bytes = 0
+
+    def _evict(self):
+        while self.bytes > self.budget and len(self._items) > 1:
+            key, item = self._items.popitem(last=False)
+            self.bytes -= item[1]
+
+
+class _LoadSignals(QtCore.QObject):
+    done = QtCore.Signal(object, object)
+
+
+class _LoadTask(QtCore.QRunnable):
+    '''Read and parse one clip on a pool thread.'''
+
+    def __init__(self, entry, signals):
+        super(_LoadTask, self).__init__()
+        self.entry = entry
+        self.signals = signals
+        self.setAutoDelete(True)
+
+    def run(self):
+        # Always report back, a key left in _pending is never read again.
+        entry = self.entry
+        result = None
+        try:
+            with trace.span('prefetch.clip', path=entry['data']):
+                filename = localcache.resolve(entry['data'])
+                result = {'info': clipfile.readInfo(filename),
+                          'clip': clipfile.readClip(filename),
+                          'thumb': None}
+                if entry['thumb_kind'] == 'movie':
+                    result['thumb'] = self._read(localcache.resolve(
+                        entry['thumb'], entry['thumb_mtime']))
+        except Exception as e:
+            result = None
+            trace.error('prefetch.clip', e)
+        finally:
+            self.signals.done.emit(entryKey(entry), result)
+
+    def _read(self, path):
+        data = pack.read(path)
+        if data is not None:
+            return data.tobytes()
+        with open(path, 'rb') as f:
+            return f.read()
+
+
+class Prefetcher(QtCore.QObject):
+    """Reads clips off the GUI thread into a shared ClipCache.
+
+    get() returns the cached clip, a dict with the 'info' readInfo()
+    returned, the parsed 'clip' and the 'thumb' bytes of animated
+    thumbnails, or None. request() queues entries, the most recent requests
+    are read first.
+    """
+    loaded = QtCore.Signal(object)
+
+    def __init__(self, parent=None):
+        super(Prefetcher, self).__init__(parent)
+        self.cache = ClipCache(plglobals.PREFETCH_MB * 1024 * 1024)
+        self.pool = QtCore.QThreadPool(self)
+        self.pool.setMaxThreadCount(plglobals.PREFETCH_THREADS)
+        self._pending = set()
+        self._failed = set()
+        self._priority = 0
+        self._signals = _LoadSignals(self)
+        self._signals.done.connect(self._onLoaded)
+
+    def get(self, entry):
+        if entry is None or not plglobals.PREFETCH:
+            return None
+        return self.cache.get(entryKey(entry))
+
+    def request(self, entries):
+        '''Queue entries, the first is read first.'''
+        if not plglobals.PREFETCH:
+            return
+        entries = [e for e in entries if e is not None and e['data'] and
+                   entryKey(e) not in self.cache and
+                   entryKey(e) not in self._pending and
+                   entryKey(e) not in self._failed]
+        if not entries:
+            return
+        if len(self._pending) + len(entries) > MAX_QUEUED:
+            self.cancel()
+        for entry in reversed(entries):
+            self._pending.add(entryKey(entry))
+            self._priority += 1
+            self.pool.start(_LoadTask(entry, self._signals), self._priority)
+        trace.count('prefetch.request', len(entries))
+
+    def forget(self, entries):
+        '''Drop the cached clips of changed or removed entries.'''
+        paths = set(e['data'] for e in entries)
+        self.cache.discardIf(lambda key: key[0] in paths)
+        self._failed = set(k for k in self._failed if k[0] not in paths)
+
+    def cancel(self):
+        '''Drop queued reads that have not started yet.'''
+        self.pool.clear()
+        self._pending.clear()
+
+    def _onLoaded(self, key, item):
+        self._pending.discard(key)
+        if item is None:
+            self._failed.add(key)
+            return
+        self.cache.put(key, item)
+        self.loaded.emit(key)
+
+
+_prefetcher = None
+
+
+def getPrefetcher():
+    '''Return the process wide Prefetcher.'''
+    global _prefetcher
+    if _prefetcher is None:
+        _prefetcher = Prefetcher()
+    return _prefetcher
@@ -0,0 +1,142 @@
+import collections
+import math
+
+from PySide2 import QtCore
+from PySide2 import QtGui
+
+from . import localcache
+from . import plglobals
+from . import thumbcache
+from . import trace
+
+if plglobals.debug == 1:
+    from importlib import reload
+    reload(localcache)
+    reload(plglobals)
+    reload(thumbcache)
+    reload(trace)
+
+
+# Recently scrubbed frame strips, keyed by (path, mtime, size).
+_strips = collections.OrderedDict()
+
+
+class _StripSignals(QtCore.QObject):
+    done = QtCore.Signal(object, object)
+
+
+class _StripTask(QtCore.QRunnable):
+    '''Decode the frames of an animated thumbnail, scaled to the tile.
+
+    Long clips are sampled down to SCRUB_MAX_FRAMES evenly spaced frames.
+    '''
+
+    def __init__(self, key, signals):
+        super(_StripTask, self).__init__()
+        self.key = key
+        self.signals = signals
+        self.setAutoDelete(True)
+
+    @trace.traced('thumb.strip')
+    def run(self):
+        path, mtime, size = self.key
+        reader = thumbcache.imageReader(localcache.resolve(path, mtime))
+        reader.setScaledSize(QtCore.QSize(size, size))
+        count = max(reader.imageCount(), 1)
+        step = max(int(math.ceil(count / float(plglobals.SCRUB_MAX_FRAMES))),
+                   1)
+        frames = []
+        i = 0
+        while True:
+            image = reader.read()
+            if image.isNull():
+                break
+            if i % step == 0:
+                frames.append(image)
+            i += 1
+        self.signals.done.emit(self.key, frames)
+
+
+class HoverPreview(QtCore.QObject):
+    """Animated preview of the hovered tile.
+
+    Nothing is decoded until start() is called on hover, and stop() drops
+    the decoder again. By default the clip plays with a QMovie. In scrub
+    mode the frames are decoded once into a strip and scrubTo() picks the
+    frame from the mouse position instead of a timer.
+    """
+    changed = QtCore.Signal()
+
+    def __init__(self, parent=None):
+        super(HoverPreview, self).__init__(parent)
+        self.path = None
+        self.scrub = False
+        self._key = None
+        self._movie = None
+        self._strip = None
+        self._frame = 0
+        self._signals = _StripSignals(self)
+        self._signals.done.connect(self._onStrip)
+
+    def isActive(self):
+        return self.path is not None
+
+    def start(self, path, size, scrub=False, mtime=None):
+        self.stop()
+        self.path = path
+        self.scrub = scrub
+        if scrub:
+            self._key = (path, mtime, size)
+            strip = _strips.get(self._key)
+            if strip is not None:
+                _strips.move_to_end(self._key)
+                self._strip = strip
+                self.changed.emit()
+            else:
+                QtCore.QThreadPool.globalInstance().start(
+                    _StripTask(self._key, self._signals))
+        else:
+            self._movie = thumbcache.movie(localcache.resolve(path, mtime))
+            self._movie.setParent(self)
+            self._movie.frameChanged.connect(self._onFrameChanged)
+            self._movie.start()
+
+    def stop(self):
+        if self._movie is not None:
+            self._movie.stop()
+            self._movie.deleteLater()
+            self._movie = None
+        self.path = None
+        self._key = None
+        self._strip = None
+        self._frame = 0
+
+    def scrubTo(self, fraction):
+        if not self._strip:
+            return
+        frame = min(max(int(fraction * len(self._strip)), 0),
+                    len(self._strip) - 1)
+        if frame != self._frame:
+            self._frame = frame
+            self.changed.emit()
+
+    def pixmap(self):
+        if self._movie is not None:
+            return self._movie.currentPixmap()
+        if self._strip:
+            return self._strip[self._frame]
+        return None
+
+    def _onFrameChanged(self, frame):
+        self.changed.emit()
+
+    def _onStrip(self, key, frames):
+        if not frames:
+            return
+        strip = [QtGui.QPixmap.fromImage(f) for f in frames]
+        _strips[key] = strip
+        while len(_strips) > plglobals.SCRUB_STRIP_CACHE:
+            _strips.popitem(last=False)
+        if key == self._key:
+            self._strip = strip
+            self.changed.emit()
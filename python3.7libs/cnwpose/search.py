@@ -0,0 +1,260 @@
+"""
+In-memory search index over the library entries.
+
+Entries get an integer id. Names are indexed by their substrings of one to
+NGRAM characters, each with an array of the ids whose name contains it.
+A substring's array is made the first time a query needs it, by testing
+only the names in the array of the substring one character shorter, so
+typing a term narrows the previous keystroke's ids instead of walking every
+entry. A longer term tests the names under its rarest substring. Tags,
+type and capture date are indexed as tokens with a sorted vocabulary for
+prefix lookups. Channel names and source paths are grouped by their
+distinct text, which a rig shares across many entries, and only the
+distinct texts are searched.
+
+add() and remove() touch one entry, so the index is kept current from the
+manifest's change journal instead of rebuilt. Removed ids stay in the
+arrays and are skipped until enough have piled up to rebuild them.
+
+A query is a list of space separated terms that must all match:
+    walk            name contains 'walk', or a tag starts with it
+    tag:loop        a tag starts with 'loop'
+    type:pose       clips or poses
+    ch:rx           a channel name starts with 'rx'
+    src:hand        the source object path contains 'hand'
+    date:2021-06    captured in June 2021
+"""
+
+import array
+import bisect
+
+from . import plglobals
+
+if plglobals.debug == 1:
+    from importlib import reload
+    reload(plglobals)
+
+
+TOKEN_FIELDS = ('tag', 'type', 'date')
+TEXT_FIELDS = ('name', 'ch', 'src')
+# Longest name substring with its own ids.
+NGRAM = 3
+# Removed ids kept before the name index is rebuilt without them.
+MAX_DEAD = 1000
+
+
+def entryKey(entry):
+    return (entry['type'], entry['name'])
+
+
+def _tokens(entry):
+    '''Return the (field, token) pairs of an entry.'''
+    tokens = set(('tag', t) for t in (entry.get('tags') or '').split())
+    tokens.add(('type', entry['type']))
+    if entry.get('date'):
+        tokens.add(('date', entry['date'][:10]))
+    return tokens
+
+
+def _text(entry):
+    '''Return the lower case channels and source of an entry.'''
+    channels = (entry.get('channel_names') or '').lower()
+    return {'ch': ' ' + channels,
+            'src': (entry.get('source') or '').lower()}
+
+
+def _substrings(text):
+    '''Return the distinct substrings of text up to NGRAM long.'''
+    return set(text[i:i + n] for n in range(1, NGRAM + 1)
+               for i in range(len(text) - n + 1))
+
+
+class SearchIndex(object):
+    def __init__(self):
+        self.clear()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def clear(self):
+        # key -> (id, tokens, texts, entry)
+        self._docs = {}
+        # id -> key and lower case name, None and '' once removed
+        self._keys = []
+        self._names = []
+        self._dead = 0
+        self._grams = {}
+        self._groups = {'ch': {}, 'src': {}}
+        self._postings = {}
+        self._vocab = {f: [] for f in TOKEN_FIELDS}
+
+    def setEntries(self, entries):
+        '''Rebuild the index from a full list of entries.'''
+        self.clear()
+        for entry in entries:
+            self._index(entry)
+        for field, token in self._postings:
+            self._vocab[field].append(token)
+        for vocab in self._vocab.values():
+            vocab.sort()
+
+    def add(self, entry):
+        key = entryKey(entry)
+        if key in self._docs:
+            self.remove(key)
+        for field, token in self._index(entry):
+            vocab = self._vocab[field]
+            i = bisect.bisect_left(vocab, token)
+            if i == len(vocab) or vocab[i] != token:
+                vocab.insert(i, token)
+        num = len(self._names) - 1
+        for gram in _substrings(self._names[num]):
+            ids = self._grams.get(gram)
+            if ids is not None:
+                ids.append(num)
+
+    def remove(self, key):
+        doc = self._docs.pop(key, None)
+        if doc is None:
+            return
+        num, tokens, texts, _ = doc
+        self._keys[num] = None
+        self._names[num] = ''
+        self._dead += 1
+        for field, text in texts.items():
+            ids = self._groups[field][text]
+            ids.discard(num)
+            if not ids:
+                del self._groups[field][text]
+        for posting in tokens:
+            ids = self._postings[posting]
+            ids.discard(num)
+            if not ids:
+                del self._postings[posting]
+                vocab = self._vocab[posting[0]]
+                i = bisect.bisect_left(vocab, posting[1])
+                if i < len(vocab) and vocab[i] == posting[1]:
+                    del vocab[i]
+        if self._dead > max(MAX_DEAD, len(self._docs)):
+            self.setEntries([doc[3] for doc in self._docs.values()])
+
+    def applyChanges(self, changes):
+        '''Update the index from Manifest.takeChanges().'''
+        for entry in changes['removed']:
+            self.remove(entryKey(entry))
+        for old, new in changes['renamed']:
+            self.remove(entryKey(old))
+            self.add(new)
+        for entry in changes['changed'] + changes['added']:
+            self.add(entry)
+
+    def _index(self, entry):
+        tokens = _tokens(entry)
+        texts = _text(entry)
+        key = entryKey(entry)
+        num = len(self._keys)
+        name = entry['name'].lower()
+        self._docs[key] = (num, tokens, texts, entry)
+        self._keys.append(key)
+        self._names.append(name)
+        for field, text in texts.items():
+            ids = self._groups[field].get(text)
+            if ids is None:
+                ids = self._groups[field][text] = set()
+            ids.add(num)
+        for posting in tokens:
+            ids = self._postings.get(posting)
+            if ids is None:
+                ids = self._postings[posting] = set()
+            ids.add(num)
+        return tokens
+
+    def _prefix(self, field, prefix):
+        '''Ids with a token of field starting with prefix.'''
+        vocab = self._vocab[field]
+        i = bisect.bisect_left(vocab, prefix)
+        result = set()
+        while i < len(vocab) and vocab[i].startswith(prefix):
+            result |= self._postings[(field, vocab[i])]
+            i += 1
+        return result
+
+    def _gram(self, gram):
+        '''Return the array of ids whose name contains gram, at most NGRAM
+        long. Removed ids may be in it.'''
+        ids = self._grams.get(gram)
+        if ids is None:
+            names = self._names
+            if len(gram) > 1:
+                within = [self._grams.get(gram[1:]), self._gram(gram[:-1])]
+                within = min((i for i in within if i is not None), key=len)
+                found = [i for i in within if gram in names[i]]
+            else:
+                found = [i for i, name in enumerate(names) if gram in name]
+            ids = self._grams[gram] = array.array('i', found)
+        return ids
+
+    def _name(self, ids, value):
+        '''Ids among ids, all if None, whose name contains value. Removed
+        ids may be among them.'''
+        if not value:
+            return set(range(len(self._names))) if ids is None else ids
+        if len(value) <= NGRAM:
+            found = self._gram(value)
+            return set(found) if ids is None else ids.intersection(found)
+        grams = [self._grams.get(value[i:i + NGRAM])
+                 for i in range(len(value) - NGRAM + 1)]
+        grams = [i for i in grams if i is not None]
+        rarest = min(grams, key=len) if grams else self._gram(value[:NGRAM])
+        if ids is None or len(rarest) < len(ids):
+            ids = rarest
+        names = self._names
+        return set(i for i in ids if value in names[i])
+
+    def _group(self, ids, field, value):
+        '''Ids among ids, all if None, whose text field matches.'''
+        if field == 'ch':
+            value = ' ' + value
+        found = set()
+        for text, members in self._groups[field].items():
+            if value in text:
+                found |= members
+        return found if ids is None else found & ids
+
+    def search(self, query):
+        '''Return the set of (type, name) keys matching query, or None
+        when the query is empty.'''
+        tokens = []
+        texts = []
+        for term in query.lower().split():
+            field, sep, value = term.partition(':')
+            if sep and field in TOKEN_FIELDS:
+                tokens.append((field, value))
+            elif sep and field in TEXT_FIELDS:
+                texts.append((field, value))
+            else:
+                texts.append((None, term))
+        if not tokens and not texts:
+            return None
+        result = None
+        for field, value in tokens:
+            ids = self._prefix(field, value)
+            result = ids if result is None else result & ids
+            if not result:
+                return set()
+        for field, value in sorted(texts, key=lambda t: -len(t[1])):
+            if field is None:
+                ids = self._name(result, value)
+                tags = self._prefix('tag', value)
+                ids |= tags if result is None else tags & result
+            elif field == 'name':
+                ids = self._name(result, value)
+            else:
+                ids = self._group(result, field, value)
+            result = ids
+            if not result:
+                return set()
+        keys = self._keys
+        found = {keys[i] for i in result}
+        found.discard(None)
+        return found
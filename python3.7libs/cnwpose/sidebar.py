@@ -1,27 +1,41 @@
-import gzip
 import hou
-import json
 import os
 from PySide2 import QtWidgets
-from PySide2 import QtGui
 from PySide2 import QtCore
+from . import apply
+from . import clipfile
+from . import localcache
+from . import manifest
 from . import plglobals
+from . import prefetch
+from . import thumbcache
 from . import utils
 
 if plglobals.debug == 1:
     from importlib import reload
+    reload(apply)
+    reload(clipfile)
+    reload(localcache)
+    reload(manifest)
     reload(plglobals)
+    reload(prefetch)
+    reload(thumbcache)
     reload(utils)
 
 
 class UI(QtWidgets.QWidget):
-    json_data = None
+    clip_info = {}
+    time_length = 0.0
+    applier = None
+    prefetched = None
     scale_tog = 0
+    thumb_key = None
 
     def __init__(self, parent=None):
         super(UI, self).__init__()
         self.setStyleSheet(hou.qt.styleSheet())
         self.setStyleSheet('margin-left: 5px; margin-right: 5px;')
+        thumbcache.getLoader().loaded.connect(self._thumbnailLoaded)
         self._createUI()
 
     def __del__(self):
@@ -66,9 +80,17 @@ class UI(QtWidgets.QWidget):
         form_layout.addRow(QtWidgets.QLabel('Clip Length'), self.lbl_length)
         form_layout.addRow(QtWidgets.QLabel(
             'Output Length'), self.lbl_length_out)
+        self.lbl_source = QtWidgets.QLabel()
+        form_layout.addRow(QtWidgets.QLabel('Source'), self.lbl_source)
+        self.lbl_date = QtWidgets.QLabel()
+        form_layout.addRow(QtWidgets.QLabel('Captured'), self.lbl_date)
         main_layout.addLayout(form_layout)
 
         # Settings
+        # Part of the clip to apply, in frames from the start of the clip.
+        self.if_range = hou.qt.InputField(hou.qt.InputField.IntegerType, 2)
+        self.if_range.valueChanged.connect(self._setOutLength)
+        form_layout.addRow(QtWidgets.QLabel('Clip Range'), self.if_range)
         self.scale = QtWidgets.QSlider(QtCore.Qt.Horizontal)
         self.scale.setMinimum(0)
         self.scale.setMaximum(400)
@@ -85,11 +107,14 @@ class UI(QtWidgets.QWidget):
         scale_layout.addWidget(self.scale)
         form_layout.addRow(QtWidgets.QLabel('Time Scale'), scale_layout)
         self.combo = QtWidgets.QComboBox()
-        self.combo.addItem('Insert')
-        self.combo.addItem('Merge')
-        self.combo.addItem('Replace')
-        self.combo.addItem('Replace All')
+        for method in apply.METHODS:
+            self.combo.addItem(method)
         form_layout.addRow(QtWidgets.QLabel('Insertion Method'), self.combo)
+        self.if_weight = hou.qt.InputField(hou.qt.InputField.FloatType, 1)
+        self.if_weight.setValue(1.0)
+        self.combo.currentTextChanged.connect(self._methodChanged)
+        self._methodChanged(self.combo.currentText())
+        form_layout.addRow(QtWidgets.QLabel('Blend Weight'), self.if_weight)
         # self.combo.setEnabled(False)
         self.btn_apply = QtWidgets.QPushButton('Apply')
         self.btn_apply.clicked.connect(self.applyJSON)
@@ -107,10 +132,13 @@ class UI(QtWidgets.QWidget):
         except AttributeError:
             pass
         self.thumb.clear()
+        self.thumb_key = None
         self.lbl_name.setText('')
         self.lbl_type.setText('')
         self.lbl_length.setText('')
         self.lbl_length_out.setText('')
+        self.lbl_source.setText('')
+        self.lbl_date.setText('')
         self.scale.setValue(100)
         if plglobals.debug == 1:
             self.te_debug.setPlainText('')
@@ -130,9 +158,28 @@ class UI(QtWidgets.QWidget):
         self.scale.setValue(self.if_scale.value()*100.0)
         self._setOutLength()
 
+    def _methodChanged(self, method):
+        # The weight scales the clip layered over the existing animation.
+        self.if_weight.setEnabled(method == 'Merge')
+
+    def _clipFrames(self):
+        return int(round(self.getTimeLength() * hou.fps()))
+
+    def _window(self):
+        '''Return the clip range as (start, end) seconds, None for the
+        whole clip.'''
+        start, end = self.if_range.values()
+        start = min(max(start, 0), self._clipFrames())
+        end = min(max(end, start), self._clipFrames())
+        if (start, end) == (0, self._clipFrames()):
+            return None
+        return (start / hou.fps(), end / hou.fps())
+
     def _setOutLength(self):
         mult = max(self.scale.value(), 1)
-        val = hou.timeToFrame(self.getTimeLength() / (mult / 100.0))
+        window = self._window()
+        length = window[1] - window[0] if window else self.getTimeLength()
+        val = hou.timeToFrame(length / (mult / 100.0))
         self.lbl_length_out.setText(str(val))
         try:
             self.movie.setSpeed(mult)
@@ -140,28 +187,44 @@ class UI(QtWidgets.QWidget):
             pass
 
     def updateClip(self):
-        self.getJSON()
+        self.getInfo()
         self.setThumbnail()
         self.setInfo()
         self.scale.setValue(100)
 
-    def getJSON(self):
-        filename = os.path.join(plglobals.clip['dir'], plglobals.clip['name'])
-        if os.path.isfile(filename):
-            with gzip.open(filename, 'rt', encoding='UTF-8') as zipfile:
-                self.json_data = json.load(zipfile)
-            if plglobals.debug == 1:
-                self.te_debug.setPlainText('')
-                self.te_debug.insertPlainText(
-                    f"{plglobals.clip['name']}\n{plglobals.clip['dir']}\n{self.json_data}")
+    def getInfo(self):
+        '''Read the clip header. Channel data is only read when applying,
+        and then only for the selected channels and clip range. A clip the
+        prefetcher already read is taken from memory.'''
+        entry = manifest.getManifest(plglobals.lib_path).entry(
+            plglobals.clip['type'], plglobals.clip['name'])
+        filename = localcache.resolve(
+            entry['data'] if entry is not None else
+            os.path.join(plglobals.clip['dir'], plglobals.clip['name']))
+        self.applier = None
+        self.prefetched = prefetch.getPrefetcher().get(entry)
+        clip = None
+        if self.prefetched is not None:
+            self.clip_info = self.prefetched['info']
+            clip = self.prefetched['clip']
+        else:
+            try:
+                self.clip_info = clipfile.readInfo(filename)
+            except (IOError, ValueError):
+                self.clip_info = {}
+        self.time_length = self.clip_info.get('length', 0.0)
+        if self.clip_info:
+            self.applier = apply.ClipApplier(
+                filename, self.time_length, clip,
+                bool(self.clip_info.get('baked')))
+        if plglobals.debug == 1:
+            self.te_debug.setPlainText(
+                f"{plglobals.clip['name']}\n{plglobals.clip['dir']}\n"
+                f"{self.clip_info.get('channels', 0)} channels, "
+                f"{self.clip_info.get('keys', 0)} keys")
 
     def getTimeLength(self):
-        end = 0.0
-        if self.json_data != None:
-            for parm in self.json_data:
-                for k in self.json_data[parm]:
-                    end = max(end, k['time'])
-        return end
+        return self.time_length
 
     def setInfo(self):
         self.lbl_name.setText(
@@ -169,21 +232,33 @@ class UI(QtWidgets.QWidget):
         self.lbl_type.setText(plglobals.clip['type'].capitalize())
         self.lbl_length.setText(
             f"{hou.timeToFrame(self.getTimeLength())}")
+        self.lbl_source.setText(self.clip_info.get('source', ''))
+        self.lbl_date.setText(self.clip_info.get('date', ''))
+        self.if_range.setValues([0, self._clipFrames()])
         self._setOutLength()
 
     def setThumbnail(self):
         self.thumb.clear()
-        gif = os.path.join(
-            plglobals.clip['dir'], plglobals.clip['name'] + '.gif')
-        jpg = os.path.join(
-            plglobals.clip['dir'], plglobals.clip['name'] + '.jpg')
-        if os.path.isfile(gif):
-            self.movie = QtGui.QMovie(gif)
+        self.thumb_key = None
+        entry = manifest.getManifest(plglobals.lib_path).entry(
+            plglobals.clip['type'], plglobals.clip['name'])
+        if entry is None or entry['thumb'] is None:
+            return
+        if entry['thumb_kind'] == 'movie':
+            self.movie = thumbcache.movie(
+                localcache.resolve(entry['thumb'], entry['thumb_mtime']),
+                self.prefetched['thumb'] if self.prefetched else None)
             self.thumb.setMovie(self.movie)
             self.movie.start()
-        elif os.path.isfile(jpg):
-            self.pixmap = QtGui.QPixmap(jpg)
-            self.thumb.setPixmap(self.pixmap)
+        else:
+            self.thumb_key = (entry['thumb'], entry['thumb_mtime'])
+            pixmap = thumbcache.getLoader().pixmap(*self.thumb_key)
+            if pixmap is not None:
+                self.thumb.setPixmap(pixmap)
+
+    def _thumbnailLoaded(self, key):
+        if key == self.thumb_key:
+            self.thumb.setPixmap(thumbcache.getLoader().cache.get(key))
 
     def _selectChannels(self):
         selection = hou.playbar.channelList().selected()
@@ -192,7 +267,7 @@ class UI(QtWidgets.QWidget):
         return selection
 
     def applyJSON(self):
-        if self.json_data == None:
+        if self.applier is None:
             utils.warningDialog("No Clip/Pose Data")
             return False
         sel = utils.selectChannels()
@@ -201,47 +276,8 @@ class UI(QtWidgets.QWidget):
         if len(sel) == 0:
             utils.warningDialog("No Object/Channels Selected")
             return False
-        frame = hou.frame()
-        time = hou.frameToTime(hou.frame())
-        length = self.getTimeLength()
         mult = max(self.if_scale.value(), 0.01)
-        length = hou.timeToFrame(length / mult)
-        method = self.combo.currentText()
-        jsn = self.json_data
-        if method == "Insert":
-            print('Insert')
-            for c in sel:
-                c_frames = c.keyframesAfter(frame)
-                for k in c_frames:
-                    c.deleteKeyframeAtFrame(k.frame())
-                    k.setFrame(k.frame() + length)
-                c.setKeyframes(c_frames)
-        elif method == "Merge":
-            print('Merge')
-            for c in sel:
-                for p, v in jsn.items():
-                    if c.name() == p:
-                        for k in v:
-                            k['value'] = k['value'] + c.evalAtTime(k['time'])
-                c_frames = c.keyframesInRange(frame, frame+length)
-                for k in c_frames:
-                    c.deleteKeyframeAtFrame(k.frame())
-        elif method == "Replace":
-            print('Replace')
-            for c in sel:
-                c_frames = c.keyframesInRange(frame, frame+length)
-                for k in c_frames:
-                    c.deleteKeyframeAtFrame(k.frame())
-        elif method == "Replace All":
-            for c in sel:
-                c.deleteAllKeyframes()
-        for p, v in jsn.items():
-            for c in sel:
-                if c.name() == p:
-                    c.setScope(True)
-                    for k in v:
-                        frame = hou.Keyframe()
-                        frame.fromJSON(k)
-                        frame.setTime((frame.time() / mult) + time)
-                        c.setKeyframe(frame)
-        self.getJSON()
+        self.applier.apply(sel, self.combo.currentText(), mult,
+                           window=self._window(),
+                           weight=self.if_weight.value())
+        return True
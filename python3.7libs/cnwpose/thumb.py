@@ -2,7 +2,7 @@ import random
 import glob
 import os
 
-from PIL import Image
+from . import encode
 
 
 def placeholder(filepath):
@@ -12,11 +12,6 @@ def placeholder(filepath):
     jpg = glob.glob(path)
     if len(jpg) == 0:
         return False
-    img = Image.open(random.choice(jpg))
-    w, h = img.size
-    crop = min(w, h)
-    img2 = img.crop(((w - crop)//2,
-                     (h - crop)//2,
-                     (w + crop)//2,
-                     (h + crop)//2)).resize((192, 192))
-    img2.save(filepath)
+    from PIL import Image
+    with Image.open(random.choice(jpg)) as img:
+        encode.cropSquare(img).save(filepath)
@@ -0,0 +1,183 @@
+import collections
+
+from PySide2 import QtCore
+from PySide2 import QtGui
+
+from . import localcache
+from . import pack
+from . import plglobals
+from . import trace
+
+if plglobals.debug == 1:
+    from importlib import reload
+    reload(localcache)
+    reload(pack)
+    reload(plglobals)
+    reload(trace)
+
+
+def _buffer(data):
+    device = QtCore.QBuffer()
+    device.setData(QtCore.QByteArray(data))
+    device.open(QtCore.QIODevice.ReadOnly)
+    return device
+
+
+def _device(path):
+    '''Return a QBuffer over a thumbnail in a pack, None for a file.'''
+    data = pack.read(path)
+    if data is None:
+        return None
+    return _buffer(data.tobytes())
+
+
+def imageReader(path):
+    '''Return a QImageReader for a thumbnail file or a thumbnail in a
+    pack.'''
+    device = _device(path)
+    if device is None:
+        return QtGui.QImageReader(path)
+    reader = QtGui.QImageReader(device)
+    # The reader doesn't own its device.
+    reader._device = device
+    return reader
+
+
+def movie(path, data=None):
+    '''Return a QMovie for a thumbnail file or a thumbnail in a pack, or
+    for data, the thumbnail's bytes, when given.'''
+    device = _buffer(data) if data is not None else _device(path)
+    if device is None:
+        return QtGui.QMovie(path)
+    movie = QtGui.QMovie(device)
+    device.setParent(movie)
+    return movie
+
+
+def image(path):
+    '''Read a thumbnail's first frame.'''
+    return imageReader(path).read()
+
+
+class ThumbnailCache(object):
+    """LRU of decoded thumbnails keyed by (path, mtime), bounded in bytes."""
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.bytes = 0
+        self._items = collections.OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key):
+        item = self._items.get(key)
+        if item is None:
+            return None
+        self._items.move_to_end(key)
+        return item[0]
+
+    def put(self, key, pixmap):
+        size = pixmap.width() * pixmap.height() * pixmap.depth() // 8
+        self.discard(key)
+        self._items[key] = (pixmap, size)
+        self.bytes += size
+        self._evict()
+
+    def discard(self, key):
+        item = self._items.pop(key, None)
+        if item is not None:
+            self.bytes -= item[1]
+
+    def setBudget(self, budget):
+        self.budget = budget
+        self._evict()
+
+    def clear(self):
+        self._items.clear()
+        self.bytes = 0
+
+    def _evict(self):
+        while self.bytes > self.budget and len(self._items) > 1:
+            key, item = self._items.popitem(last=False)
+            self.bytes -= item[1]
+
+
+class _DecodeSignals(QtCore.QObject):
+    done = QtCore.Signal(object, object)
+
+
+class _DecodeTask(QtCore.QRunnable):
+    '''Decode one thumbnail to a QImage on a pool thread.
+
+    GIFs decode to their first frame, the poster shown until hover.
+    '''
+
+    def __init__(self, key, signals):
+        super(_DecodeTask, self).__init__()
+        self.key = key
+        self.signals = signals
+        self.setAutoDelete(True)
+
+    def run(self):
+        with trace.span('thumb.decode', path=self.key[0]):
+            decoded = image(localcache.resolve(*self.key))
+        self.signals.done.emit(self.key, decoded)
+
+
+class ThumbnailLoader(QtCore.QObject):
+    """Decodes thumbnails off the GUI thread into a shared ThumbnailCache.
+
+    pixmap() returns the cached pixmap or None and queues a decode, `loaded`
+    is emitted with the key once it is in the cache. The most recent
+    requests are decoded first, so the tiles currently being painted win
+    over ones that have already scrolled away.
+    """
+    loaded = QtCore.Signal(object)
+
+    def __init__(self, parent=None):
+        super(ThumbnailLoader, self).__init__(parent)
+        self.cache = ThumbnailCache(plglobals.THUMB_CACHE_MB * 1024 * 1024)
+        self.pool = QtCore.QThreadPool(self)
+        self.pool.setMaxThreadCount(plglobals.THUMB_THREADS)
+        self._pending = set()
+        self._failed = set()
+        self._priority = 0
+        self._signals = _DecodeSignals(self)
+        self._signals.done.connect(self._onDecoded)
+
+    def pixmap(self, path, mtime):
+        if not path:
+            return None
+        key = (path, mtime)
+        pixmap = self.cache.get(key)
+        if pixmap is None and key not in self._pending \
+                and key not in self._failed:
+            self._pending.add(key)
+            self._priority += 1
+            self.pool.start(_DecodeTask(key, self._signals), self._priority)
+        return pixmap
+
+    def cancel(self):
+        '''Drop queued decodes that have not started yet.'''
+        self.pool.clear()
+        self._pending.clear()
+
+    def _onDecoded(self, key, image):
+        self._pending.discard(key)
+        if image.isNull():
+            self._failed.add(key)
+            return
+        self.cache.put(key, QtGui.QPixmap.fromImage(image))
+        self.loaded.emit(key)
+
+
+_loader = None
+
+
+def getLoader():
+    '''Return the process wide ThumbnailLoader.'''
+    global _loader
+    if _loader is None:
+        _loader = ThumbnailLoader()
+    return _loader
@@ -0,0 +1,203 @@
+"""
+Spans, counters and an optional profile of a session.
+
+    with trace.span('scan', full=full):
+        ...
+    trace.count('scan.probe')
+
+    @trace.traced('capture.bake')
+    def _bakeChannels(self, parms, frame_range):
+
+While tracing is off span() returns a shared no-op context and count() and
+event() return straight away, so they can stay in hot paths. When on, each
+span is recorded with its thread, start and duration, and each counter
+change with its running total, into a bounded buffer. export() writes them
+as a Chrome trace, which chrome://tracing and ui.perfetto.dev open, with the
+counter totals under 'otherData'.
+
+With a profile, cProfile runs on the thread that enabled tracing, the GUI
+thread, and export() saves its stats next to the trace as <file>.prof.
+
+This module imports nothing from Houdini, clipfile and the other plain
+modules use it too. TRACE in plglobals turns it on for a whole session, the
+trace is then written when Houdini exits.
+"""
+
+import atexit
+import collections
+import cProfile
+import functools
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+MAX_EVENTS = 200000
+
+_enabled = False
+_events = collections.deque(maxlen=MAX_EVENTS)
+_counters = {}
+_lock = threading.Lock()
+_profiler = None
+_atexit = False
+_pid = os.getpid()
+# Print errors passed to error(), set from plglobals.debug.
+echo = False
+
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL = _NullSpan()
+
+
+class _Span(object):
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        if exc_type is not None:
+            self.args['error'] = repr(exc)
+        _record(self.name, 'X', self.start, self.args, end - self.start)
+        return False
+
+
+def _record(name, phase, start, args, duration=None):
+    event = {'name': name, 'cat': name.split('.', 1)[0], 'ph': phase,
+             'ts': start * 1e6, 'pid': _pid, 'tid': threading.get_ident()}
+    if duration is not None:
+        event['dur'] = duration * 1e6
+    if args:
+        event['args'] = args
+    _events.append(event)
+
+
+def isEnabled():
+    return _enabled
+
+
+def enable(profile=False, filename=None):
+    '''Start recording, and profiling the calling thread if profile is
+    set. With a filename the trace is also exported when Python exits.'''
+    global _enabled, _profiler, _atexit
+    _enabled = True
+    if profile and _profiler is None:
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+    if filename is not None and not _atexit:
+        atexit.register(_exportAtExit, filename)
+        _atexit = True
+
+
+def disable():
+    '''Stop recording, what was recorded is kept until clear().'''
+    global _enabled
+    _enabled = False
+    if _profiler is not None:
+        _profiler.disable()
+
+
+def clear():
+    global _profiler
+    _events.clear()
+    with _lock:
+        _counters.clear()
+    if _profiler is not None:
+        _profiler.disable()
+        _profiler = None
+
+
+def span(name, **args):
+    '''Context manager timing the enclosed block as name.'''
+    if not _enabled:
+        return _NULL
+    return _Span(name, args)
+
+
+def traced(name):
+    '''Decorator recording each call of a function as a span.'''
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _Span(name, {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, value=1):
+    '''Add value to the counter name.'''
+    if not _enabled:
+        return
+    with _lock:
+        total = _counters[name] = _counters.get(name, 0) + value
+    _record(name, 'C', time.perf_counter(), {'total': total})
+
+
+def event(name, **args):
+    '''Record a single point in time.'''
+    if not _enabled:
+        return
+    args['s'] = 't'
+    _record(name, 'i', time.perf_counter(), args)
+
+
+def error(name, e):
+    '''Record an exception that was handled, printing it when echo is
+    set.'''
+    if echo:
+        print(f'{name}: {e}')
+    event(name, error=repr(e))
+
+
+def counters():
+    with _lock:
+        return dict(_counters)
+
+
+def defaultFile():
+    return os.path.join(tempfile.gettempdir(), 'cnwpose_trace.json')
+
+
+def export(filename=None):
+    '''Write the recorded events as a Chrome trace and, when profiling, the
+    profile as filename.prof. Returns the trace's filename.'''
+    filename = filename or defaultFile()
+    events = list(_events)
+    events.append({'name': 'thread_name', 'ph': 'M', 'pid': _pid,
+                   'tid': threading.main_thread().ident,
+                   'args': {'name': 'main'}})
+    data = {'traceEvents': events, 'displayTimeUnit': 'ms',
+            'otherData': {'counters': counters(),
+                          'truncated': len(_events) == MAX_EVENTS}}
+    with open(filename, 'w') as f:
+        json.dump(data, f)
+    if _profiler is not None:
+        # dump_stats() stops the profiler, keep it running while tracing.
+        _profiler.dump_stats(filename + '.prof')
+        if _enabled:
+            _profiler.enable()
+    return filename
+
+
+def _exportAtExit(filename):
+    if _events:
+        try:
+            export(filename)
+        except (IOError, OSError):
+            pass
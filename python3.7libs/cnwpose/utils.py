@@ -1,5 +1,13 @@
 import hou
 
+from . import pack
+from . import plglobals
+
+if plglobals.debug == 1:
+    from importlib import reload
+    reload(pack)
+    reload(plglobals)
+
 
 def warningDialog(message, true_button='OK', false_button='Cancel',
                   show_cancel=True):
@@ -26,3 +34,14 @@ def selectChannels():
     if len(selection) == 0:
         selection = hou.playbar.channelList().parms()
     return selection
+
+
+def isReadOnly():
+    """Warn and return True when the library is a pack, which can't be
+    written to.
+    """
+    if not pack.isPack(plglobals.lib_path):
+        return False
+    warningDialog('The library is a pack and is read-only, export a new '
+                  'pack from a library folder instead.', show_cancel=False)
+    return True
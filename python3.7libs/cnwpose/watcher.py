@@ -0,0 +1,140 @@
+import os
+
+from PySide2 import QtCore
+
+from . import manifest
+from . import plglobals
+
+if plglobals.debug == 1:
+    from importlib import reload
+    reload(manifest)
+    reload(plglobals)
+
+
+class LibraryWatcher(QtCore.QObject):
+    """Emit `changed` shortly after anything is added, removed or renamed
+    in the library's clip and pose folders, or the files of a watched entry
+    are rewritten.
+
+    File system notifications are debounced so a capture writing several
+    files only triggers one update. Notifications are not delivered for
+    changes other machines make on a network share, so the folder mtimes
+    are also polled.
+
+    A recapture rewrites the files inside an existing entry folder, which
+    the clip and pose folders don't see. watchEntries() adds the folder,
+    data file and thumbnail of up to WATCH_MAX_ENTRIES entries, the ones on
+    screen, to the watched and polled paths. takeTouched() returns the keys
+    of the entries that changed, for Manifest.reconcile()'s check.
+    """
+    changed = QtCore.Signal()
+
+    def __init__(self, parent=None):
+        super(LibraryWatcher, self).__init__(parent)
+        self.lib_path = None
+        self._mtimes = {}
+        # path -> (type, name) of the watched entries' files
+        self._entries = {}
+        self._touched = set()
+        self._fs = QtCore.QFileSystemWatcher(self)
+        self._fs.directoryChanged.connect(self._onChanged)
+        self._fs.fileChanged.connect(self._onChanged)
+        self._debounce = QtCore.QTimer(self)
+        self._debounce.setSingleShot(True)
+        self._debounce.setInterval(plglobals.WATCH_DEBOUNCE_MS)
+        self._debounce.timeout.connect(self._emitChanged)
+        self._poll = QtCore.QTimer(self)
+        self._poll.setInterval(plglobals.WATCH_POLL_MS)
+        self._poll.timeout.connect(self._pollMtimes)
+
+    def _dirs(self):
+        if self.lib_path is None:
+            return []
+        return [self.lib_path] + [os.path.join(self.lib_path, t)
+                                  for t in manifest.TYPES]
+
+    def setPath(self, lib_path):
+        '''Watch a new library directory.'''
+        paths = self._fs.directories() + self._fs.files()
+        if paths:
+            self._fs.removePaths(paths)
+        self.lib_path = lib_path
+        self._entries = {}
+        self._touched = set()
+        self._mtimes = self._stat()
+        self._watchDirs()
+        if not self._poll.isActive():
+            self._poll.start()
+
+    def stop(self):
+        self._poll.stop()
+        self._debounce.stop()
+        paths = self._fs.directories() + self._fs.files()
+        if paths:
+            self._fs.removePaths(paths)
+
+    def watchEntries(self, entries):
+        '''Watch the folder, data and thumbnail files of entries instead of
+        the previous ones.'''
+        paths = {}
+        for entry in entries[:plglobals.WATCH_MAX_ENTRIES]:
+            key = (entry['type'], entry['name'])
+            for path in (entry['dir'], entry['data'], entry['thumb']):
+                if path:
+                    paths[path] = key
+        old = [p for p in self._entries if p not in paths]
+        watched = set(self._fs.directories() + self._fs.files())
+        if watched.intersection(old):
+            self._fs.removePaths([p for p in old if p in watched])
+        for path in old:
+            self._mtimes.pop(path, None)
+        new = [p for p in paths if p not in self._entries]
+        self._entries = paths
+        self._mtimes.update(self._stat(new))
+        self._watchDirs()
+
+    def takeTouched(self):
+        '''Return and forget the keys of the watched entries that changed.'''
+        touched = self._touched
+        self._touched = set()
+        return touched
+
+    def _watchDirs(self):
+        # clip/ and pose/ may only be created by the first capture, a
+        # file replaced by a rename is no longer watched.
+        watched = set(self._fs.directories() + self._fs.files())
+        for d in self._dirs() + list(self._entries):
+            if d not in watched and os.path.exists(d):
+                self._fs.addPath(d)
+
+    def _stat(self, paths=None):
+        if paths is None:
+            paths = self._dirs() + list(self._entries)
+        mtimes = {}
+        for d in paths:
+            try:
+                mtimes[d] = os.stat(d).st_mtime
+            except OSError:
+                mtimes[d] = None
+        return mtimes
+
+    def _onChanged(self, path):
+        key = self._entries.get(path)
+        if key is not None:
+            self._touched.add(key)
+        self._debounce.start()
+
+    def _pollMtimes(self):
+        mtimes = self._stat()
+        if mtimes != self._mtimes:
+            self._debounce.start()
+
+    def _emitChanged(self):
+        mtimes = self._stat()
+        for path, mtime in mtimes.items():
+            key = self._entries.get(path)
+            if key is not None and mtime != self._mtimes.get(path):
+                self._touched.add(key)
+        self._mtimes = mtimes
+        self._watchDirs()
+        self.changed.emit()
@@ -1,3 +1,4 @@
+import bisect
 import hou
 import os
 import re
@@ -6,6 +7,11 @@ import sys
 from PySide2 import QtWidgets
 from PySide2 import QtCore
 from PySide2 import QtGui
+from . import blobstore
+from . import manifest
+from . import prefetch
+from . import preview
+from . import thumbcache
 from . import utils
 from . import plglobals
 
@@ -14,6 +20,11 @@ from . import plglobals
 
 if plglobals.debug == 1:
     from importlib import reload
+    reload(blobstore)
+    reload(manifest)
+    reload(prefetch)
+    reload(preview)
+    reload(thumbcache)
     reload(plglobals)
 
 
@@ -38,12 +49,86 @@ QImageThumbnail:selected {
 '''
 
 
+def deleteClip(name, path, clip_type):
+    '''Ask to delete a library entry, returns True if it was deleted.'''
+    if utils.isReadOnly():
+        return False
+    confirm = utils.warningDialog(
+        f"Are you sure you want to delete `{name}`?", true_button="Delete")
+    if not confirm:
+        return False
+    index = manifest.getManifest(plglobals.lib_path)
+    if blobstore.isRef(path):
+        blobstore.deleteRef(path)
+        index.remove(clip_type, name)
+        return True
+    shutil.rmtree(path)
+    index.remove(clip_type, name)
+    return True
+
+
+def renameClip(name, path, clip_type):
+    '''Ask for a new name and rename a library entry's files and folder.'''
+    if utils.isReadOnly():
+        return False
+    rename = hou.ui.readInput(
+        'New Clip Name', severity=hou.severityType.ImportantMessage)
+    if rename is None or rename[1] == '':
+        if utils.warningDialog('Invalid Name'):
+            return renameClip(name, path, clip_type)
+        return False
+    new_name = re.sub(r'\W+', '_', rename[1])
+    if new_name == name:
+        return False
+    if blobstore.entryExists(os.path.dirname(path), new_name):
+        if utils.warningDialog(f"`{new_name}` already exists"):
+            return renameClip(name, path, clip_type)
+        return False
+    if blobstore.isRef(path):
+        blobstore.renameRef(path, new_name)
+    else:
+        for ext in ('', '.gif', '.webp', '.jpg', manifest.TAGS_EXT):
+            if os.path.isfile(os.path.join(path, name + ext)):
+                os.rename(os.path.join(path, name + ext),
+                          os.path.join(path, new_name + ext))
+        if os.path.isdir(path):
+            os.rename(path, os.path.join(os.path.dirname(path), new_name))
+    manifest.getManifest(plglobals.lib_path).rename(clip_type, name, new_name)
+    return True
+
+
+def editTags(name, path, clip_type):
+    '''Ask for a library entry's tags, returns True if they were saved.'''
+    if utils.isReadOnly():
+        return False
+    tags = manifest.readTags(path, name)
+    result = hou.ui.readInput(
+        'Tags, separated by commas', buttons=('Save', 'Cancel'),
+        initial_contents=', '.join(tags))
+    if result[0] != 0:
+        return False
+    manifest.writeTags(path, name, result[1].split(','))
+    manifest.getManifest(plglobals.lib_path).update(clip_type, name)
+    return True
+
+
 class FlowLayout(QtWidgets.QLayout):
+    '''Wrapping layout.
+
+    Hidden widgets take no space. Item positions are cached per width and
+    visible item count until the layout is invalidated. When every item has
+    the same size, set it with setUniformItemSize() and positions are
+    computed arithmetically instead of querying each item.
+    '''
+
     def __init__(self, parent=None, margin=-1, hspacing=-1, vspacing=-1):
         super(FlowLayout, self).__init__()
         self._hspacing = hspacing
         self._vspacing = vspacing
         self._items = []
+        self._uniform = None
+        self._cache = {}
+        self._applied = None
         self.setContentsMargins(margin, margin, margin, margin)
 
     def __del__(self):
@@ -52,6 +137,11 @@ class FlowLayout(QtWidgets.QLayout):
     def addItem(self, item):
         self._items.append(item)
 
+    def insertWidget(self, index, widget):
+        self.addChildWidget(widget)
+        self._items.insert(index, QtWidgets.QWidgetItem(widget))
+        self.invalidate()
+
     def horizontalSpacing(self):
         if self._hspacing >= 0:
             return self._hspacing
@@ -69,6 +159,18 @@ class FlowLayout(QtWidgets.QLayout):
     def count(self):
         return len(self._items)
 
+    def _visibleItems(self):
+        return [i for i in self._items if not i.isEmpty()]
+
+    def setUniformItemSize(self, size):
+        self._uniform = QtCore.QSize(size) if size is not None else None
+        self.invalidate()
+
+    def invalidate(self):
+        self._cache.clear()
+        self._applied = None
+        super(FlowLayout, self).invalidate()
+
     def itemAt(self, index):
         if 0 <= index < len(self._items):
             return self._items[index]
@@ -101,37 +203,70 @@ class FlowLayout(QtWidgets.QLayout):
         size += QtCore.QSize(left + right, top + bottom)
         return size
 
-    def doLayout(self, rect, testonly):
-        left, top, right, bottom = self.getContentsMargins()
-        width = right - left
-        effective = rect.adjusted(+left, +top, -right, -bottom)
-        x = effective.x()
-        y = effective.y()
-        lineheight = 0
-        for item in self._items:
-            widget = item.widget()
-            hspace = self.horizontalSpacing()
+    def _spacing(self):
+        hspace = self.horizontalSpacing()
+        vspace = self.verticalSpacing()
+        if (hspace == -1 or vspace == -1) and self._items:
+            style = self._items[0].widget().style()
             if hspace == -1:
-                hspace = widget.style().layoutSpacing(
+                hspace = style.layoutSpacing(
                     QtWidgets.QSizePolicy.PushButton,
                     QtWidgets.QSizePolicy.PushButton, QtCore.Qt.Horizontal)
-            vspace = self.verticalSpacing()
             if vspace == -1:
-                vspace = widget.style().layoutSpacing(
+                vspace = style.layoutSpacing(
                     QtWidgets.QSizePolicy.PushButton,
                     QtWidgets.QSizePolicy.PushButton, QtCore.Qt.Vertical)
-            nextX = x + item.sizeHint().width() + hspace
-            if nextX - hspace > effective.right() and lineheight > 0:
-                x = effective.x()
+        return hspace, vspace
+
+    def _computeLayout(self, width):
+        '''Return the content height and (x, y, w, h) of every item,
+        relative to the top left of the content rect.'''
+        hspace, vspace = self._spacing()
+        items = self._visibleItems()
+        count = len(items)
+        if self._uniform is not None:
+            w = self._uniform.width()
+            h = self._uniform.height()
+            cols = max(1, (width - 1 + hspace) // (w + hspace))
+            rows = -(-count // cols)
+            positions = [((i % cols) * (w + hspace),
+                          (i // cols) * (h + vspace), w, h)
+                         for i in range(count)]
+            return rows * h + max(rows - 1, 0) * vspace, positions
+        positions = []
+        x = 0
+        y = 0
+        lineheight = 0
+        for item in items:
+            hint = item.sizeHint()
+            w = hint.width()
+            h = hint.height()
+            if x + w > width - 1 and lineheight > 0:
+                x = 0
                 y = y + lineheight + vspace
-                nextX = x + item.sizeHint().width() + hspace
                 lineheight = 0
-            if not testonly:
-                item.setGeometry(
-                    QtCore.QRect(QtCore.QPoint(x, y), item.sizeHint()))
-            x = nextX
-            lineheight = max(lineheight, item.sizeHint().height())
-        return y + lineheight - rect.y() + bottom
+            positions.append((x, y, w, h))
+            x = x + w + hspace
+            lineheight = max(lineheight, h)
+        return y + lineheight, positions
+
+    def doLayout(self, rect, testonly):
+        left, top, right, bottom = self.getContentsMargins()
+        effective = rect.adjusted(+left, +top, -right, -bottom)
+        items = self._visibleItems()
+        key = (effective.width(), len(items))
+        layout = self._cache.get(key)
+        if layout is None:
+            layout = self._cache[key] = self._computeLayout(effective.width())
+        height, positions = layout
+        applied = (effective.x(), effective.y()) + key
+        if not testonly and applied != self._applied:
+            x0 = effective.x()
+            y0 = effective.y()
+            for item, (x, y, w, h) in zip(items, positions):
+                item.setGeometry(QtCore.QRect(x0 + x, y0 + y, w, h))
+            self._applied = applied
+        return height + top + bottom
 
     def smartSpacing(self, pm):
         parent = self.parent()
@@ -178,9 +313,17 @@ class ScrollingFlowWidget(QtWidgets.QWidget):
         self.flow_layout.addWidget(widget)
         widget.setParent(self._wrapper)
 
+    def insertWidget(self, index, widget):
+        widget.setParent(self._wrapper)
+        self.flow_layout.insertWidget(index, widget)
+        widget.show()
+
     def count(self):
         return self.flow_layout.count()
 
+    def setUniformItemSize(self, size):
+        self.flow_layout.setUniformItemSize(size)
+
     def itemAt(self, index):
         return self.flow_layout.itemAt(index)
 
@@ -189,11 +332,14 @@ class QImageThumbnail(QtWidgets.QWidget):
     clicked = QtCore.Signal()
     deleted = QtCore.Signal()
     rename = QtCore.Signal()
+    tagged = QtCore.Signal()
     label_text = ''
     name = ''
     path = ''
     clip_type = ''
     thumb_type = ''
+    movie_path = ''
+    movie_mtime = None
 
     def __init__(self):
         super(QImageThumbnail, self).__init__()
@@ -215,6 +361,9 @@ class QImageThumbnail(QtWidgets.QWidget):
         self.setContextMenuPolicy(QtCore.Qt.CustomContextMenu)
         self.customContextMenuRequested.connect(self.right_click)
         self.installEventFilter(self)
+        self.preview = preview.HoverPreview(self)
+        self.preview.changed.connect(self._previewChanged)
+        self.setMouseTracking(True)
 
     def __del__(self):
         self.thumbnail.clear()
@@ -229,43 +378,24 @@ class QImageThumbnail(QtWidgets.QWidget):
         self.clicked.emit()
 
     def _del_clip(self):
-        confirm = utils.warningDialog(
-            f"Are you sure you want to delete `{self.name}`?", true_button="Delete")
-        if confirm:
-            shutil.rmtree(self.path)
+        if deleteClip(self.name, self.path, self.clip_type):
             self.deleted.emit()
 
     def _rename_clip(self):
-        rename = hou.ui.readInput(
-            'New Clip Name', severity=hou.severityType.ImportantMessage)
-        if rename is None or rename[1] == '':
-            if utils.warningDialog('Invalid Name'):
-                self._rename_clip()
-            else:
-                return False
-        new_name = re.sub(r'\W+', '_', rename[1])
-        dir = os.path.join(os.path.dirname(self.path), new_name)
-        if os.path.isfile(os.path.join(self.path, self.name)):
-            os.rename(os.path.join(self.path, self.name),
-                      os.path.join(self.path, new_name))
-        if os.path.isfile(os.path.join(self.path, self.name + '.gif')):
-            os.rename(os.path.join(self.path, self.name + '.gif'),
-                      os.path.join(self.path, new_name + '.gif'))
-        if os.path.isfile(os.path.join(self.path, self.name + '.jpg')):
-            os.rename(os.path.join(self.path, self.name + '.jpg'),
-                      os.path.join(self.path, new_name + '.jpg'))
-        if os.path.isdir(self.path):
-            npath = os.path.join(os.path.dirname(self.path), new_name)
-            os.rename(self.path, npath)
-
-        self.rename.emit()
+        if renameClip(self.name, self.path, self.clip_type):
+            self.rename.emit()
+
+    def _tag_clip(self):
+        if editTags(self.name, self.path, self.clip_type):
+            self.tagged.emit()
 
     def name(self):
         return self.name
 
-    def setPath(self, path):
+    def setPath(self, path, name=None):
+        # A blob store entry's path is its <name>.ref file, not a folder.
         self.path = path
-        self.name = os.path.basename(path)
+        self.name = name if name is not None else os.path.basename(path)
 
     def setType(self, clip_type):
         self.clip_type = clip_type
@@ -274,16 +404,17 @@ class QImageThumbnail(QtWidgets.QWidget):
         self.label_text = text.replace("_", " ")
         self.label.setText(text)
 
-    def setMovie(self, gif):
+    def setMovie(self, gif, mtime=None):
         self.thumb_type = 'movie'
-        self.movie = QtGui.QMovie(gif)
-        self.movie.setParent(self.thumbnail)
-        self.thumbnail.setMovie(self.movie)
-        self.movie.jumpToFrame(0)
+        self.movie_path = gif
+        self.movie_mtime = mtime
+        self.thumbnail.setPixmap(QtGui.QPixmap.fromImage(
+            thumbcache.image(gif)))
 
     def setImage(self, jpg):
         self.thumb_type = 'pixmap'
-        self.thumbnail.setPixmap(jpg)
+        self.thumbnail.setPixmap(QtGui.QPixmap.fromImage(
+            thumbcache.image(jpg)))
 
     def resizeEvent(self, event):
         self.formatText()
@@ -318,16 +449,31 @@ class QImageThumbnail(QtWidgets.QWidget):
         return QtWidgets.QWidget.eventFilter(self, obj, event)
 
     def _hoverStyle(self):
+        prefetch.getPrefetcher().request(
+            [manifest.getManifest(plglobals.lib_path).entry(
+                self.clip_type, self.name)])
         if self.thumb_type == 'movie':
-            self.movie.start()
+            self.preview.start(self.movie_path, self.thumbnail.width(),
+                               plglobals.SCRUB_PREVIEW, self.movie_mtime)
         self.label.setStyleSheet('color: black')
 
     def _clearStyle(self):
-        if self.thumb_type == 'movie':
-            self.movie.jumpToFrame(0)
-            self.movie.stop()
+        if self.thumb_type == 'movie' and self.preview.isActive():
+            self.preview.stop()
+            self.thumbnail.setPixmap(QtGui.QPixmap.fromImage(
+                thumbcache.image(self.movie_path)))
         self.label.setStyleSheet('color: rgb(204, 204, 204)')
 
+    def _previewChanged(self):
+        pixmap = self.preview.pixmap()
+        if pixmap is not None:
+            self.thumbnail.setPixmap(pixmap)
+
+    def mouseMoveEvent(self, event):
+        if self.preview.scrub:
+            self.preview.scrubTo(event.pos().x() / float(max(self.width(), 1)))
+        super(QImageThumbnail, self).mouseMoveEvent(event)
+
     def right_click(self, pos):
         self._clearStyle()
         menu = QtWidgets.QMenu()
@@ -337,9 +483,385 @@ class QImageThumbnail(QtWidgets.QWidget):
         menu.addSeparator()
         delete_option = menu.addAction('Delete')
         rename_option = menu.addAction('Rename')
+        tags_option = menu.addAction('Edit Tags')
 
         select_option.triggered.connect(self._sel_clip)
         delete_option.triggered.connect(self._del_clip)
         rename_option.triggered.connect(self._rename_clip)
+        tags_option.triggered.connect(self._tag_clip)
 
         menu.exec_(self.mapToGlobal(pos))
+
+
+class ThumbnailModel(QtCore.QAbstractListModel):
+    """List model of library entries, sorted by name.
+
+    Thumbnails are only requested when a tile is painted. They are decoded
+    in the background by the shared thumbcache loader, the tile is painted
+    as a placeholder until its decode finishes.
+
+    setFilter() limits the rows to a set of (type, name) keys, the
+    unfiltered entries are kept so the filter can change without a reload.
+    """
+    EntryRole = QtCore.Qt.UserRole + 1
+
+    def __init__(self, parent=None):
+        super(ThumbnailModel, self).__init__(parent)
+        self._entries = []
+        self._keys = []
+        self._all = []
+        self._all_keys = []
+        self._filter = None
+        self._thumbs = {}
+        self.loader = thumbcache.getLoader()
+        self.loader.loaded.connect(self._thumbnailLoaded)
+
+    def _sortKey(self, entry):
+        return (entry['name'].lower(), entry['type'], entry['name'])
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._entries)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        entry = self._entries[index.row()]
+        if role == QtCore.Qt.DisplayRole:
+            return entry['name'].replace('_', ' ')
+        if role == QtCore.Qt.ToolTipRole:
+            return entry['name']
+        if role == QtCore.Qt.DecorationRole:
+            return self.loader.pixmap(entry['thumb'], entry['thumb_mtime'])
+        if role == self.EntryRole:
+            return entry
+        return None
+
+    def _thumbnailLoaded(self, key):
+        # Entries deduplicated into the blob store share a thumbnail.
+        for entry in self._thumbs.get(key, ()):
+            row = self.row(entry)
+            if row >= 0:
+                index = self.index(row)
+                self.dataChanged.emit(index, index,
+                                      [QtCore.Qt.DecorationRole])
+
+    def _thumbKey(self, entry):
+        return (entry['thumb'], entry['thumb_mtime'])
+
+    def _accepts(self, entry):
+        return self._filter is None or \
+            (entry['type'], entry['name']) in self._filter
+
+    def _applyFilter(self):
+        self._entries = [e for e in self._all if self._accepts(e)]
+        self._keys = [self._sortKey(e) for e in self._entries]
+        self._thumbs = {}
+        for entry in self._entries:
+            self._thumbs.setdefault(self._thumbKey(entry), []).append(entry)
+
+    def setEntries(self, entries):
+        self.beginResetModel()
+        self.loader.cancel()
+        self._all = sorted(entries, key=self._sortKey)
+        self._all_keys = [self._sortKey(e) for e in self._all]
+        self._applyFilter()
+        self.endResetModel()
+
+    def setFilter(self, keys):
+        '''Show only the entries whose (type, name) is in keys, all of them
+        if keys is None.'''
+        if keys is None and self._filter is None:
+            return
+        self.beginResetModel()
+        self.loader.cancel()
+        self._filter = keys
+        self._applyFilter()
+        self.endResetModel()
+
+    def entries(self):
+        return list(self._all)
+
+    def row(self, entry):
+        key = self._sortKey(entry)
+        row = bisect.bisect_left(self._keys, key)
+        if row < len(self._keys) and self._keys[row] == key:
+            return row
+        return -1
+
+    def insertEntry(self, entry):
+        key = self._sortKey(entry)
+        i = bisect.bisect(self._all_keys, key)
+        self._all_keys.insert(i, key)
+        self._all.insert(i, entry)
+        if not self._accepts(entry):
+            return -1
+        row = bisect.bisect(self._keys, key)
+        self.beginInsertRows(QtCore.QModelIndex(), row, row)
+        self._keys.insert(row, key)
+        self._entries.insert(row, entry)
+        self._thumbs.setdefault(self._thumbKey(entry), []).append(entry)
+        self.endInsertRows()
+        return row
+
+    def removeEntry(self, entry):
+        key = self._sortKey(entry)
+        i = bisect.bisect_left(self._all_keys, key)
+        if i < len(self._all_keys) and self._all_keys[i] == key:
+            del self._all_keys[i]
+            del self._all[i]
+        row = self.row(entry)
+        if row < 0:
+            return False
+        key = self._thumbKey(self._entries[row])
+        shared = self._thumbs.get(key, [])
+        shared[:] = [e for e in shared if e is not self._entries[row]]
+        if not shared:
+            self._thumbs.pop(key, None)
+        self.beginRemoveRows(QtCore.QModelIndex(), row, row)
+        del self._keys[row]
+        del self._entries[row]
+        self.endRemoveRows()
+        return True
+
+
+class ThumbnailDelegate(QtWidgets.QStyledItemDelegate):
+    """Paints a library tile: thumbnail above an elided label."""
+    LABEL_HEIGHT = 22
+    MARGIN = 2
+
+    def __init__(self, view):
+        super(ThumbnailDelegate, self).__init__(view)
+        self.view = view
+        self.tile_size = hou.ui.scaledSize(128)
+
+    def sizeHint(self, option, index):
+        return QtCore.QSize(self.tile_size,
+                            self.tile_size + self.LABEL_HEIGHT + 4)
+
+    def paint(self, painter, option, index):
+        painter.save()
+        rect = option.rect.adjusted(self.MARGIN, self.MARGIN,
+                                    -self.MARGIN, -self.MARGIN)
+        hover = bool(option.state & QtWidgets.QStyle.State_MouseOver)
+        if option.state & QtWidgets.QStyle.State_Selected:
+            painter.fillRect(rect, QtGui.QColor(255, 192, 23, 115))
+        elif hover:
+            painter.fillRect(rect, QtGui.QColor(255, 255, 255, 115))
+        else:
+            painter.fillRect(rect, QtGui.QColor(0, 0, 0, 26))
+        painter.setPen(QtGui.QColor(0, 0, 0))
+        painter.drawRect(rect.adjusted(0, 0, -1, -1))
+
+        pad = 9
+        side = max(rect.width() - pad * 2, 0)
+        image_rect = QtCore.QRect(rect.x() + pad, rect.y() + pad, side, side)
+        pixmap = self.view.hoverPixmap(index)
+        if pixmap is None:
+            pixmap = index.data(QtCore.Qt.DecorationRole)
+        if pixmap is not None and not pixmap.isNull():
+            painter.drawPixmap(image_rect, pixmap)
+        else:
+            painter.fillRect(image_rect, QtGui.QColor(0, 0, 0, 40))
+
+        text_rect = QtCore.QRect(rect.x(), image_rect.bottom() + 1,
+                                 rect.width(), self.LABEL_HEIGHT)
+        if hover:
+            painter.setPen(QtGui.QColor(0, 0, 0))
+        else:
+            painter.setPen(QtGui.QColor(204, 204, 204))
+        text = option.fontMetrics.elidedText(
+            index.data(QtCore.Qt.DisplayRole), QtCore.Qt.ElideRight,
+            text_rect.width() - pad)
+        painter.drawText(text_rect, QtCore.Qt.AlignCenter, text)
+        painter.restore()
+
+
+class ThumbnailView(QtWidgets.QListView):
+    """Icon mode grid of library entries that only paints visible tiles.
+
+    Replaces a ScrollingFlowWidget of QImageThumbnail widgets, memory and
+    build time no longer grow with one widget per clip.
+    """
+    clipSelected = QtCore.Signal()
+    clipDeleted = QtCore.Signal()
+    clipRenamed = QtCore.Signal()
+    clipTagged = QtCore.Signal()
+
+    def __init__(self, parent=None):
+        super(ThumbnailView, self).__init__(parent)
+        self.setViewMode(QtWidgets.QListView.IconMode)
+        self.setMovement(QtWidgets.QListView.Static)
+        self.setResizeMode(QtWidgets.QListView.Adjust)
+        self.setLayoutMode(QtWidgets.QListView.Batched)
+        self.setBatchSize(500)
+        self.setUniformItemSizes(True)
+        self.setSelectionMode(QtWidgets.QAbstractItemView.SingleSelection)
+        self.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.setVerticalScrollMode(QtWidgets.QAbstractItemView.ScrollPerPixel)
+        self.setMouseTracking(True)
+        self.setAttribute(QtCore.Qt.WA_Hover)
+        self.setModel(ThumbnailModel(self))
+        self.delegate = ThumbnailDelegate(self)
+        self.setItemDelegate(self.delegate)
+        self._hover = QtCore.QPersistentModelIndex()
+        self.scrub = plglobals.SCRUB_PREVIEW
+        self.preview = preview.HoverPreview(self)
+        self.preview.changed.connect(self._previewChanged)
+        self.setContextMenuPolicy(QtCore.Qt.CustomContextMenu)
+        self.customContextMenuRequested.connect(self.right_click)
+        self.setTileSize(self.delegate.tile_size)
+
+    def setTileSize(self, size):
+        self.delegate.tile_size = size
+        hint = self.delegate.sizeHint(None, QtCore.QModelIndex())
+        # Schedules a single delayed relayout.
+        self.setGridSize(hint)
+
+    def entryAt(self, index):
+        if not index.isValid():
+            return None
+        return index.data(ThumbnailModel.EntryRole)
+
+    def selectEntry(self, entry):
+        row = self.model().row(entry)
+        if row >= 0:
+            self.setCurrentIndex(self.model().index(row))
+
+    def neighbourEntries(self, index):
+        '''Return the entries of the tiles right of, left of, below and
+        above index.'''
+        columns = max(self.viewport().width() //
+                      max(self.gridSize().width(), 1), 1)
+        rows = self.model().rowCount()
+        return [self.entryAt(self.model().index(row))
+                for row in (index.row() + 1, index.row() - 1,
+                            index.row() + columns, index.row() - columns)
+                if 0 <= row < rows]
+
+    def visibleEntries(self):
+        '''Return the entries of the tiles on screen.'''
+        grid = self.gridSize()
+        columns = max(self.viewport().width() // max(grid.width(), 1), 1)
+        first = self.indexAt(QtCore.QPoint(grid.width() // 2,
+                                           grid.height() // 2))
+        if not first.isValid():
+            return []
+        count = (self.viewport().height() // max(grid.height(), 1) + 2) * \
+            columns
+        rows = min(first.row() + count, self.model().rowCount())
+        return [self.entryAt(self.model().index(row))
+                for row in range(first.row(), rows)]
+
+    def setScrub(self, scrub):
+        self.scrub = scrub
+        self._setHover(QtCore.QModelIndex())
+
+    def hoverPixmap(self, index):
+        if self.preview.isActive() and index == self._hover:
+            return self.preview.pixmap()
+        return None
+
+    def _setHover(self, index):
+        if index == self._hover:
+            return
+        if self._hover.isValid():
+            self.update(QtCore.QModelIndex(self._hover))
+        self.preview.stop()
+        self._hover = QtCore.QPersistentModelIndex(index)
+        entry = self.entryAt(index)
+        prefetch.getPrefetcher().request([entry])
+        if entry is not None and entry['thumb_kind'] == 'movie':
+            self.preview.start(entry['thumb'], self.delegate.tile_size,
+                               self.scrub, entry['thumb_mtime'])
+
+    def _previewChanged(self):
+        if self._hover.isValid():
+            self.update(QtCore.QModelIndex(self._hover))
+
+    def _updateHover(self, pos):
+        index = self.indexAt(pos)
+        self._setHover(index)
+        if self.scrub and index.isValid():
+            rect = self.visualRect(index)
+            self.preview.scrubTo(
+                (pos.x() - rect.x()) / float(max(rect.width(), 1)))
+
+    def mouseMoveEvent(self, event):
+        self._updateHover(event.pos())
+        super(ThumbnailView, self).mouseMoveEvent(event)
+
+    def leaveEvent(self, event):
+        self._setHover(QtCore.QModelIndex())
+        super(ThumbnailView, self).leaveEvent(event)
+
+    def scrollContentsBy(self, dx, dy):
+        # The hovered tile may have scrolled out from under the cursor.
+        super(ThumbnailView, self).scrollContentsBy(dx, dy)
+        if self._hover.isValid():
+            pos = self.viewport().mapFromGlobal(QtGui.QCursor.pos())
+            if self.viewport().rect().contains(pos):
+                self._updateHover(pos)
+            else:
+                self._setHover(QtCore.QModelIndex())
+
+    def mousePressEvent(self, event):
+        super(ThumbnailView, self).mousePressEvent(event)
+        if event.button() == QtCore.Qt.MouseButton.LeftButton:
+            self._sel_clip(self.indexAt(event.pos()))
+
+    def _sel_clip(self, index):
+        entry = self.entryAt(index)
+        if entry is None:
+            return
+        self.setCurrentIndex(index)
+        prefetch.getPrefetcher().request(self.neighbourEntries(index))
+        plglobals.clip['name'] = entry['name']
+        plglobals.clip['dir'] = entry['dir']
+        plglobals.clip['type'] = entry['type']
+        self.clipSelected.emit()
+
+    def _del_clip(self, index):
+        entry = self.entryAt(index)
+        if entry is not None and deleteClip(
+                entry['name'], entry['dir'], entry['type']):
+            self.clipDeleted.emit()
+
+    def _rename_clip(self, index):
+        entry = self.entryAt(index)
+        if entry is not None and renameClip(
+                entry['name'], entry['dir'], entry['type']):
+            self.clipRenamed.emit()
+
+    def _tag_clip(self, index):
+        entry = self.entryAt(index)
+        if entry is not None and editTags(
+                entry['name'], entry['dir'], entry['type']):
+            self.clipTagged.emit()
+
+    def right_click(self, pos):
+        index = QtCore.QPersistentModelIndex(self.indexAt(pos))
+        if not index.isValid():
+            return
+        self._setHover(QtCore.QModelIndex())
+        menu = QtWidgets.QMenu()
+        menu.setStyleSheet(hou.qt.styleSheet())
+
+        select_option = menu.addAction('Select')
+        menu.addSeparator()
+        delete_option = menu.addAction('Delete')
+        rename_option = menu.addAction('Rename')
+        tags_option = menu.addAction('Edit Tags')
+
+        action = menu.exec_(self.viewport().mapToGlobal(pos))
+        if not index.isValid():
+            return
+        if action == select_option:
+            self._sel_clip(QtCore.QModelIndex(index))
+        elif action == delete_option:
+            self._del_clip(QtCore.QModelIndex(index))
+        elif action == rename_option:
+            self._rename_clip(QtCore.QModelIndex(index))
+        elif action == tags_option:
+            self._tag_clip(QtCore.QModelIndex(index))